@@ -0,0 +1,569 @@
+#!/usr/bin/env python3
+"""
+Archival of pScheduler results to one or more archiver endpoints.
+
+ArchivalQueue uploads in the background, one worker per ArchiverClient, so
+a slow archiver never delays the next test; uploads can be batched into one
+gzip-compressed request. Uploads that fail (or miss the drain deadline) go
+to ArchiveOutbox, a SQLite table of pointers to the stored results, and are
+replayed with a stable idempotency key on the next run.
+"""
+import gzip
+import hashlib
+import logging
+import os
+import queue
+import sqlite3
+import threading
+import time
+from typing import List, Optional
+
+import requests
+
+from archiver_client.archiver_client import ArchiverClient, NodeRef, MeasurementRequest, ArchiverError, ArchiverHTTPError
+from result_store import json_dumps, json_loads, load_stored_result
+
+# Blocks the runner adds to a result before archiving it (run parameters and
+# the summary). They are not in the stored file, so the outbox keeps them.
+RUNNER_BLOCKS = ("runner", "runner-summary")
+
+
+def _category_to_method_name(category: str) -> str:
+    # map category to ArchiverClient method
+    return {
+        "latency": "create_latency_measurement",
+        "rtt": "create_rtt_measurement",
+        "throughput": "create_throughput_measurement",
+        "trace": "create_trace_measurement",
+        "mtu": "create_mtu_measurement",
+        "clock": "create_clock_measurement",
+    }[category]
+
+
+def build_archiver_clients(archiver_urls: List[str], auth_token: str) -> dict:
+    """
+    Create one ArchiverClient per URL for connection reuse across the run.
+    Returns a dict mapping base_url -> ArchiverClient.
+    """
+    clients = {}
+    for url in archiver_urls:
+        clients[url] = ArchiverClient(base_url=url, bearer_token=auth_token, verify=False)
+    return clients
+
+
+def build_measurement_request(raw_json: dict, src: NodeRef, dst: NodeRef, reverse: bool) -> MeasurementRequest:
+    direction = "reverse" if reverse else "forward"
+    return MeasurementRequest(
+        src=src,
+        dst=dst,
+        direction=direction,
+        raw=raw_json,
+    )
+
+
+def _send_measurement(client: ArchiverClient, base_url: str, category: str, req: MeasurementRequest,
+                      logger: logging.Logger, idempotency_key: Optional[str] = None) -> Optional[str]:
+    """
+    POST one measurement to one archiver. Errors are logged, never raised.
+    Returns None on success, otherwise a short error description.
+    """
+    method_name = _category_to_method_name(category)
+    try:
+        method = getattr(client, method_name)
+        resp = method(req, upsert=True, idempotency_key=idempotency_key)
+        logger.info(f"Archived to {base_url} [{category}] OK: {resp if resp else 'no-content'}")
+        return None
+    except ArchiverHTTPError as e:
+        logger.error(f"Archiver HTTP error ({base_url}): {e.status} {e.payload}")
+        return f"HTTP {e.status}"
+    except ArchiverError as e:
+        logger.error(f"Archiver client error ({base_url}): {e}")
+        return str(e)
+    except Exception as e:
+        logger.exception(f"Unexpected archiver error ({base_url}): {e}")
+        return f"unexpected: {e}"
+
+
+# Archiver answers meaning "no batch endpoint here": fall back to one request per item
+_NO_BATCH_STATUS = {404, 405, 415, 501}
+
+
+def _send_measurement_batch(client: ArchiverClient, base_url: str, items: list,
+                            logger: logging.Logger) -> Optional[List[Optional[str]]]:
+    """
+    POST several measurements in one gzip-compressed request to
+    <base_url>/measurements/batch?upsert=true with the body
+
+        {"items": [{"category": ..., "idempotency_key": ..., "measurement": {...}}, ...]}
+
+    *items* are (category, MeasurementRequest, idempotency_key) tuples. Returns
+    one error string (or None) per item, or None when the archiver has no
+    batch endpoint. A {"results": [{"status": <http status>, "error": ...}]}
+    response is applied per item; any other 2xx response leaves the outcome
+    unknown, so every item counts as failed (and is replayed with its
+    idempotency key).
+    """
+    body = {
+        "items": [
+            {"category": category, "idempotency_key": key, "measurement": req.to_payload()}
+            for category, req, key in items
+        ]
+    }
+    headers = {
+        "Content-Type": "application/json",
+        "Content-Encoding": "gzip",
+        "Accept": "application/json",
+        "User-Agent": client.user_agent,
+    }
+    if client.bearer_token:
+        headers["Authorization"] = f"Bearer {client.bearer_token}"
+    if client.api_key:
+        headers["X-API-Key"] = client.api_key
+    try:
+        resp = client.session.post(
+            f"{client.base_url}/measurements/batch", params={"upsert": "true"},
+            data=gzip.compress(json_dumps(body)), headers=headers, timeout=client.timeout, verify=client.verify,
+        )
+    except requests.RequestException as e:
+        logger.error(f"Archiver batch error ({base_url}): {e}")
+        return [f"batch: {e}"] * len(items)
+    if resp.status_code in _NO_BATCH_STATUS:
+        return None
+    if not 200 <= resp.status_code < 300:
+        logger.error(f"Archiver batch HTTP error ({base_url}): {resp.status_code} {resp.text[:300]}")
+        return [f"HTTP {resp.status_code}"] * len(items)
+
+    try:
+        results = resp.json().get("results")
+    except (ValueError, AttributeError):
+        results = None
+    if not isinstance(results, list) or len(results) != len(items):
+        logger.error(f"Archiver batch ({base_url}): unexpected response {resp.text[:300]}")
+        errors = ["batch: unexpected response"] * len(items)
+    else:
+        errors = [
+            None if 200 <= int(r.get("status", 200)) < 300 else (r.get("error") or f"HTTP {r.get('status')}")
+            for r in results
+        ]
+    failed = sum(e is not None for e in errors)
+    logger.info(f"Archived batch to {base_url}: {len(items) - failed} OK, {failed} failed")
+    return errors
+
+
+def archive_result_to_endpoints(
+    archiver_clients: dict,
+    category: str,
+    raw_json: dict,
+    src: NodeRef,
+    dst: NodeRef,
+    reverse: bool,
+    logger: logging.Logger,
+) -> None:
+    """
+    Sends the raw pscheduler JSON to each archiver using pre-built clients.
+    """
+    req = build_measurement_request(raw_json, src, dst, reverse)
+    for base_url, client in archiver_clients.items():
+        _send_measurement(client, base_url, category, req, logger)
+
+
+class ArchiveOutbox:
+    """
+    Persistent per-endpoint outbox for measurements that could not be archived.
+
+    Rows are pointers to the result already saved on disk — a result file or
+    a segment record reference — (plus the
+    src/dst/direction needed to rebuild the MeasurementRequest, and the
+    RUNNER_BLOCKS added to it), so the outbox stays small and a replay sends
+    the same body as the original upload. Each (endpoint, result_path, direction) is stored once; a
+    repeated failure only bumps its attempt counter. Replays post with
+    upsert=True and a stable Idempotency-Key, so a result that did reach the
+    archiver before the connection dropped is not duplicated.
+    """
+
+    def __init__(self, db_path: str, logger: logging.Logger):
+        self.db_path = db_path
+        self.logger = logger
+        os.makedirs(os.path.dirname(db_path) or ".", exist_ok=True)
+        # Shared by the archival worker threads; every access holds self._lock
+        self._conn = sqlite3.connect(db_path, check_same_thread=False, isolation_level=None)
+        self._lock = threading.Lock()
+        with self._lock:
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.execute(
+                """
+                CREATE TABLE IF NOT EXISTS outbox (
+                    id INTEGER PRIMARY KEY AUTOINCREMENT,
+                    endpoint TEXT NOT NULL,
+                    category TEXT NOT NULL,
+                    result_path TEXT NOT NULL,
+                    direction TEXT NOT NULL,
+                    src_ip TEXT, src_name TEXT,
+                    dst_ip TEXT, dst_name TEXT,
+                    created REAL NOT NULL,
+                    attempts INTEGER NOT NULL DEFAULT 1,
+                    last_error TEXT,
+                    extra TEXT,
+                    UNIQUE (endpoint, result_path, direction)
+                )
+                """
+            )
+            columns = {row[1] for row in self._conn.execute("PRAGMA table_info(outbox)")}
+            if "extra" not in columns:
+                # Outboxes created before RUNNER_BLOCKS were kept
+                self._conn.execute("ALTER TABLE outbox ADD COLUMN extra TEXT")
+
+    @staticmethod
+    def idempotency_key(endpoint: str, result_path: str, direction: str) -> str:
+        return hashlib.sha256(f"{endpoint}|{os.path.abspath(result_path)}|{direction}".encode()).hexdigest()
+
+    def add(self, endpoint: str, category: str, result_path: str, req: MeasurementRequest, error: str) -> None:
+        """Record (or re-record) a failed upload."""
+        extra = {k: req.raw[k] for k in RUNNER_BLOCKS if isinstance(req.raw, dict) and k in req.raw}
+        with self._lock:
+            if self._conn is None:
+                return
+            self._conn.execute(
+                """
+                INSERT INTO outbox (endpoint, category, result_path, direction,
+                                    src_ip, src_name, dst_ip, dst_name, created, last_error, extra)
+                VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+                ON CONFLICT (endpoint, result_path, direction)
+                DO UPDATE SET attempts = attempts + 1, last_error = excluded.last_error
+                """,
+                (endpoint, category, result_path, req.direction or "forward",
+                 req.src.ip, req.src.name, req.dst.ip, req.dst.name, time.time(), error,
+                 json_dumps(extra).decode() if extra else None),
+            )
+
+    def remove(self, row_id: int) -> None:
+        with self._lock:
+            if self._conn is None:
+                return
+            self._conn.execute("DELETE FROM outbox WHERE id = ?", (row_id,))
+
+    def discard(self, endpoint: str, result_path: str, direction: str) -> None:
+        """Remove the entry for an upload that turned out to succeed after all."""
+        with self._lock:
+            if self._conn is None:
+                return
+            self._conn.execute(
+                "DELETE FROM outbox WHERE endpoint = ? AND result_path = ? AND direction = ?",
+                (endpoint, result_path, direction),
+            )
+
+    def expire(self, max_age_s: float) -> int:
+        """Drop entries older than *max_age_s*; returns how many were dropped."""
+        with self._lock:
+            cur = self._conn.execute("DELETE FROM outbox WHERE created < ?", (time.time() - max_age_s,))
+            return cur.rowcount
+
+    def pending(self, endpoint: str, limit: int) -> list:
+        """Oldest-first rows for one endpoint, as dicts."""
+        with self._lock:
+            cur = self._conn.execute(
+                "SELECT * FROM outbox WHERE endpoint = ? ORDER BY created LIMIT ?", (endpoint, limit)
+            )
+            cols = [c[0] for c in cur.description]
+            return [dict(zip(cols, row)) for row in cur.fetchall()]
+
+    def depth(self) -> dict:
+        """Number of queued entries per endpoint."""
+        with self._lock:
+            return dict(self._conn.execute("SELECT endpoint, COUNT(*) FROM outbox GROUP BY endpoint").fetchall())
+
+    def close(self) -> None:
+        # Workers that missed the drain deadline may still call add()/remove()
+        with self._lock:
+            self._conn.close()
+            self._conn = None
+
+
+class ArchivalQueue:
+    """
+    Background archival decoupled from test execution.
+
+    One worker thread (and one queue) per ArchiverClient, so a slow endpoint
+    only delays its own uploads and never the next test. Each client is only
+    ever used by its own worker, which keeps the underlying requests.Session
+    single-threaded. Call drain() once at the end of the run.
+
+    With an ArchiveOutbox attached, failed uploads are recorded there, and
+    replay_outbox() queues earlier failures ahead of the new results.
+
+    With *batch_size* > 1, new results are held back and posted up to
+    *batch_size* at a time as one gzip-compressed request (see
+    _send_measurement_batch); wait() flushes what is left. Endpoints without
+    a batch endpoint fall back to one request per result. Outbox replays are
+    always sent one by one.
+    """
+
+    # Queue marker: post the results accumulated so far
+    _FLUSH = "flush"
+
+    def __init__(self, archiver_clients: dict, logger: logging.Logger, outbox: Optional[ArchiveOutbox] = None,
+                 batch_size: int = 0):
+        self.logger = logger
+        self.outbox = outbox
+        self.batch_size = batch_size
+        self._batch_unsupported = set()
+        self._queues = {url: queue.Queue() for url in archiver_clients}
+        # New results held for the next batched request; guarded by _lock so
+        # wait() can park them when the deadline passes
+        self._batches = {url: [] for url in archiver_clients}
+        # Items a worker is posting right now, and the new results among them
+        # that wait() parked in the outbox anyway (see _park_unsent)
+        self._inflight = {url: [] for url in archiver_clients}
+        self._parked = set()
+        self._stats = {url: self._new_stats() for url in archiver_clients}
+        self._replay_halted = set()
+        self._lock = threading.Lock()
+        self._workers = {}
+        for url, client in archiver_clients.items():
+            t = threading.Thread(
+                target=self._worker, args=(url, client), name=f"archiver-{url}", daemon=True
+            )
+            t.start()
+            self._workers[url] = t
+
+    @staticmethod
+    def _new_stats() -> dict:
+        return {"ok": 0, "failed": 0, "replayed": 0, "send_s": 0.0, "send_max_s": 0.0}
+
+    def submit(self, category: str, req: MeasurementRequest, result_path: Optional[str] = None) -> None:
+        """Queue one measurement for every endpoint; returns immediately."""
+        for q in self._queues.values():
+            q.put((category, req, result_path, None))
+
+    def replay_outbox(self, batch_size: int) -> int:
+        """
+        Queue up to *batch_size* of the oldest outbox rows per endpoint. The
+        result JSON is only loaded by the worker right before posting. Returns
+        the number of rows queued.
+        """
+        if self.outbox is None:
+            return 0
+        queued = 0
+        for url, q in self._queues.items():
+            for row in self.outbox.pending(url, batch_size):
+                q.put((row["category"], None, row["result_path"], row))
+                queued += 1
+        return queued
+
+    def _load_outbox_request(self, row: dict) -> Optional[MeasurementRequest]:
+        try:
+            raw = load_stored_result(row["result_path"])
+        except Exception as e:
+            self.logger.warning(f"Outbox: dropping entry for unreadable result {row['result_path']}: {e}")
+            return None
+        if row.get("extra"):
+            raw = {**raw, **json_loads(row["extra"])}
+        return MeasurementRequest(
+            src=NodeRef(ip=row["src_ip"], name=row["src_name"]),
+            dst=NodeRef(ip=row["dst_ip"], name=row["dst_name"]),
+            direction=row["direction"],
+            raw=raw,
+        )
+
+    def _worker(self, base_url: str, client: ArchiverClient) -> None:
+        q = self._queues[base_url]
+        while True:
+            item = q.get()
+            if item is None or item == self._FLUSH:
+                try:
+                    self._flush(base_url, client, q)
+                finally:
+                    q.task_done()
+                if item is None:
+                    return
+                continue
+            if self.batch_size > 1 and item[3] is None:
+                # task_done() for these is called once they are posted (or parked)
+                with self._lock:
+                    batch = self._batches[base_url]
+                    batch.append(item)
+                    full = len(batch) >= self.batch_size
+                if full:
+                    self._flush(base_url, client, q)
+                continue
+            with self._lock:
+                self._inflight[base_url] = [item]
+            try:
+                self._process(base_url, client, *item)
+            finally:
+                with self._lock:
+                    self._inflight[base_url] = []
+                q.task_done()
+
+    def _flush(self, base_url: str, client: ArchiverClient, q: queue.Queue) -> None:
+        with self._lock:
+            items = self._batches[base_url]
+            self._batches[base_url] = []
+            self._inflight[base_url] = list(items)
+        try:
+            if len(items) > 1 and base_url not in self._batch_unsupported:
+                if self._send_batch(base_url, client, items):
+                    return
+            for item in items:
+                self._process(base_url, client, *item)
+        finally:
+            with self._lock:
+                self._inflight[base_url] = []
+            for _ in items:
+                q.task_done()
+
+    def _send_batch(self, base_url: str, client: ArchiverClient, items: list) -> bool:
+        """
+        Post *items* (new results only) in one request. Returns False, and
+        stops batching for this endpoint, if it has no batch endpoint.
+        """
+        keys = [
+            ArchiveOutbox.idempotency_key(base_url, result_path, req.direction or "forward") if result_path else None
+            for _, req, result_path, _ in items
+        ]
+        started = time.monotonic()
+        errors = _send_measurement_batch(
+            client, base_url, [(category, req, key) for (category, req, _, _), key in zip(items, keys)], self.logger
+        )
+        elapsed = time.monotonic() - started
+        if errors is None:
+            self.logger.info(f"Archiver {base_url} has no batch endpoint; sending one request per result")
+            self._batch_unsupported.add(base_url)
+            return False
+        self._add_send_time(base_url, elapsed)
+        for (category, req, result_path, row), error in zip(items, errors):
+            self._settle(base_url, category, req, result_path, row, error)
+        return True
+
+    def _process(self, base_url: str, client: ArchiverClient, category: str,
+                 req: Optional[MeasurementRequest], result_path: Optional[str], row: Optional[dict]) -> None:
+        if row is not None:
+            # An earlier replay to this endpoint failed; it is still down,
+            # so leave the remaining backlog for the next run.
+            if base_url in self._replay_halted:
+                return
+            req = self._load_outbox_request(row)
+            if req is None:
+                self.outbox.remove(row["id"])
+                return
+
+        key = None
+        if result_path:
+            key = ArchiveOutbox.idempotency_key(base_url, result_path, req.direction or "forward")
+        started = time.monotonic()
+        error = _send_measurement(client, base_url, category, req, self.logger, idempotency_key=key)
+        self._add_send_time(base_url, time.monotonic() - started)
+        self._settle(base_url, category, req, result_path, row, error)
+
+    def _add_send_time(self, base_url: str, elapsed: float) -> None:
+        with self._lock:
+            stats = self._stats[base_url]
+            stats["send_s"] = round(stats["send_s"] + elapsed, 3)
+            stats["send_max_s"] = round(max(stats["send_max_s"], elapsed), 3)
+
+    def _settle(self, base_url: str, category: str, req: MeasurementRequest, result_path: Optional[str],
+                row: Optional[dict], error: Optional[str]) -> None:
+        """Count one upload and update the outbox accordingly."""
+        with self._lock:
+            if error is None:
+                self._stats[base_url]["replayed" if row is not None else "ok"] += 1
+            else:
+                self._stats[base_url]["failed"] += 1
+                if row is not None:
+                    self._replay_halted.add(base_url)
+            self._inflight[base_url] = [i for i in self._inflight[base_url] if i[2] != result_path]
+            parked = (base_url, result_path) in self._parked
+            self._parked.discard((base_url, result_path))
+
+        if self.outbox is None or not result_path:
+            return
+        if error is None and row is not None:
+            self.outbox.remove(row["id"])
+        elif error is None and parked:
+            # wait() parked it while it was in flight; it did arrive
+            self.outbox.discard(base_url, result_path, req.direction or "forward")
+        elif error is not None:
+            self.outbox.add(base_url, category, result_path, req, error)
+
+    def _park_unsent(self, base_url: str) -> int:
+        """
+        Empty a timed-out endpoint's queue and its held batch, moving new
+        results into the outbox (replayed rows are already there). New
+        results still in flight are recorded too, since the process may exit
+        before their upload ends; if it does succeed, _settle() removes the
+        entry again. Queue markers (flush/stop) are put back. Call with _lock
+        held. Returns the number of items left, including the ones in flight.
+        """
+        q = self._queues[base_url]
+        items = self._batches[base_url]
+        self._batches[base_url] = []
+        markers = []
+        while True:
+            try:
+                item = q.get_nowait()
+            except queue.Empty:
+                break
+            if item is None or item == self._FLUSH:
+                markers.append(item)
+            else:
+                items.append(item)
+        for _ in range(len(items) + len(markers)):
+            q.task_done()
+        for category, req, result_path, row in items:
+            if row is None and result_path and self.outbox is not None:
+                self.outbox.add(base_url, category, result_path, req, "not sent before drain deadline")
+        for category, req, result_path, row in self._inflight[base_url]:
+            if row is None and result_path and self.outbox is not None:
+                self.outbox.add(base_url, category, result_path, req, "not confirmed before drain deadline")
+                self._parked.add((base_url, result_path))
+        # Whatever is still counted now is in flight
+        left = len(items) + q.unfinished_tasks
+        for marker in markers:
+            q.put(marker)
+        return left
+
+    def wait(self, timeout: float) -> dict:
+        """
+        Wait up to *timeout* seconds (shared across all endpoints) for every
+        queue to go idle. Workers keep running afterwards, so a long-lived
+        process can call this once per run. Unsent and in-flight results of
+        endpoints that missed the deadline are recorded in the outbox.
+
+        Returns a dict mapping base_url -> {"ok", "failed", "replayed", "send_s",
+        "send_max_s", "pending", "status"} for the work done since the previous
+        call, where send_s is the total upload time and status is "complete"
+        or "timed-out".
+        """
+        if self.batch_size > 1:
+            for q in self._queues.values():
+                q.put(self._FLUSH)
+        deadline = time.monotonic() + max(0.0, timeout)
+        while time.monotonic() < deadline:
+            if all(q.unfinished_tasks == 0 for q in self._queues.values()):
+                break
+            time.sleep(0.2)
+
+        results = {}
+        with self._lock:
+            for url, q in self._queues.items():
+                busy = q.unfinished_tasks > 0
+                pending = self._park_unsent(url) if busy else 0
+                results[url] = {
+                    **self._stats[url],
+                    "pending": pending,
+                    "status": "timed-out" if busy else "complete",
+                }
+                self._stats[url] = self._new_stats()
+            self._replay_halted.clear()
+        return results
+
+    def close(self) -> None:
+        """Stop the workers once their queues are empty (does not wait)."""
+        for q in self._queues.values():
+            q.put(None)
+
+    def drain(self, timeout: float) -> dict:
+        """wait() for the queues, then stop the workers."""
+        results = self.wait(timeout)
+        self.close()
+        return results
@@ -0,0 +1,116 @@
+#!/usr/bin/env python3
+"""
+CPU and NUMA placement for bandwidth-heavy test tools.
+
+A placement spec is one of:
+
+  2-3,6    these CPUs
+  node:1   the CPUs of NUMA node 1
+  auto     the CPUs of the NUMA node the test's NIC is attached to
+
+resolve_placement() turns a spec into {"spec", "cpus", "numa_node"}, limited
+to the CPUs this process may run on. run_direct_tools.py applies it with
+iperf3 -A (single CPU) or sched_setaffinity on the child, plus numactl
+--membind when available; the pScheduler runner passes the first CPU as
+the throughput test's client-cpu-affinity.
+"""
+import os
+import re
+import shutil
+from typing import List, Optional
+
+from throughput_lease import interface_for
+
+SYS_NODE_DIR = "/sys/devices/system/node"
+SYS_NET_DIR = "/sys/class/net"
+PROC_ROUTE = "/proc/net/route"
+
+
+def parse_cpu_list(text: str) -> List[int]:
+    """Kernel-style CPU list ("0-3,8,10-11") to a sorted list of CPU numbers."""
+    cpus = set()
+    for part in text.strip().split(","):
+        if not part:
+            continue
+        first, _, last = part.partition("-")
+        if not first.isdigit() or (last and not last.isdigit()):
+            raise ValueError(f"invalid CPU list: {text!r}")
+        cpus.update(range(int(first), int(last or first) + 1))
+    return sorted(cpus)
+
+
+def numa_node_cpus(node: int) -> List[int]:
+    with open(os.path.join(SYS_NODE_DIR, f"node{node}", "cpulist")) as f:
+        return parse_cpu_list(f.read())
+
+
+def _default_route_interface() -> Optional[str]:
+    try:
+        with open(PROC_ROUTE) as f:
+            for line in f.readlines()[1:]:
+                fields = line.split()
+                if len(fields) > 1 and fields[1] == "00000000":
+                    return fields[0]
+    except OSError:
+        pass
+    return None
+
+
+def source_interface(source: Optional[str]) -> Optional[str]:
+    """
+    Interface a test bound to *source* (an IP or interface name) leaves
+    through; unbound tests use the default route. None if unknown.
+    """
+    if source and os.path.isdir(os.path.join(SYS_NET_DIR, source)):
+        return source
+    # interface_for() folds the default-route NIC into its "default" lease key
+    ifname = interface_for(source)
+    return _default_route_interface() if ifname == "default" else ifname
+
+
+def nic_numa_node(ifname: Optional[str]) -> Optional[int]:
+    """NUMA node a NIC's PCI device sits on; None if unknown or not NUMA."""
+    if not ifname:
+        return None
+    try:
+        with open(os.path.join(SYS_NET_DIR, ifname, "device", "numa_node")) as f:
+            node = int(f.read().strip())
+    except (OSError, ValueError):
+        return None
+    return node if node >= 0 else None
+
+
+def resolve_placement(spec: str, ifname: Optional[str] = None) -> Optional[dict]:
+    """
+    Resolve a placement *spec* (see module docstring) for a test leaving
+    through *ifname*. Returns None for "auto" when the NIC's node is unknown.
+    Raises ValueError for a bad spec or one that leaves no usable CPU.
+    """
+    spec = spec.strip()
+    node = None
+    if spec == "auto":
+        node = nic_numa_node(ifname)
+        if node is None:
+            return None
+        cpus = numa_node_cpus(node)
+    elif spec.startswith("node:"):
+        if not re.fullmatch(r"node:\d+", spec):
+            raise ValueError(f"invalid NUMA node spec: {spec!r}")
+        node = int(spec[len("node:"):])
+        try:
+            cpus = numa_node_cpus(node)
+        except OSError:
+            raise ValueError(f"NUMA node {node} does not exist")
+    else:
+        cpus = parse_cpu_list(spec)
+    usable = sorted(set(cpus) & os.sched_getaffinity(0))
+    if not usable:
+        raise ValueError(f"placement {spec!r} leaves no CPU this process may use")
+    return {"spec": spec, "cpus": usable, "numa_node": node}
+
+
+def numactl_prefix(numa_node: Optional[int]) -> List[str]:
+    """numactl command prefix binding memory to *numa_node*, or [] without numactl or node."""
+    if numa_node is None or shutil.which("numactl") is None:
+        return []
+    return ["numactl", f"--membind={numa_node}"]
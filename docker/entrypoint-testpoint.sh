@@ -9,8 +9,15 @@ fi
 
 # --- Read configuration from environment ---
 CRON_EXPRESSION="${CRON_EXPRESSION:-0 */6 * * *}"
+# RUNNER_MODE: "cron" launches a fresh runner per interval; "daemon" keeps one
+# resident runner process that follows CRON_EXPRESSION itself.
+RUNNER_MODE="${RUNNER_MODE:-cron}"
 ARCHIVE_URLS="${ARCHIVE_URLS:-}"
 AUTH_TOKEN="${AUTH_TOKEN:-}"
+# THROUGHPUT_BUDGET: optional daily bytes per destination for throughput tests (e.g. 2G)
+THROUGHPUT_BUDGET="${THROUGHPUT_BUDGET:-}"
+# THROUGHPUT_AFFINITY: optional CPU placement for throughput tests (e.g. 2-3, node:0, auto)
+THROUGHPUT_AFFINITY="${THROUGHPUT_AFFINITY:-}"
 SCRIPT_PATH="/usr/src/app/periodic.py"
 LOG_FILE="/data/pscheduler_cron.log"
 PYTHON_BIN=$(which python3)
@@ -18,13 +25,14 @@ PYTHON_BIN=$(which python3)
 echo "HOSTS: $HOSTS"
 echo "CRON_EXPRESSION: $CRON_EXPRESSION"
 echo "ARCHIVE_URLS: $ARCHIVE_URLS"
+echo "RUNNER_MODE: $RUNNER_MODE"
 
 # --- Set up cron job ---
 mkdir -p /etc/cron.d /data
 
 CRON_FILE=/etc/cron.d/pscheduler_cron
 
-# Build cron command with optional flags
+# Build runner command with optional flags
 CRON_CMD="$PYTHON_BIN $SCRIPT_PATH --hosts $HOSTS --output-dir /data --reverse"
 if [ -n "$ARCHIVE_URLS" ]; then
   CRON_CMD="$CRON_CMD --archiver-urls $ARCHIVE_URLS"
@@ -32,18 +40,56 @@ fi
 if [ -n "$AUTH_TOKEN" ]; then
   CRON_CMD="$CRON_CMD --auth-token $AUTH_TOKEN"
 fi
+if [ -n "$THROUGHPUT_BUDGET" ]; then
+  CRON_CMD="$CRON_CMD --throughput-budget $THROUGHPUT_BUDGET"
+fi
+if [ -n "$THROUGHPUT_AFFINITY" ]; then
+  CRON_CMD="$CRON_CMD --throughput-affinity $THROUGHPUT_AFFINITY"
+fi
 
-# Cron treats '%' as newline — escape them in the command string
-CRON_CMD_ESCAPED="${CRON_CMD//%/\\%}"
-
-# Use /etc/cron.d/ (requires username field; no user crontab to avoid double execution)
 crontab -r 2>/dev/null || true
-echo "$CRON_EXPRESSION root $CRON_CMD_ESCAPED >> $LOG_FILE 2>&1" > "$CRON_FILE"
-echo "" >> "$CRON_FILE"  # trailing newline required by cron
-chmod 0644 "$CRON_FILE"
 
-echo "Cron job registered:"
-cat "$CRON_FILE"
+if [ "$RUNNER_MODE" = "daemon" ]; then
+  # Resident runner: no cron entry, a systemd service follows the schedule instead
+  rm -f "$CRON_FILE"
+  DAEMON_UNIT=/etc/systemd/system/pscheduler-runner-daemon.service
+  # systemd treats '%' as a specifier prefix — escape as '%%'
+  DAEMON_CMD_ESCAPED="${CRON_CMD//%/%%}"
+  cat > "$DAEMON_UNIT" <<UNIT
+[Unit]
+Description=perfSONAR periodic pScheduler runner (daemon mode)
+After=pscheduler-scheduler.service pscheduler-runner.service
+
+[Service]
+ExecStart=$DAEMON_CMD_ESCAPED --daemon --cron "$CRON_EXPRESSION"
+Restart=on-failure
+RestartSec=30
+StandardOutput=append:$LOG_FILE
+StandardError=append:$LOG_FILE
+
+[Install]
+WantedBy=multi-user.target
+UNIT
+  systemctl daemon-reload
+  systemctl enable pscheduler-runner-daemon.service
+  systemctl restart --no-block pscheduler-runner-daemon.service
+
+  echo "Runner daemon registered:"
+  cat "$DAEMON_UNIT"
+else
+  systemctl disable --now pscheduler-runner-daemon.service 2>/dev/null || true
+
+  # Cron treats '%' as newline — escape them in the command string
+  CRON_CMD_ESCAPED="${CRON_CMD//%/\\%}"
+
+  # Use /etc/cron.d/ (requires username field; no user crontab to avoid double execution)
+  echo "$CRON_EXPRESSION root $CRON_CMD_ESCAPED >> $LOG_FILE 2>&1" > "$CRON_FILE"
+  echo "" >> "$CRON_FILE"  # trailing newline required by cron
+  chmod 0644 "$CRON_FILE"
+
+  echo "Cron job registered:"
+  cat "$CRON_FILE"
+fi
 
 # --- Patch pscheduler limits (throughput duration 60 -> 300) ---
 LIMITS_FILE="/etc/pscheduler/limits.conf"
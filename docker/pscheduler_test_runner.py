@@ -1,18 +1,40 @@
 #!/usr/bin/env python3
 import argparse
-import json
 import subprocess
+import threading
 import time
 import os
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from contextlib import contextmanager, nullcontext
+from dataclasses import dataclass, replace
 from datetime import datetime, timezone
+import fcntl
+import heapq
+import random
+import re
 import sys
 import logging
 from typing import List, Optional
 
 
 import netifaces
+import requests
 
-from archiver_client.archiver_client import ArchiverClient, NodeRef, MeasurementRequest, ArchiverError, ArchiverHTTPError
+from archival import ArchivalQueue, ArchiveOutbox, archive_result_to_endpoints, build_archiver_clients, \
+    build_measurement_request
+from cpu_affinity import resolve_placement, source_interface
+from result_store import RunManifest, SegmentStore, iter_manifest_entries, json_dumps, json_loads, read_json_file, \
+    write_json_atomic
+from scheduling import CronSchedule, acquire_run_lock, run_daemon
+from throughput_lease import DEFAULT_LEASE_DIR, LeaseTimeout, ThroughputLease, interface_for, lease_keys
+
+try:
+    import numpy as np  # optional: per-result summary statistics
+except ImportError:
+    np = None
+
+from archiver_client.archiver_client import NodeRef
 
 # Available tests categorized by logical category -> supported tools
 AVAILABLE_TESTS = {
@@ -40,6 +62,51 @@ CUSTOM_TEST_ARGS = {
 # Extra args specifically for iperf3 (only applied when tool == iperf3)
 IPERF_ARGS = ["-i", "10", "-O", "10"]
 
+# Outcomes of a single run_pscheduler_test invocation
+OUTCOME_OK = "ok"          # result saved (and handed to archival)
+OUTCOME_FAILED = "failed"  # command or output failure; not retried
+OUTCOME_RETRY = "retry"    # pScheduler reported succeeded: false
+OUTCOME_SKIPPED = "skipped"  # not started: could not finish before --deadline
+
+# Pre-flight: tools (and, for auto tool selection, categories) that need the
+# destination's pScheduler as a participant
+REMOTE_TOOLS = {"iperf3", "owping", "twping", "halfping", "psclock"}
+REMOTE_CATEGORIES = {"throughput", "latency", "clock"}
+
+# Bandwidth-heavy categories: run under a cross-process lease (throughput_lease.py)
+LEASED_TESTS = {"throughput"}
+
+# Planning: typical seconds per test when no run history exists. pScheduler
+# defaults, replaced by a duration in CUSTOM_TEST_ARGS/IPERF_ARGS if present.
+DEFAULT_TEST_SECONDS = {
+    "latency": 25,
+    "rtt": 10,
+    "throughput": 10,
+    "trace": 30,
+    "mtu": 15,
+    "clock": 5,
+}
+# Planning: pScheduler scheduling + tool setup per task
+PSCHEDULER_OVERHEAD_S = 10
+
+# With --deadline: categories run in this order, so cheap, frequent
+# measurements are not crowded out by long throughput tests
+DEFAULT_PRIORITY = ["latency", "rtt", "clock", "mtu", "trace", "throughput"]
+
+
+def _extract_json_text(text: str) -> str:
+    """
+    The JSON document in `pscheduler task` stdout. Anything printed around it
+    (progress notes on older releases) is dropped without copying the body twice.
+    """
+    start = text.find("{")
+    end = text.rfind("}")
+    if start < 0 or end < start:
+        raise ValueError("no JSON object in pscheduler output")
+    if start == 0 and end == len(text) - 1:
+        return text
+    return text[start:end + 1]
+
 
 def setup_logger(output_dir):
     """Configure logger with file and console output."""
@@ -71,10 +138,13 @@ def setup_logger(output_dir):
     return logger
 
 
-def build_pscheduler_cmd(*, test, tool, host, output_file, reverse, source=None):
+def build_pscheduler_cmd(*, test, tool, host, output_file=None, reverse, source=None, extra_args=None):
     """
     Build a pscheduler command. If tool is None, do NOT include '--tool'
     so that pscheduler chooses automatically.
+    Without output_file the result JSON is printed on stdout (--quiet drops the
+    progress chatter), so the caller can parse it straight from the pipe.
+    extra_args, if given, replaces CUSTOM_TEST_ARGS[test] for this test.
     NOTE: archiver integration is handled by our client afterwards; we do NOT use --archive here.
     """
     base = ["pscheduler", "task"]
@@ -82,13 +152,17 @@ def build_pscheduler_cmd(*, test, tool, host, output_file, reverse, source=None)
     if tool:
         base += ["--tool", tool]
 
-    base += ["--format", "json", "--output", output_file, test, "--dest", host]
+    if output_file:
+        base += ["--format", "json", "--output", output_file, test, "--dest", host]
+    else:
+        base += ["--quiet", "--format", "json", test, "--dest", host]
 
     if source:
         base += ["--source", source]
 
     # Category-level extra args
-    extra_args = CUSTOM_TEST_ARGS.get(test, [])
+    if extra_args is None:
+        extra_args = CUSTOM_TEST_ARGS.get(test, [])
     if extra_args:
         base.extend(extra_args)
 
@@ -103,6 +177,322 @@ def build_pscheduler_cmd(*, test, tool, host, output_file, reverse, source=None)
     return base
 
 
+# CLI flag -> (task spec key, value converter) for the args used above
+_SPEC_FLAGS = {
+    "-P": ("parallel", int),
+    "--parallel": ("parallel", int),
+    "-t": ("duration", lambda v: f"PT{int(v)}S"),
+    "--duration": ("duration", lambda v: v if v.startswith("P") else f"PT{int(v)}S"),
+    "-i": ("interval", lambda v: f"PT{int(v)}S"),
+    "--interval": ("interval", lambda v: v if v.startswith("P") else f"PT{int(v)}S"),
+    "-O": ("omit", lambda v: f"PT{int(v)}S"),
+    "--omit": ("omit", lambda v: v if v.startswith("P") else f"PT{int(v)}S"),
+    "--client-cpu-affinity": ("client-cpu-affinity", int),
+}
+
+# Throughput tools that honour the spec's client-cpu-affinity (iperf3 -A);
+# None is pScheduler's own choice, which then has to pick one of them
+AFFINITY_TOOLS = {None, "iperf3"}
+
+
+def build_pscheduler_task(*, test, tool, host, reverse, source=None, extra_args=None) -> dict:
+    """
+    Build the pScheduler REST API task equivalent of build_pscheduler_cmd(),
+    using the same CUSTOM_TEST_ARGS (or extra_args) / IPERF_ARGS.
+    """
+    spec = {"schema": 1, "dest": host}
+    if source:
+        spec["source"] = source
+
+    cli_args = list(CUSTOM_TEST_ARGS.get(test, []) if extra_args is None else extra_args)
+    if tool == "iperf3":
+        cli_args.extend(IPERF_ARGS)
+    it = iter(cli_args)
+    for flag in it:
+        if flag not in _SPEC_FLAGS:
+            raise ValueError(f"No task spec mapping for pscheduler argument '{flag}'")
+        key, convert = _SPEC_FLAGS[flag]
+        spec[key] = convert(next(it))
+
+    if reverse and test == "throughput":
+        spec["reverse"] = True
+    elif reverse and test == "latency":
+        spec["flip"] = True
+
+    task = {"schema": 1, "test": {"type": test, "spec": spec}, "schedule": {"slip": "PT5M"}}
+    if tool:
+        task["tools"] = [tool]
+    return task
+
+
+class PSchedulerAPIError(Exception):
+    """The pScheduler REST API rejected a task or its run did not finish."""
+
+
+class PSchedulerAPIClient:
+    """
+    In-process client for the pScheduler REST API, replacing a `pscheduler task`
+    process per test: post the task, follow its first run and return the
+    merged result JSON in memory.
+
+    Run polling uses the API's wait-merged long poll, so a finished run is
+    noticed without a tight loop. Until the run is due, polling sleeps toward
+    its start time instead.
+
+    *base_url* defaults to the local API; point it at a stand-in HTTP server
+    to exercise the runner without pScheduler installed.
+    """
+
+    # Run states after which no result will ever appear
+    _TERMINAL_STATES = {"finished", "overdue", "missed", "failed", "preempted", "nonstart", "canceled"}
+
+    def __init__(self, base_url: str = "https://localhost/pscheduler", *, verify: bool = False,
+                 timeout: float = 30.0, poll_interval: float = 2.0, session: Optional[requests.Session] = None):
+        self.base_url = base_url.rstrip("/")
+        self.verify = verify
+        self.timeout = timeout
+        self.poll_interval = poll_interval
+        self.session = session or requests.Session()
+        if not verify:
+            requests.packages.urllib3.disable_warnings(requests.packages.urllib3.exceptions.InsecureRequestWarning)
+
+    def fork(self) -> "PSchedulerAPIClient":
+        """A client with the same settings and its own Session, for use in another thread."""
+        return PSchedulerAPIClient(self.base_url, verify=self.verify, timeout=self.timeout,
+                                   poll_interval=self.poll_interval)
+
+    def _request(self, method: str, url: str, **kwargs):
+        kwargs.setdefault("timeout", self.timeout)
+        resp = self.session.request(method, url, verify=self.verify, **kwargs)
+        if not 200 <= resp.status_code < 300:
+            raise PSchedulerAPIError(f"{method} {url} -> HTTP {resp.status_code}: {resp.text[:300]}")
+        return resp.json()
+
+    def post_task(self, task: dict) -> str:
+        """POST /tasks; returns the new task's URL."""
+        return self._request("POST", f"{self.base_url}/tasks", json=task)
+
+    def first_run_url(self, task_url: str, deadline: float) -> str:
+        """The task's first run URL, once the scheduler has placed it."""
+        while True:
+            runs = self._request("GET", f"{task_url}/runs")
+            if runs:
+                return runs[0]
+            if time.monotonic() >= deadline:
+                raise PSchedulerAPIError(f"No run scheduled for {task_url}")
+            time.sleep(self.poll_interval)
+
+    def wait_for_result(self, run_url: str, deadline: float) -> dict:
+        """Poll a run until it reaches a terminal state; returns the run JSON."""
+        while True:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                raise PSchedulerAPIError(f"Timed out waiting for {run_url}")
+            run = self._request(
+                "GET", run_url, params={"wait-merged": "true"},
+                timeout=min(remaining, self.timeout) + 5,
+            )
+            state = run.get("state")
+            # A finished run may still be merging participant results
+            if state in self._TERMINAL_STATES and (state != "finished" or "result-merged" in run):
+                return run
+            wait = self._until_start(run) if state == "pending" else self.poll_interval
+            time.sleep(min(wait, remaining))
+
+    @staticmethod
+    def _run_time(run: dict, key: str) -> Optional[datetime]:
+        value = run.get(key)
+        if not value:
+            return None
+        try:
+            return datetime.fromisoformat(value.replace("Z", "+00:00"))
+        except ValueError:
+            return None
+
+    def _until_start(self, run: dict) -> float:
+        when = self._run_time(run, "start-time")
+        if when is None:
+            return self.poll_interval
+        return max(self.poll_interval, (when - datetime.now(timezone.utc)).total_seconds())
+
+    def run_task(self, task: dict, timeout: float = 900.0, timing: Optional[dict] = None) -> dict:
+        """
+        Run one task to completion and return its merged result. A run that
+        ends without a result yields {"succeeded": False, "error": ...} so it
+        is handled like a failed CLI result.
+
+        If *timing* is given, the run's scheduling delay (task posted -> run
+        started) and test runtime (run start -> end) are stored in it.
+
+        Only failing to reach the API before the task exists raises
+        requests.ConnectionError; once it is posted, losing the API raises
+        PSchedulerAPIError, since the test may run anyway.
+        """
+        deadline = time.monotonic() + timeout
+        posted = datetime.now(timezone.utc)
+        try:
+            task_url = self.post_task(task)
+        except requests.Timeout as e:
+            if isinstance(e, requests.ConnectTimeout):
+                raise
+            # The request reached the API, so the task may exist
+            raise PSchedulerAPIError(f"No response to POST /tasks: {e}") from e
+        try:
+            run_url = self.first_run_url(task_url, deadline)
+            run = self.wait_for_result(run_url, deadline)
+        except (requests.ConnectionError, requests.Timeout) as e:
+            raise PSchedulerAPIError(f"Lost the API after posting {task_url}: {e}") from e
+        if timing is not None:
+            start, end = self._run_time(run, "start-time"), self._run_time(run, "end-time")
+            if start is not None:
+                timing["schedule_delay_s"] = round(max(0.0, (start - posted).total_seconds()), 3)
+                if end is not None:
+                    timing["test_runtime_s"] = round((end - start).total_seconds(), 3)
+        result = run.get("result-merged")
+        if isinstance(result, dict):
+            return result
+        errors = run.get("errors") or run.get("state-display") or run.get("state")
+        return {"succeeded": False, "error": f"run ended without result: {errors}"}
+
+
+_ISO_DURATION = re.compile(
+    r"^(?P<sign>[+-])?P(?:(?P<d>\d+(?:\.\d+)?)D)?(?:T(?:(?P<h>\d+(?:\.\d+)?)H)?(?:(?P<m>\d+(?:\.\d+)?)M)?(?:(?P<s>\d+(?:\.\d+)?)S)?)?$"
+)
+
+
+def _iso8601_seconds(value) -> Optional[float]:
+    """'PT0.000304S' -> 0.000304, '-PT0.0012S' -> -0.0012 (also accepts plain numbers); None if unparseable."""
+    if isinstance(value, (int, float)):
+        return float(value)
+    if not isinstance(value, str):
+        return None
+    m = _ISO_DURATION.match(value.strip())
+    if not m or not any(m.group(k) for k in ("d", "h", "m", "s")):
+        return None
+    d, h, mi, sec = (float(m.group(k) or 0) for k in ("d", "h", "m", "s"))
+    seconds = d * 86400 + h * 3600 + mi * 60 + sec
+    return -seconds if m.group("sign") == "-" else seconds
+
+
+# Percentiles reported in every distribution summary
+SUMMARY_PERCENTILES = (5, 50, 95, 99)
+
+
+def _distribution(values, weights=None, scale: float = 1.0) -> Optional[dict]:
+    """
+    min/mean/max/stddev and SUMMARY_PERCENTILES of *values* (optionally
+    histogram counts in *weights*), multiplied by *scale*.
+    """
+    v = np.asarray(values, dtype=np.float64) * scale
+    if v.size == 0:
+        return None
+    if weights is None:
+        pct = np.percentile(v, SUMMARY_PERCENTILES)
+        mean, std = v.mean(), v.std()
+    else:
+        w = np.asarray(weights, dtype=np.float64)
+        if w.sum() <= 0:
+            return None
+        order = np.argsort(v)
+        v, w = v[order], w[order]
+        cum = np.cumsum(w)
+        # Nearest-rank percentile on the histogram
+        idx = np.searchsorted(cum, np.asarray(SUMMARY_PERCENTILES) / 100.0 * cum[-1], side="left")
+        pct = v[np.minimum(idx, v.size - 1)]
+        mean = np.average(v, weights=w)
+        std = np.sqrt(np.average((v - mean) ** 2, weights=w))
+    out = {"min": float(v.min()), "mean": float(mean), "max": float(v.max()), "stddev": float(std)}
+    out.update({f"p{p}": float(x) for p, x in zip(SUMMARY_PERCENTILES, pct)})
+    return out
+
+
+def _summarize_throughput(raw: dict) -> dict:
+    intervals = [i.get("summary", {}) for i in raw.get("intervals") or []]
+    # Skip TCP slow-start intervals iperf3 marks as omitted (-O)
+    intervals = [i for i in intervals if not i.get("omitted")]
+    bits = np.array([i.get("throughput-bits", np.nan) for i in intervals], dtype=np.float64)
+    retrans = np.array([i.get("retransmits") or 0 for i in intervals], dtype=np.float64)
+    total = (raw.get("summary") or {}).get("summary") or {}
+    return {
+        "intervals": int(bits.size),
+        "throughput_bps": _distribution(bits[~np.isnan(bits)]),
+        "throughput_bps_total": total.get("throughput-bits"),
+        "retransmits": int(total["retransmits"]) if total.get("retransmits") is not None else int(retrans.sum()),
+        "retransmit_intervals": int(np.count_nonzero(retrans)),
+    }
+
+
+def _summarize_latency(raw: dict) -> dict:
+    hist = raw.get("histogram-latency") or {}
+    buckets = np.array([float(k) for k in hist.keys()], dtype=np.float64)
+    counts = np.array(list(hist.values()), dtype=np.float64)
+    sent = raw.get("packets-sent")
+    lost = raw.get("packets-lost")
+    return {
+        "packets_sent": sent,
+        "packets_received": raw.get("packets-received"),
+        "packets_lost": lost,
+        "loss": (lost / sent) if sent and lost is not None else None,
+        "duplicates": raw.get("packets-duplicated"),
+        "reordered": raw.get("packets-reordered"),
+        "latency_ms": _distribution(buckets, counts) if buckets.size else None,
+        "max_clock_error_ms": raw.get("max-clock-error"),
+    }
+
+
+def _summarize_rtt(raw: dict) -> dict:
+    rtts = [_iso8601_seconds(r.get("rtt")) for r in raw.get("roundtrips") or [] if r.get("rtt")]
+    rtts = [r for r in rtts if r is not None]
+    return {
+        "sent": raw.get("sent"),
+        "received": raw.get("received"),
+        "loss": raw.get("loss"),
+        "rtt_ms": _distribution(rtts, scale=1000.0),
+    }
+
+
+def _summarize_trace(raw: dict, dest: Optional[str]) -> dict:
+    paths = raw.get("paths") or []
+    hop_counts = np.array([len(p) for p in paths], dtype=np.int64)
+    last_hops = [(p[-1] or {}).get("ip") if p else None for p in paths]
+    return {
+        "paths": len(paths),
+        "hop_count": _distribution(hop_counts) if hop_counts.size else None,
+        "reached_dest": any(ip == dest for ip in last_hops) if dest else None,
+        "unique_hops": len({h.get("ip") for p in paths for h in p if h and h.get("ip")}),
+    }
+
+
+def summarize_result(category: str, raw: dict, dest: Optional[str] = None) -> Optional[dict]:
+    """
+    Compact per-result metrics (throughput intervals, latency histograms, ping
+    RTTs, trace hops, MTU, clock offset) so consumers don't have to re-parse the
+    full pScheduler JSON. Returns None when NumPy is missing.
+    """
+    if np is None:
+        return None
+    if category == "throughput":
+        metrics = _summarize_throughput(raw)
+    elif category == "latency":
+        metrics = _summarize_latency(raw)
+    elif category == "rtt":
+        metrics = _summarize_rtt(raw)
+    elif category == "trace":
+        metrics = _summarize_trace(raw, dest)
+    elif category == "mtu":
+        metrics = {"mtu": raw.get("mtu")}
+    elif category == "clock":
+        metrics = {"difference_s": _iso8601_seconds(raw.get("difference"))}
+    else:
+        metrics = {}
+    return {"succeeded": raw.get("succeeded"), **metrics}
+
+
+def _summary_path(output_file: str) -> str:
+    root, _ = os.path.splitext(output_file)
+    return f"{root}.summary.json"
+
+
 def _coalesce(val: Optional[str], fallback: str) -> str:
     return val if val else fallback
 
@@ -169,17 +559,6 @@ def _dst_noderef_from_host(host: str) -> NodeRef:
     return NodeRef(ip=host, name=host)
 
 
-def _category_to_method_name(category: str) -> str:
-    # map category to ArchiverClient method
-    return {
-        "latency": "create_latency_measurement",
-        "rtt": "create_rtt_measurement",
-        "throughput": "create_throughput_measurement",
-        "trace": "create_trace_measurement",
-        "mtu": "create_mtu_measurement",
-        "clock": "create_clock_measurement",
-    }[category]
-
 def _resolve_auth_token(cli_token: Optional[str]) -> Optional[str]:
     """
     Resolve bearer token from:
@@ -191,64 +570,206 @@ def _resolve_auth_token(cli_token: Optional[str]) -> Optional[str]:
     tok = (cli_token or os.environ.get("AUTH_TOKEN") or os.environ.get("ARCHIVER_BEARER") or "").strip()
     return tok or None
 
-def _build_archiver_clients(archiver_urls: List[str], auth_token: str) -> dict:
+
+def _parse_bytes(text: str) -> int:
+    """'2G', '500M', '1.5GB', '750000' -> bytes (decimal units, as link quotas are)."""
+    m = re.fullmatch(r"(\d+(?:\.\d+)?)\s*([KMGT]?)B?", text.strip().upper())
+    if not m:
+        raise ValueError(f"invalid size '{text}' (use e.g. 500M, 2G)")
+    return int(float(m.group(1)) * 1000 ** " KMGT".index(m.group(2) or " "))
+
+
+def _with_arg(args: List[str], flag: str, value: str) -> List[str]:
+    """Copy of *args* with *flag*'s value set to *value* (appended if absent)."""
+    out = list(args)
+    if flag in out:
+        out[out.index(flag) + 1] = value
+    else:
+        out += [flag, value]
+    return out
+
+
+class ThroughputBudget:
     """
-    Create one ArchiverClient per URL for connection reuse across the run.
-    Returns a dict mapping base_url -> ArchiverClient.
+    Daily byte budget per destination for throughput tests, for metered links.
+
+    Before each throughput test, decide() estimates its cost as the highest
+    throughput seen in the last few tests to that destination and direction
+    (or *assumed_rate_bps* before there is any) times the test duration,
+    including the iperf3 omit period. The test runs unchanged if it fits in
+    what is left of today's budget, is shortened (-t) if a test of at least
+    *min_duration* seconds fits, and is skipped otherwise. record() charges the
+    measured bytes, or the estimate when the result has none; failed tests
+    are charged too.
+
+    Usage and recent rates persist in <output-dir>/state/throughput_budget.json;
+    usage resets at UTC midnight. decide() reads the file afresh and record()
+    merges into it under an flock, so a cron run and the daemon sharing the
+    state directory both count each other's traffic.
     """
-    clients = {}
-    for url in archiver_urls:
-        clients[url] = ArchiverClient(base_url=url, bearer_token=auth_token, verify=False)
-    return clients
 
+    RECENT_RATES = 5
 
-def archive_result_to_endpoints(
-    archiver_clients: dict,
-    category: str,
-    raw_json: dict,
-    src: NodeRef,
-    dst: NodeRef,
-    reverse: bool,
-    logger: logging.Logger,
-) -> None:
+    def __init__(self, state_path: str, daily_bytes: int, logger: logging.Logger,
+                 min_duration: float = 10.0, assumed_rate_bps: float = 100e6):
+        self.state_path = state_path
+        self.daily_bytes = daily_bytes
+        self.logger = logger
+        self.min_duration = min_duration
+        self.assumed_rate_bps = assumed_rate_bps
+        self._lock = threading.Lock()
+        self._state = self._load()
+
+    def _load(self) -> dict:
+        try:
+            state = read_json_file(self.state_path)
+        except (OSError, ValueError):
+            state = {}
+        state.setdefault("day", None)
+        state.setdefault("used", {})
+        state.setdefault("rates", {})
+        return state
+
+    @contextmanager
+    def _file_lock(self):
+        """Exclusive flock on <state>.lock, shared by every runner using the state directory."""
+        os.makedirs(os.path.dirname(self.state_path) or ".", exist_ok=True)
+        fd = os.open(f"{self.state_path}.lock", os.O_RDWR | os.O_CREAT, 0o644)
+        try:
+            fcntl.flock(fd, fcntl.LOCK_EX)
+            yield
+        finally:
+            os.close(fd)
+
+    def _roll_day(self) -> None:
+        today = datetime.now(timezone.utc).strftime("%Y%m%d")
+        if self._state["day"] != today:
+            self._state["day"] = today
+            self._state["used"] = {}
+
+    @staticmethod
+    def _seconds(tool: Optional[str], args: List[str]) -> tuple[float, float]:
+        spec = build_pscheduler_task(test="throughput", tool=tool, host="-", reverse=False,
+                                     extra_args=args)["test"]["spec"]
+        duration = _iso8601_seconds(spec.get("duration")) or DEFAULT_TEST_SECONDS["throughput"]
+        return duration, _iso8601_seconds(spec.get("omit")) or 0.0
+
+    def decide(self, dest: str, reverse: bool, tool: Optional[str]) -> dict:
+        """
+        Parameters for the next throughput test to *dest*: a dict with
+        "action" (full/shortened/skip), the pscheduler "args" to use and the
+        estimate behind them.
+        """
+        args = list(CUSTOM_TEST_ARGS.get("throughput", []))
+        duration, omit = self._seconds(tool, args)
+        with self._lock:
+            self._state = self._load()
+            self._roll_day()
+            remaining = max(0, self.daily_bytes - self._state["used"].get(dest, 0))
+            rates = self._state["rates"].get(f"{dest}|{'reverse' if reverse else 'forward'}")
+        rate, basis = (max(rates), "history") if rates else (self.assumed_rate_bps, "assumed")
+
+        decision = {
+            "action": "full",
+            "args": args,
+            "duration_s": duration,
+            "omit_s": omit,
+            "rate_bps": rate,
+            "rate_basis": basis,
+            "estimated_bytes": int(rate * (duration + omit) / 8),
+            "remaining_bytes": remaining,
+            "budget_bytes": self.daily_bytes,
+        }
+        if decision["estimated_bytes"] <= remaining:
+            return decision
+        fits = int(remaining * 8 / rate - omit)
+        if fits >= self.min_duration:
+            decision.update(
+                action="shortened", args=_with_arg(args, "-t", str(fits)), duration_s=float(fits),
+                estimated_bytes=int(rate * (fits + omit) / 8),
+            )
+        else:
+            decision.update(action="skip", args=None)
+        return decision
+
+    @staticmethod
+    def measured(raw: dict) -> tuple[Optional[float], Optional[float]]:
+        """(bits/s, seconds) from a throughput result summary."""
+        total = (raw.get("summary") or {}).get("summary") or {}
+        bits = total.get("throughput-bits")
+        if bits is None:
+            return None, None
+        seconds = (total.get("end") or 0) - (total.get("start") or 0)
+        return float(bits), float(seconds) if seconds > 0 else None
+
+    def record(self, dest: str, reverse: bool, raw: dict, decision: dict, succeeded: bool = True) -> int:
+        """
+        Charge a finished (or failed) test to *dest*'s budget; returns the
+        bytes charged. Only successful tests add to the recent rates.
+        """
+        rate, seconds = self.measured(raw)
+        if rate is None:
+            charged = decision["estimated_bytes"]
+        else:
+            # Omitted (slow-start) intervals carry traffic too
+            charged = int(rate * ((seconds or decision["duration_s"]) + decision["omit_s"]) / 8)
+        with self._lock, self._file_lock():
+            # Merge into the file as it is now: another runner may have charged meanwhile
+            self._state = self._load()
+            self._roll_day()
+            self._state["used"][dest] = self._state["used"].get(dest, 0) + charged
+            if rate and succeeded:
+                key = f"{dest}|{'reverse' if reverse else 'forward'}"
+                self._state["rates"][key] = (self._state["rates"].get(key, []) + [rate])[-self.RECENT_RATES:]
+            write_json_atomic(self.state_path, self._state)
+            used = self._state["used"][dest]
+        self.logger.info(
+            f"Throughput budget {dest}: charged {charged / 1e6:.0f} MB, "
+            f"{used / 1e6:.0f}/{self.daily_bytes / 1e6:.0f} MB used today"
+        )
+        return charged
+
+
+class PhaseTimer:
     """
-    Sends the raw pscheduler JSON to each archiver using pre-built clients.
+    Wall-clock seconds per named phase of one test or run:
+
+        timer = PhaseTimer()
+        with timer.phase("store"):
+            ...
+
+    Re-entering a phase adds to its total.
     """
-    direction = "reverse" if reverse else "forward"
-    req = MeasurementRequest(
-        src=src,
-        dst=dst,
-        direction=direction,
-        raw=raw_json,
-    )
 
-    method_name = _category_to_method_name(category)
+    def __init__(self):
+        self.phases = {}
 
-    for base_url, client in archiver_clients.items():
+    @contextmanager
+    def phase(self, name: str):
+        started = time.monotonic()
         try:
-            method = getattr(client, method_name)
-            resp = method(req, upsert=True)
-            logger.info(f"Archived to {base_url} [{category}] OK: {resp if resp else 'no-content'}")
-        except ArchiverHTTPError as e:
-            logger.error(f"Archiver HTTP error ({base_url}): {e.status} {e.payload}")
-        except ArchiverError as e:
-            logger.error(f"Archiver client error ({base_url}): {e}")
-        except Exception as e:
-            logger.exception(f"Unexpected archiver error ({base_url}): {e}")
-
-def run_checked(cmd, *, timeout=None, logger: logging.Logger = None):
+            yield
+        finally:
+            self.add(name, time.monotonic() - started)
+
+    def add(self, name: str, seconds: float) -> None:
+        self.phases[name] = round(self.phases.get(name, 0.0) + seconds, 4)
+
+
+def run_checked(cmd, *, timeout=None, logger: logging.Logger = None, log_stdout: bool = True):
     try:
         logger.info(f"Running {' '.join(cmd)}")
         cp = subprocess.run(
             cmd,
             check=True,                 # <- raises CalledProcessError on non-zero exit
-            stdout=subprocess.PIPE,     # capture for debugging
+            stdout=subprocess.PIPE,     # captured: debugging, or the result itself
             stderr=subprocess.PIPE,
             text=True,
             timeout=timeout,
         )
         if logger:
-            logger.debug(cp.stdout.strip())
+            # Results can be megabytes; don't copy them into the log
+            logger.debug(cp.stdout.strip() if log_stdout else f"stdout: {len(cp.stdout)} chars")
         return True, cp
     except subprocess.CalledProcessError as e:
         if logger:
@@ -265,6 +786,21 @@ def run_checked(cmd, *, timeout=None, logger: logging.Logger = None):
             logger.error(f"Executable not found: {cmd[0]}")
         return False, e
 
+def _manifest_entry(test: str, tool: Optional[str], dest: str, dst: NodeRef, source: Optional[str],
+                    reverse: bool, attempt: int) -> dict:
+    return {
+        "category": test,
+        "tool": tool if tool else "auto",
+        "dest": dest,
+        "name": dst.name,
+        "source": source,
+        "direction": "reverse" if reverse else "forward",
+        "time": datetime.now(timezone.utc).strftime('%Y%m%d-%H%M%SZ'),
+        "attempt": attempt,
+        "stored": None,
+    }
+
+
 def run_pscheduler_test(
     test: str,
     tool: Optional[str],
@@ -275,95 +811,676 @@ def run_pscheduler_test(
     reverse: bool = False,
     dst_override: Optional[NodeRef] = None,
     source: Optional[str] = None,
+    archive_queue: Optional[ArchivalQueue] = None,
+    api_client: Optional[PSchedulerAPIClient] = None,
+    archive_summary: bool = False,
+    segment_store: Optional[SegmentStore] = None,
+    manifest: Optional[RunManifest] = None,
+    attempt: int = 1,
+    lease_options: Optional[dict] = None,
+    budget: Optional[ThroughputBudget] = None,
+    affinity: Optional[str] = None,
 ):
+    """
+    Run one test and return its OUTCOME_*. Results go to one file per test, or
+    to daily segments when *segment_store* is given. With a *manifest*, every
+    invocation (including failures) is recorded there, with its per-phase
+    timing (see PhaseTimer).
+
+    LEASED_TESTS run under a ThroughputLease on their NIC and destination when
+    *lease_options* (ThroughputLease keyword arguments, including lease_dir) is
+    given; the wait is recorded as "lease_wait_s". A lease that cannot be
+    acquired in time yields OUTCOME_RETRY.
+
+    With a *budget*, throughput tests may be shortened or skipped
+    (OUTCOME_SKIPPED); the decision is recorded as "budget" and archived
+    with the result.
+
+    With an *affinity* placement spec (see cpu_affinity), throughput tests
+    pin the local iperf3 through the task's client-cpu-affinity; the CPU
+    used is recorded as "affinity" and archived with the result.
+    """
     # Parse dest + friendly name
     if dst_override is None:
         dest, dst, _ = _parse_host_spec(host_spec)
     else:
         dest, dst = dst_override.ip, dst_override
 
-    timestamp_utc = datetime.now(timezone.utc).strftime('%Y%m%d-%H%M%SZ')
-    category_dir = os.path.join(output_dir, test)
-    os.makedirs(category_dir, exist_ok=True)
-
-    suffix = "reverse" if reverse else "forward"
-    tool_tag = tool if tool else "auto"
-
-    # Safer filename using both dest ip/host and friendly name
-    def _safe(s: str) -> str:
-        return s.replace(":", "_").replace("/", "_").replace("@", "_").replace("|", "_").replace(",", "_")
+    entry = _manifest_entry(test, tool, dest, dst, source, reverse, attempt)
+    timer = PhaseTimer()
+    started = time.monotonic()
+    outcome = OUTCOME_FAILED
+    lease = nullcontext()
+    if lease_options and test in LEASED_TESTS:
+        lease = ThroughputLease(
+            keys=lease_keys(dest, source), owner=f"pscheduler {test} {dest} {entry['direction']}",
+            logger=logger, **lease_options
+        )
+    try:
+        with lease:
+            if isinstance(lease, ThroughputLease):
+                timer.add("lease_wait", lease.wait_s)
+                entry["lease_wait_s"] = lease.wait_s
+                if lease.recovered:
+                    entry["lease_recovered"] = lease.recovered
+            decision = None
+            if budget is not None and test == "throughput":
+                # Decided under the lease, so concurrent tests see each other's usage
+                decision = budget.decide(dest, reverse, tool)
+                entry["budget"] = decision
+            if decision is not None and decision["action"] == "skip":
+                logger.warning(
+                    f"Throughput budget: skipping {test} to {dest} ({dst.name}) {entry['direction']}: "
+                    f"~{decision['estimated_bytes'] / 1e6:.0f} MB needed, "
+                    f"{decision['remaining_bytes'] / 1e6:.0f} MB left today"
+                )
+                entry["reason"] = "budget"
+                outcome = OUTCOME_SKIPPED
+            else:
+                if decision is not None and decision["action"] == "shortened":
+                    logger.info(f"Throughput budget: shortening {test} to {dest} to {decision['duration_s']:.0f}s")
+                if affinity and test == "throughput" and tool in AFFINITY_TOOLS:
+                    _place_test(entry, affinity, logger)
+                outcome = _run_pscheduler_test(
+                    entry, dst, output_dir, logger, archiver_clients, archive_queue, api_client,
+                    archive_summary, segment_store, timer, budget
+                )
+    except LeaseTimeout as e:
+        logger.warning(f"{test} to {dest} ({dst.name}) not started: {e}")
+        entry["lease_wait_s"] = round(time.monotonic() - started, 3)
+        timer.add("lease_wait", entry["lease_wait_s"])
+        outcome = OUTCOME_RETRY
+    finally:
+        if manifest is not None:
+            entry["status"] = outcome
+            entry["duration_s"] = round(time.monotonic() - started, 3)
+            entry["phases"] = timer.phases
+            manifest.add(entry)
+    return outcome
+
+
+def _place_test(entry: dict, spec: str, logger: logging.Logger) -> None:
+    """
+    Resolve the CPU placement for a test leaving through its source's NIC.
+    pScheduler runs the tool itself and takes a single client CPU, so the
+    first CPU of the placement is used; memory binding is not available.
+    """
+    try:
+        placement = resolve_placement(spec, source_interface(entry["source"]))
+    except ValueError as e:
+        logger.warning(f"CPU affinity {spec!r} for {entry['dest']}: {e}; running unpinned")
+        return
+    if placement is None:
+        logger.debug(f"NUMA node of the NIC for {entry['dest']} unknown; running unpinned")
+        return
+    entry["affinity"] = {**placement, "client_cpu": placement["cpus"][0], "method": "client-cpu-affinity"}
+
+
+def _run_pscheduler_test(entry: dict, dst: NodeRef, output_dir: str, logger: logging.Logger,
+                         archiver_clients: dict, archive_queue: Optional[ArchivalQueue],
+                         api_client: Optional[PSchedulerAPIClient], archive_summary: bool,
+                         segment_store: Optional[SegmentStore], timer: PhaseTimer,
+                         budget: Optional[ThroughputBudget] = None) -> str:
+    test, dest, source, timestamp_utc = entry["category"], entry["dest"], entry["source"], entry["time"]
+    tool = None if entry["tool"] == "auto" else entry["tool"]
+    tool_tag, suffix = entry["tool"], entry["direction"]
+    reverse = suffix == "reverse"
+    decision = entry.get("budget")
+    extra_args = decision["args"] if decision else None
+    affinity = entry.get("affinity")
+    if affinity:
+        extra_args = list(CUSTOM_TEST_ARGS.get(test, []) if extra_args is None else extra_args)
+        extra_args += ["--client-cpu-affinity", str(affinity["client_cpu"])]
+
+    output_file = None
+    if segment_store is None:
+        category_dir = os.path.join(output_dir, test)
+        os.makedirs(category_dir, exist_ok=True)
+
+        # Safer filename using both dest ip/host and friendly name; bound
+        # tests add their source, since interface groups run concurrently
+        def _safe(s: str) -> str:
+            return s.replace(":", "_").replace("/", "_").replace("@", "_").replace("|", "_").replace(",", "_")
+
+        source_tag = f"_src-{_safe(source)}" if source else ""
+        output_file = os.path.join(
+            category_dir,
+            f"{_safe(dst.name)}@{_safe(dest)}_{tool_tag}_{timestamp_utc}_{suffix}{source_tag}.json"
+        )
 
-    output_file = os.path.join(
-        category_dir,
-        f"{_safe(dst.name)}@{_safe(dest)}_{tool_tag}_{timestamp_utc}_{suffix}.json"
-    )
+    def _store(result_json) -> str:
+        """Write the result exactly once; returns its stored reference."""
+        with timer.phase("store"):
+            if segment_store is not None:
+                if isinstance(result_json, str):
+                    result_json = result_json.encode()
+                return segment_store.append(test, {k: v for k, v in entry.items() if k != "stored"}, result_json)
+            with open(output_file, "wb" if isinstance(result_json, bytes) else "w") as f:
+                f.write(result_json)
+            return output_file
 
-    cmd = build_pscheduler_cmd(
-        test=test, tool=tool, host=dest, output_file=output_file, reverse=reverse, source=source
-    )
+    # Result comes back on stdout; it is parsed once and written once below
+    cmd = build_pscheduler_cmd(test=test, tool=tool, host=dest, reverse=reverse, source=source, extra_args=extra_args)
 
     logger.info(f"Running {test} ({'auto' if tool is None else tool}) -> dest={dest} name={dst.name}{' source=' + source if source else ''} reverse={reverse}")
     logger.debug(f"Command: {' '.join(cmd)}")
 
     try:
-        status, exception = run_checked(cmd, logger=logger)
-        #result = subprocess.run(cmd, check=True)
-        if status:
-            logger.info(f"Completed {test} ({tool_tag}) to {dest} ({dst.name}), output: {output_file}")
-        else:
-            logger.error(f"Command failed (exit {status}), exception code: {exception}")
-            return
+        raw = None
+        if api_client is not None:
+            try:
+                task = build_pscheduler_task(
+                    test=test, tool=tool, host=dest, reverse=reverse, source=source, extra_args=extra_args
+                )
+                timing = {}
+                with timer.phase("pscheduler"):
+                    raw = api_client.run_task(task, timing=timing)
+                entry.update(timing)
+            except requests.ConnectionError as e:
+                # Local API unreachable before the task was created — the CLI below is the fallback
+                logger.warning(f"pScheduler API unavailable ({e}); falling back to the CLI")
+            except (PSchedulerAPIError, ValueError) as e:
+                logger.error(f"pScheduler API error for {test} ({tool_tag}) to {dest} ({dst.name}): {e}")
+                return OUTCOME_FAILED
+            else:
+                entry["stored"] = _store(json_dumps(raw))
+                logger.info(f"Completed {test} ({tool_tag}) to {dest} ({dst.name}) via API, output: {entry['stored']}")
+
+        if raw is None:
+            with timer.phase("pscheduler"):
+                status, exception = run_checked(cmd, logger=logger, log_stdout=False)
+            #result = subprocess.run(cmd, check=True)
+            if not status:
+                logger.error(f"Command failed (exit {status}), exception code: {exception}")
+                return OUTCOME_FAILED
 
-        if archiver_clients:
             try:
-                with open(output_file, "r") as f:
-                    raw = json.load(f)
+                with timer.phase("parse"):
+                    text = _extract_json_text(exception.stdout)
+                    raw = json_loads(text)
             except Exception as e:
-                logger.error(f"Could not read output JSON ({output_file}): {e}")
-                return
-
-            # Check if pScheduler reported a test failure (e.g. iperf3 KeyError)
-            if isinstance(raw, dict) and raw.get("succeeded") is False:
-                err_msg = raw.get("error", "unknown error")
-                logger.warning(
-                    f"Test {test} ({tool_tag}) to {dest} ({dst.name}) "
-                    f"failed: {err_msg} — retrying once after 30s"
-                )
-                time.sleep(30)
-                status, exception = run_checked(cmd, logger=logger)
-                if not status:
-                    logger.error(f"Retry also failed (exit {status}): {exception}")
-                    return
-                try:
-                    with open(output_file, "r") as f:
-                        raw = json.load(f)
-                except Exception as e:
-                    logger.error(f"Could not read retry output JSON ({output_file}): {e}")
-                    return
-                if isinstance(raw, dict) and raw.get("succeeded") is False:
-                    logger.error(
-                        f"Retry of {test} ({tool_tag}) to {dest} ({dst.name}) "
-                        f"also failed: {raw.get('error', 'unknown')} — skipping archival"
-                    )
-                    return
-                logger.info(f"Retry succeeded for {test} ({tool_tag}) to {dest} ({dst.name})")
+                logger.error(f"Could not parse pscheduler JSON output for {test} to {dest}: {e}")
+                return OUTCOME_FAILED
+            # Store the text exactly as pscheduler printed it (no re-encode)
+            entry["stored"] = _store(text)
+            del text
+            logger.info(f"Completed {test} ({tool_tag}) to {dest} ({dst.name}), output: {entry['stored']}")
+
+        # Check if pScheduler reported a test failure (e.g. iperf3 KeyError).
+        # The caller decides whether and when to retry; never sleep here.
+        if isinstance(raw, dict) and raw.get("succeeded") is False:
+            err_msg = raw.get("error", "unknown error")
+            logger.warning(f"Test {test} ({tool_tag}) to {dest} ({dst.name}) failed: {err_msg}")
+            if decision is not None:
+                # A failed or partial run still used the link; charge it before any retry
+                decision["charged_bytes"] = budget.record(dest, reverse, raw, decision, succeeded=False)
+            return OUTCOME_RETRY
+
+        runner_info = {}
+        if decision is not None and isinstance(raw, dict):
+            decision["charged_bytes"] = budget.record(dest, reverse, raw, decision)
+            runner_info["throughput-budget"] = decision
+        if affinity:
+            runner_info["cpu-affinity"] = affinity
+        if runner_info and isinstance(raw, dict):
+            # Shallow copy: archive the parameters the runner chose with the result
+            raw = {**raw, "runner": runner_info}
+
+        summary = None
+        if isinstance(raw, dict):
+            try:
+                with timer.phase("summary"):
+                    summary = summarize_result(test, raw, dest)
+            except Exception as e:
+                # A summary is a convenience; never lose the raw result over it
+                logger.warning(f"Could not summarize {entry['stored']}: {e}")
+        if summary is not None:
+            if segment_store is not None:
+                # The manifest line is the summary record in segment mode
+                entry["summary"] = summary
+            summary = {
+                **{k: v for k, v in entry.items() if k not in ("stored", "summary")},
+                "result_file": os.path.basename(entry["stored"]),
+                **summary,
+            }
+            if output_file is not None:
+                with timer.phase("store"), open(_summary_path(output_file), "wb") as f:
+                    f.write(json_dumps(summary))
+            if archive_summary:
+                # Shallow copy: the big arrays stay shared with the saved result
+                raw = {**raw, "runner-summary": summary}
 
+        if archiver_clients:
             if source:
                 # Use explicit source IP for the src NodeRef (multi-network path)
                 src = NodeRef(ip=source, name=_default_src_noderef().name)
             else:
                 src = _default_src_noderef()
-            archive_result_to_endpoints(
-                archiver_clients=archiver_clients,
-                category=test,
-                raw_json=raw,
-                src=src,
-                dst=dst,
-                reverse=reverse,
-                logger=logger,
-            )
+            with timer.phase("archive"):
+                if archive_queue is not None:
+                    # Hand off to the background workers; the next test starts right away
+                    archive_queue.submit(test, build_measurement_request(raw, src, dst, reverse), entry["stored"])
+                else:
+                    archive_result_to_endpoints(
+                        archiver_clients=archiver_clients,
+                        category=test,
+                        raw_json=raw,
+                        src=src,
+                        dst=dst,
+                        reverse=reverse,
+                        logger=logger,
+                    )
+        return OUTCOME_OK
     except subprocess.CalledProcessError as e:
         logger.error(f"Error running {test} ({tool_tag}) on {dest} ({dst.name}): {e}")
+        return OUTCOME_FAILED
+
+
+@dataclass
+class PendingTest:
+    """One pscheduler invocation planned for this run."""
+    test: str
+    tool: Optional[str]
+    host_spec: str
+    dst: NodeRef
+    source: Optional[str] = None
+    reverse: bool = False
+    attempt: int = 1
+
+    def describe(self) -> str:
+        return (f"{self.test} ({self.tool or 'auto'}) to {self.dst.ip} ({self.dst.name})"
+                f"{' reverse' if self.reverse else ''}")
+
+
+@dataclass
+class RetryPolicy:
+    """
+    Re-queue tests whose result reports succeeded: false.
+
+    attempts: retries per test after the first run (0 disables retries)
+    delay:    seconds before the first retry; doubled for each further retry
+    jitter:   up to this many seconds added at random, so retries of tests
+              that failed together do not hit the far end together
+    """
+    attempts: int = 1
+    delay: float = 30.0
+    jitter: float = 5.0
+
+    def backoff(self, attempt: int) -> float:
+        """Delay before running *attempt* (2 = first retry)."""
+        return self.delay * (2 ** max(0, attempt - 2)) + random.uniform(0.0, max(0.0, self.jitter))
+
+
+def run_test_jobs(jobs: List[PendingTest], run_job, retry_policy: RetryPolicy, logger: logging.Logger,
+                  admit=None) -> dict:
+    """
+    Run *jobs* in order, calling run_job(job) -> outcome for each.
+
+    Tests reporting OUTCOME_RETRY are re-queued with the policy's backoff
+    instead of blocking: other queued tests run while a retry waits, and a
+    retry that has come due runs before the next new test. The runner only
+    sleeps when nothing but not-yet-due retries is left.
+
+    If given, admit(job, start_monotonic) -> bool is asked before a test
+    starts and before a retry is queued; refused tests are dropped (the
+    callback records why).
+
+    Returns retry statistics for the run summary.
+    """
+    stats = {"scheduled": 0, "recovered": 0, "exhausted": 0, "skipped": 0, "retry_seconds": 0.0}
+    pending = deque(jobs)
+    retries = []  # heap of (due_monotonic, seq, job)
+    seq = 0
+
+    while pending or retries:
+        now = time.monotonic()
+        if retries and retries[0][0] <= now:
+            job = heapq.heappop(retries)[2]
+        elif pending:
+            job = pending.popleft()
+        else:
+            wait = retries[0][0] - now
+            logger.info(f"Waiting {wait:.0f}s for the next retry ({len(retries)} queued)")
+            time.sleep(wait)
+            stats["retry_seconds"] += wait
+            continue
+
+        if admit is not None and not admit(job, time.monotonic()):
+            stats["skipped"] += 1
+            continue
+
+        started = time.monotonic()
+        outcome = run_job(job)
+        if job.attempt > 1:
+            stats["retry_seconds"] += time.monotonic() - started
+
+        if outcome == OUTCOME_RETRY:
+            if job.attempt <= retry_policy.attempts:
+                retry = replace(job, attempt=job.attempt + 1)
+                delay = retry_policy.backoff(retry.attempt)
+                if admit is not None and not admit(retry, time.monotonic() + delay):
+                    stats["skipped"] += 1
+                    continue
+                seq += 1
+                heapq.heappush(retries, (time.monotonic() + delay, seq, retry))
+                stats["scheduled"] += 1
+                logger.info(f"Retry {job.attempt}/{retry_policy.attempts} of {job.describe()} queued in {delay:.0f}s")
+            else:
+                stats["exhausted"] += 1
+                logger.error(f"{job.describe()} still failing after {job.attempt} attempts — skipping archival")
+        elif outcome == OUTCOME_OK and job.attempt > 1:
+            stats["recovered"] += 1
+            logger.info(f"Retry succeeded for {job.describe()}")
+
+    return stats
+
+
+class DurationEstimator:
+    """
+    Per-test duration estimates for planning a run.
+
+    Uses the median duration of the same test (category, tool, destination,
+    direction) over the newest *history_runs* run manifests, then the median
+    for the category and tool, and finally the configured test duration plus
+    PSCHEDULER_OVERHEAD_S. Retry rates per category come from the same history.
+    """
+
+    def __init__(self, output_dir: str, history_runs: int = 20):
+        self._durations = {}
+        self._tries = {}  # category -> [invocations, retries]
+        for e in iter_manifest_entries(output_dir, last=history_runs):
+            tries = self._tries.setdefault(e.get("category"), [0, 0])
+            tries[0] += 1
+            if e.get("status") == OUTCOME_RETRY:
+                tries[1] += 1
+            if e.get("status") == OUTCOME_OK and e.get("duration_s"):
+                key = (e["category"], e.get("tool"), e.get("dest"), e.get("direction"))
+                self._durations.setdefault(key, []).append(e["duration_s"])
+                self._durations.setdefault(key[:2], []).append(e["duration_s"])
+
+    @staticmethod
+    def configured_seconds(job: PendingTest) -> float:
+        """Test duration implied by CUSTOM_TEST_ARGS/IPERF_ARGS, plus overhead."""
+        spec = build_pscheduler_task(test=job.test, tool=job.tool, host=job.dst.ip, reverse=False)["test"]["spec"]
+        seconds = _iso8601_seconds(spec.get("duration")) or DEFAULT_TEST_SECONDS.get(job.test, 30)
+        seconds += _iso8601_seconds(spec.get("omit")) or 0.0
+        return seconds + PSCHEDULER_OVERHEAD_S
+
+    def estimate(self, job: PendingTest) -> tuple[float, str]:
+        """(seconds, basis) for one run of *job*; basis is "history" or "configured"."""
+        tool = job.tool or "auto"
+        for key in ((job.test, tool, job.dst.ip, "reverse" if job.reverse else "forward"), (job.test, tool)):
+            if key in self._durations:
+                values = sorted(self._durations[key])
+                return values[len(values) // 2], "history"
+        return self.configured_seconds(job), "configured"
+
+    def retry_rate(self, category: str) -> float:
+        runs, retries = self._tries.get(category, (0, 0))
+        return retries / runs if runs else 0.0
+
+
+def order_by_priority(jobs: List[PendingTest], priority: List[str]) -> List[PendingTest]:
+    """Stable sort by category rank in *priority* (unlisted categories last)."""
+    rank = {cat: i for i, cat in enumerate(priority)}
+    return sorted(jobs, key=lambda j: rank.get(j.test, len(rank)))
+
+
+def group_jobs(jobs: List[PendingTest], parallel: bool) -> dict:
+    """
+    Split *jobs* by the NIC their source resolves to (see throughput_lease.interface_for):
+    groups run concurrently, jobs within a group run serially in order.
+    Without *parallel*, everything is one group.
+    """
+    if not parallel:
+        return {"all": list(jobs)} if jobs else {}
+    groups = {}
+    nic_of = {}
+    for job in jobs:
+        if job.source not in nic_of:
+            nic_of[job.source] = interface_for(job.source)
+        groups.setdefault(nic_of[job.source], []).append(job)
+    return groups
+
+
+def plan_run(groups: dict, estimator: DurationEstimator, retry_policy: RetryPolicy) -> dict:
+    """
+    Estimated duration of running the job *groups* from group_jobs(): the
+    plain total, the expectation with historical retry rates, and the worst
+    case where every test uses all its retries. Groups run concurrently, so
+    each figure is that of the longest group.
+    """
+    planned = []
+    totals = []
+    for group, jobs in groups.items():
+        total = expected_retries = 0.0
+        for job in jobs:
+            seconds, basis = estimator.estimate(job)
+            total += seconds
+            expected_retries += estimator.retry_rate(job.test) * seconds * retry_policy.attempts
+            planned.append({"group": group, "job": job.describe(), "estimate_s": round(seconds, 1), "basis": basis})
+        totals.append((total, total + expected_retries))
+    return {
+        "tests": len(planned),
+        "groups": len(groups),
+        "estimate_s": round(max((t for t, _ in totals), default=0.0), 1),
+        "expected_s": round(max((e for _, e in totals), default=0.0), 1),
+        "worst_case_s": round(max((t for t, _ in totals), default=0.0) * (1 + retry_policy.attempts), 1),
+        "jobs": planned,
+    }
+
+
+def _parse_duration(text: str) -> float:
+    """'3600', '90m', '5h', '1h30m' -> seconds."""
+    m = re.fullmatch(r"(?:(\d+(?:\.\d+)?)h)?(?:(\d+(?:\.\d+)?)m)?(?:(\d+(?:\.\d+)?)s?)?", text.strip())
+    if not m or not any(m.groups()):
+        raise ValueError(f"invalid duration '{text}' (use e.g. 3600, 90m, 5h, 1h30m)")
+    h, mi, sec = (float(g or 0) for g in m.groups())
+    return h * 3600 + mi * 60 + sec
+
+
+def _fmt_duration(seconds: float) -> str:
+    seconds = int(round(seconds))
+    h, rem = divmod(seconds, 3600)
+    return f"{h}h{rem // 60:02d}m" if h else f"{rem // 60}m{rem % 60:02d}s"
+
+
+def _cron_interval(schedule: "CronSchedule") -> float:
+    first = schedule.next_after(datetime.now().astimezone())
+    return (schedule.next_after(first) - first).total_seconds()
+
+
+def _deadline_seconds(args) -> Optional[float]:
+    """
+    The run's time budget from --deadline: a duration, or "auto" for the time
+    left until the next --cron slot. None without --deadline.
+    """
+    if not args.deadline:
+        return None
+    if args.deadline == "auto":
+        now = datetime.now().astimezone()
+        return (CronSchedule(args.cron).next_after(now) - now).total_seconds()
+    return _parse_duration(args.deadline)
+
+
+def print_plan(args, jobs: List[PendingTest], logger: logging.Logger) -> None:
+    """--plan: print the estimated duration of this run and exit."""
+    retry_policy = RetryPolicy(attempts=args.retry_attempts, delay=args.retry_delay, jitter=args.retry_jitter)
+    estimator = DurationEstimator(args.output_dir)
+    deadline = _deadline_seconds(args)
+    if deadline is not None:
+        jobs = order_by_priority(jobs, args.priority)
+    plan = plan_run(group_jobs(jobs, args.parallel_sources), estimator, retry_policy)
+
+    print(f"\nPlan: {plan['tests']} tests in {plan['groups']} parallel group(s)")
+    elapsed = {}
+    for item in plan["jobs"]:
+        elapsed[item["group"]] = elapsed.get(item["group"], 0.0) + item["estimate_s"]
+        over = deadline is not None and elapsed[item["group"]] > deadline
+        print(f"  {item['estimate_s']:7.0f}s  {item['basis']:<10}  [{item['group']}] {item['job']}"
+              f"{'  (past deadline)' if over else ''}")
+    print(f"\nEstimated: {_fmt_duration(plan['estimate_s'])}, "
+          f"with expected retries {_fmt_duration(plan['expected_s'])}, "
+          f"worst case {_fmt_duration(plan['worst_case_s'])}")
+    try:
+        interval = _cron_interval(CronSchedule(args.cron))
+        verdict = "fits" if plan["expected_s"] <= interval else "OVERRUNS"
+        print(f"Cron interval ('{args.cron}'): {_fmt_duration(interval)} — {verdict}")
+    except ValueError as e:
+        logger.warning(f"Cannot compare with --cron: {e}")
+    if deadline is not None:
+        print(f"Deadline: {_fmt_duration(deadline)} (tests marked 'past deadline' are likely to be skipped)")
+
+
+class PreflightCache:
+    """
+    Probe results on disk (<output-dir>/state/preflight_cache.json), keyed by
+    probe. Positive results are reused for *ttl* seconds, negative and
+    inconclusive ones for *negative_ttl*, so a destination that comes back is
+    retried soon.
+    """
+
+    def __init__(self, path: str, ttl: float, negative_ttl: float):
+        self.path = path
+        self.ttl = ttl
+        self.negative_ttl = negative_ttl
+        try:
+            self._entries = read_json_file(path)
+        except (OSError, ValueError):
+            self._entries = {}
+
+    def get(self, key: str) -> Optional[dict]:
+        entry = self._entries.get(key)
+        if entry is None:
+            return None
+        ttl = self.ttl if entry.get("ok") else self.negative_ttl
+        return entry if time.time() - entry.get("checked", 0) < ttl else None
+
+    def put(self, key: str, ok: Optional[bool], detail: str) -> None:
+        self._entries[key] = {"ok": ok, "detail": detail, "checked": time.time()}
+
+    def save(self) -> None:
+        # Drop entries nobody could reuse any more
+        horizon = time.time() - max(self.ttl, self.negative_ttl)
+        self._entries = {k: v for k, v in self._entries.items() if v.get("checked", 0) >= horizon}
+        write_json_atomic(self.path, self._entries)
+
+
+def _pscheduler_url(host: str) -> str:
+    return f"https://[{host}]/pscheduler" if ":" in host else f"https://{host}/pscheduler"
+
+
+class Preflight:
+    """
+    Parallel pre-flight probes run before any test starts, so unsupported
+    combinations are dropped instead of each burning a full pscheduler timeout:
+
+      source|<ip>        the bound source address is still on a local interface
+      remote|<dest>      the destination's pScheduler API answers
+      tool|local|<tool>  the local pScheduler has the tool
+      tool|<dest>|<tool> the destination's pScheduler has the tool
+
+    A job is only pruned on a definite negative; a probe that cannot tell
+    (e.g. the local API is down) keeps the job. A probe that times out or
+    cannot connect is retried once before it counts, so one dropped packet
+    does not prune a destination for the whole negative TTL.
+    """
+
+    def __init__(self, cache: PreflightCache, local_api: str, logger: logging.Logger,
+                 timeout: float = 5.0, workers: int = 16):
+        self.cache = cache
+        self.local_api = local_api.rstrip("/")
+        self.logger = logger
+        self.timeout = timeout
+        self.workers = workers
+        # requests.Session is not thread-safe; each probe worker gets its own
+        self._local = threading.local()
+
+    @staticmethod
+    def _needs_remote(job: PendingTest) -> bool:
+        return job.tool in REMOTE_TOOLS if job.tool else job.test in REMOTE_CATEGORIES
+
+    def _probes(self, job: PendingTest) -> List[str]:
+        keys = []
+        if job.source:
+            keys.append(f"source|{job.source}")
+        if job.tool:
+            keys.append(f"tool|local|{job.tool}")
+        if self._needs_remote(job):
+            keys.append(f"remote|{job.dst.ip}")
+            if job.tool:
+                keys.append(f"tool|{job.dst.ip}|{job.tool}")
+        return keys
+
+    def _session(self) -> requests.Session:
+        session = getattr(self._local, "session", None)
+        if session is None:
+            session = self._local.session = requests.Session()
+        return session
+
+    def _get(self, url: str) -> requests.Response:
+        try:
+            return self._session().get(url, verify=False, timeout=self.timeout)
+        except (requests.Timeout, requests.ConnectionError):
+            return self._session().get(url, verify=False, timeout=self.timeout)
+
+    def _probe(self, key: str) -> tuple[Optional[bool], str]:
+        kind, _, rest = key.partition("|")
+        if kind == "source":
+            local = {a.get("addr", "").split("%")[0]
+                     for ifname in netifaces.interfaces()
+                     for fam in (netifaces.AF_INET, netifaces.AF_INET6)
+                     for a in netifaces.ifaddresses(ifname).get(fam, [])}
+            return (True, "present") if rest in local else (False, f"source {rest} is not on any interface")
+        if kind == "remote":
+            try:
+                resp = self._get(_pscheduler_url(rest))
+            except requests.RequestException as e:
+                return False, f"pScheduler at {rest} unreachable ({type(e).__name__})"
+            return (True, "reachable") if resp.ok else (False, f"pScheduler at {rest} answered HTTP {resp.status_code}")
+        host, _, tool = rest.partition("|")
+        base = self.local_api if host == "local" else _pscheduler_url(host)
+        try:
+            resp = self._get(f"{base}/tools/{tool}")
+        except requests.RequestException as e:
+            return None, f"could not query tools at {host} ({type(e).__name__})"
+        if resp.status_code == 404:
+            return False, f"tool {tool} not available at {host}"
+        return (True, "available") if resp.ok else (None, f"tools query at {host}: HTTP {resp.status_code}")
+
+    def run(self, jobs: List[PendingTest]) -> tuple[List[PendingTest], list]:
+        """Probe (or reuse cached results) for *jobs*; returns (kept jobs, [(job, reason)])."""
+        needed = {key for job in jobs for key in self._probes(job)}
+        results = {}
+        todo = []
+        for key in needed:
+            cached = self.cache.get(key)
+            if cached is None:
+                todo.append(key)
+            else:
+                results[key] = cached
+        if todo:
+            self.logger.info(f"Pre-flight: probing {len(todo)} items ({len(results)} cached)")
+            with ThreadPoolExecutor(max_workers=min(self.workers, len(todo)), thread_name_prefix="preflight") as pool:
+                futures = {pool.submit(self._probe, key): key for key in todo}
+                for future in as_completed(futures):
+                    key = futures[future]
+                    try:
+                        ok, detail = future.result()
+                    except Exception as e:
+                        ok, detail = None, f"probe error: {e}"
+                    self.cache.put(key, ok, detail)
+                    results[key] = {"ok": ok, "detail": detail}
+            self.cache.save()
+
+        kept, pruned = [], []
+        for job in jobs:
+            failed = [results[k]["detail"] for k in self._probes(job) if results[k]["ok"] is False]
+            if failed:
+                pruned.append((job, failed[0]))
+            else:
+                kept.append(job)
+        return kept, pruned
 
 
 def _split_urls(raw: str) -> list[str]:
@@ -460,7 +1577,50 @@ def _parse_archiver_urls(cli_value: Optional[List[str]]) -> List[str]:
     return deduped
 
 
-def main():
+def _build_test_jobs(args, logger: logging.Logger) -> List[PendingTest]:
+    """
+    Expand hosts x tests x tool mode (x reverse) into the ordered list of
+    pscheduler invocations for this run. Source hints are resolved once per host.
+    """
+    # Prepare subset tool set (if requested)
+    subset_tools = set(args.tools or []) if args.tool_mode == "subset" else None
+
+    jobs: List[PendingTest] = []
+    for host_spec in args.hosts:
+        dest, dst, source_hint = _parse_host_spec(host_spec)
+        source = _resolve_source(source_hint, logger) if source_hint else None
+        if source_hint and source is None:
+            logger.warning(f"Host {host_spec}: could not resolve source '{source_hint}'; proceeding without --source")
+        elif source:
+            logger.info(f"Host {host_spec}: source binding -> {source}")
+        for test in args.tests:
+            supported_tools = AVAILABLE_TESTS.get(test, [])
+
+            if args.tool_mode == "auto":
+                tool = None
+                if test == "throughput":
+                    tool = "iperf3"
+                elif test == "latency":
+                    tool = "halfping"
+                tools = [tool]
+            elif args.tool_mode == "all":
+                tools = supported_tools
+            else:  # subset
+                tools = [t for t in supported_tools if t in subset_tools]
+                if not tools:
+                    logger.warning(
+                        f"No matching tools for test '{test}' with subset {sorted(subset_tools)}; skipping."
+                    )
+                    continue
+
+            for tool in tools:
+                jobs.append(PendingTest(test, tool, host_spec, dst, source=source, reverse=False))
+                if args.reverse and test in ["throughput", "latency"] and tool not in ["halfping"]:
+                    jobs.append(PendingTest(test, tool, host_spec, dst, source=source, reverse=True))
+    return jobs
+
+
+def _build_arg_parser() -> argparse.ArgumentParser:
     parser = argparse.ArgumentParser(
         description="Run pscheduler tests between hosts, save JSON output, and archive to the pscheduler-result-archiver."
     )
@@ -502,7 +1662,137 @@ def main():
         nargs="+",
         help="When --tool-mode=subset, run only these tools (e.g., iperf3 ping twping)"
     )
+    parser.add_argument(
+        "--archive-drain-timeout", type=float, default=300.0,
+        help="Seconds to wait at the end of the run for queued archival uploads (default: 300)"
+    )
+    parser.add_argument(
+        "--archive-batch", type=int, default=0,
+        help="Post up to N results per archiver request, gzip-compressed, via <archiver>/measurements/batch; "
+             "falls back to one request per result if the archiver lacks it (default: 0, off)"
+    )
+    parser.add_argument(
+        "--retry-attempts", type=int, default=1,
+        help="Retries for a test whose result reports succeeded=false (default: 1; 0 disables)"
+    )
+    parser.add_argument(
+        "--retry-delay", type=float, default=30.0,
+        help="Seconds before the first retry; doubles for each further retry (default: 30)"
+    )
+    parser.add_argument(
+        "--retry-jitter", type=float, default=5.0,
+        help="Random extra delay of up to this many seconds per retry (default: 5)"
+    )
+    parser.add_argument(
+        "--outbox-batch", type=int, default=200,
+        help="Max failed uploads per archiver replayed from the outbox at the start of a run (default: 200)"
+    )
+    parser.add_argument(
+        "--outbox-max-age-days", type=float, default=30.0,
+        help="Drop outbox entries older than this many days (default: 30)"
+    )
+    parser.add_argument(
+        "--pscheduler-backend", choices=["cli", "api"], default="cli",
+        help="cli: spawn `pscheduler task` per test [default]; "
+             "api: post tasks to the pScheduler REST API in-process (falls back to the CLI if unreachable)"
+    )
+    parser.add_argument(
+        "--pscheduler-api", default="https://localhost/pscheduler",
+        help="pScheduler REST API base URL for --pscheduler-backend=api (default: https://localhost/pscheduler)"
+    )
+    parser.add_argument(
+        "--storage", choices=["files", "segments"], default="files",
+        help="files: one JSON file per test [default]; "
+             "segments: append to daily <category>/segments/<YYYYMMDD>.ndjson.gz"
+    )
+    parser.add_argument(
+        "--archive-summary", action="store_true",
+        help="Include the compact per-test summary in archived results (as 'runner-summary')"
+    )
+    parser.add_argument(
+        "--lease-dir", default=DEFAULT_LEASE_DIR,
+        help="Shared directory for cross-container throughput test leases "
+             "(default: $LEASE_DIR or /leases; '' disables leasing)"
+    )
+    parser.add_argument(
+        "--lease-timeout", type=float, default=1800.0,
+        help="Max seconds to wait for a busy NIC/destination lease before re-queuing the test (default: 1800)"
+    )
+    parser.add_argument(
+        "--lease-max-hold", type=float, default=900.0,
+        help="Seconds after which a lease is considered stale and may be taken over (default: 900)"
+    )
+    parser.add_argument(
+        "--throughput-budget", default=os.environ.get("THROUGHPUT_BUDGET"),
+        help="Daily byte budget per destination for throughput tests, e.g. 2G (default: $THROUGHPUT_BUDGET; "
+             "unset = unlimited). Tests are shortened or skipped when the budget runs low"
+    )
+    parser.add_argument(
+        "--budget-min-duration", type=float, default=10.0,
+        help="Shortest throughput test (-t seconds) worth running under the budget (default: 10)"
+    )
+    parser.add_argument(
+        "--budget-assumed-rate", default="100M",
+        help="Throughput (bits/s) assumed for destinations without history, e.g. 100M (default: 100M)"
+    )
+    parser.add_argument(
+        "--throughput-affinity", default=os.environ.get("THROUGHPUT_AFFINITY"),
+        help="Pin the local iperf3 of throughput tests: a CPU list (2-3,6), node:N, or auto for the NUMA node "
+             "of the test's NIC; the first CPU is used (default: $THROUGHPUT_AFFINITY; unset = unpinned)"
+    )
+    parser.add_argument(
+        "--preflight", action=argparse.BooleanOptionalAction, default=False,
+        help="Probe sources, destination pScheduler reachability and tool availability before testing, "
+             "and drop tests that cannot work (default: off)"
+    )
+    parser.add_argument(
+        "--preflight-ttl", type=float, default=21600.0,
+        help="Seconds to reuse a successful pre-flight probe (default: 21600)"
+    )
+    parser.add_argument(
+        "--preflight-negative-ttl", type=float, default=900.0,
+        help="Seconds to reuse a failed or inconclusive pre-flight probe (default: 900)"
+    )
+    parser.add_argument(
+        "--preflight-timeout", type=float, default=5.0,
+        help="Timeout per pre-flight HTTP probe in seconds (default: 5)"
+    )
+    parser.add_argument(
+        "--parallel-sources", action=argparse.BooleanOptionalAction, default=True,
+        help="Run tests on different source interfaces (dst@name%%src) concurrently; "
+             "tests sharing an interface stay serial (default: on)"
+    )
+    parser.add_argument(
+        "--plan", action="store_true",
+        help="Print the estimated duration of the run (from run history or configured durations) and exit"
+    )
+    parser.add_argument(
+        "--deadline",
+        help="Time budget for the tests, e.g. 5h, 90m, 3600, or 'auto' (until the next --cron slot). "
+             "Tests run in --priority order; a test whose estimate no longer fits is skipped and recorded"
+    )
+    parser.add_argument(
+        "--priority", nargs="+", choices=ALL_TEST_CATEGORIES, default=DEFAULT_PRIORITY,
+        help=f"Category order under --deadline (default: {' '.join(DEFAULT_PRIORITY)})"
+    )
+    parser.add_argument(
+        "--metrics-textfile",
+        help="Also export the run report as Prometheus metrics to this file "
+             "(e.g. the node_exporter textfile collector directory)"
+    )
+    parser.add_argument(
+        "--daemon", action="store_true",
+        help="Stay resident and run on the --cron schedule instead of being launched by cron"
+    )
+    parser.add_argument(
+        "--cron", default=os.environ.get("CRON_EXPRESSION") or "0 */6 * * *",
+        help="Cron expression for --daemon mode (default: $CRON_EXPRESSION or '0 */6 * * *')"
+    )
+    return parser
+
 
+def main():
+    parser = _build_arg_parser()
     args = parser.parse_args()
 
     # List available tests/tools
@@ -533,73 +1823,351 @@ def main():
         )
 
     # Build archiver clients once for connection reuse across all tests
-    archiver_clients = _build_archiver_clients(archiver_urls, auth_token) if archiver_urls else {}
+    archiver_clients = build_archiver_clients(archiver_urls, auth_token) if archiver_urls else {}
+    # Uploads run in the background so slow archivers never stretch the test run.
+    # Failed uploads land in a persistent outbox and are replayed on the next run.
+    outbox = None
+    archive_queue = None
+    if archiver_clients and not args.plan:
+        outbox = ArchiveOutbox(os.path.join(args.output_dir, "state", "archive_outbox.sqlite"), logger)
+        archive_queue = ArchivalQueue(archiver_clients, logger, outbox=outbox, batch_size=args.archive_batch)
+
+    if args.daemon:
+        try:
+            schedule = CronSchedule(args.cron)
+        except ValueError as e:
+            parser.error(f"--cron: {e}")
+    try:
+        _deadline_seconds(args)
+    except ValueError as e:
+        parser.error(f"--deadline: {e}")
 
+    budget = None
+    if args.throughput_budget:
+        try:
+            budget = ThroughputBudget(
+                os.path.join(args.output_dir, "state", "throughput_budget.json"),
+                _parse_bytes(args.throughput_budget), logger,
+                min_duration=args.budget_min_duration, assumed_rate_bps=_parse_bytes(args.budget_assumed_rate),
+            )
+        except ValueError as e:
+            parser.error(f"--throughput-budget/--budget-assumed-rate: {e}")
+        logger.info(f"Throughput budget: {budget.daily_bytes / 1e6:.0f} MB per destination per day")
+
+    if args.throughput_affinity:
+        try:
+            # "auto" is resolved per test, against the NIC of its source
+            if args.throughput_affinity.strip() != "auto":
+                resolve_placement(args.throughput_affinity)
+        except ValueError as e:
+            parser.error(f"--throughput-affinity: {e}")
+        logger.info(f"Throughput tests pinned by CPU affinity {args.throughput_affinity!r}")
 
     logger.info(f"Hosts: {', '.join(args.hosts)}")
     logger.info(f"Tests: {', '.join(args.tests)}")
     logger.info(f"Tool mode: {args.tool_mode}{' (' + ', '.join(args.tools) + ')' if args.tool_mode=='subset' and args.tools else ''}")
 
-    # Prepare subset tool set (if requested)
-    subset_tools = set(args.tools or []) if args.tool_mode == "subset" else None
+    # Sources are resolved once here; the daemon reuses the job list every cycle
+    jobs = _build_test_jobs(args, logger)
 
-    for host_spec in args.hosts:
-        dest, dst, source_hint = _parse_host_spec(host_spec)
-        source = _resolve_source(source_hint, logger) if source_hint else None
-        if source_hint and source is None:
-            logger.warning(f"Host {host_spec}: could not resolve source '{source_hint}'; proceeding without --source")
-        elif source:
-            logger.info(f"Host {host_spec}: source binding -> {source}")
-        for test in args.tests:
-            supported_tools = AVAILABLE_TESTS.get(test, [])
+    if args.plan:
+        print_plan(args, jobs, logger)
+        sys.exit(0)
 
-            if args.tool_mode == "auto":
-                tool = None
-                if test == "throughput":
-                    tool = "iperf3"
-                elif test == "latency":
-                    tool = "halfping"
-                run_pscheduler_test(
-                    test, tool, host_spec, args.output_dir, logger, archiver_clients,
-                    reverse=False, dst_override=dst, source=source
-                )
-                if args.reverse and test in ["throughput", "latency"] and (tool is None or tool not in ["halfping"]):
-                    run_pscheduler_test(
-                        test, tool, host_spec, args.output_dir, logger, archiver_clients,
-                        reverse=True, dst_override=dst, source=source
-                    )
+    lease_options = None
+    if args.lease_dir:
+        try:
+            os.makedirs(args.lease_dir, exist_ok=True)
+            lease_options = {
+                "lease_dir": args.lease_dir, "timeout": args.lease_timeout, "max_hold": args.lease_max_hold
+            }
+            logger.info(f"Throughput tests lease their NIC/destination in {args.lease_dir}")
+        except OSError as e:
+            logger.warning(f"Lease directory {args.lease_dir} unusable ({e}); throughput tests run without leases")
+
+    preflight = None
+    if args.preflight:
+        preflight = Preflight(
+            PreflightCache(os.path.join(args.output_dir, "state", "preflight_cache.json"),
+                           args.preflight_ttl, args.preflight_negative_ttl),
+            args.pscheduler_api, logger, timeout=args.preflight_timeout,
+        )
 
-            elif args.tool_mode == "all":
-                for tool in supported_tools:
-                    run_pscheduler_test(
-                        test, tool, host_spec, args.output_dir, logger, archiver_clients,
-                        reverse=False, dst_override=dst, source=source
-                    )
-                    if args.reverse and test in ["throughput", "latency"] and tool not in ["halfping"]:
-                        run_pscheduler_test(
-                            test, tool, host_spec, args.output_dir, logger, archiver_clients,
-                            reverse=True, dst_override=dst, source=source
-                        )
+    api_client = None
+    if args.pscheduler_backend == "api":
+        api_client = PSchedulerAPIClient(args.pscheduler_api)
+        logger.info(f"pScheduler backend: REST API at {args.pscheduler_api} (CLI fallback)")
+
+    def _cycle() -> dict:
+        stats = run_once(args, jobs, logger, archiver_clients, archive_queue, outbox, api_client, lease_options,
+                         budget, preflight)
+        tests = stats.pop("tests")
+        stats["report"] = write_run_report(args, stats, tests, logger)
+        return stats
+
+    if args.daemon:
+        def _daemon_cycle() -> dict:
+            # New log file per run, as with cron-launched runs
+            setup_logger(args.output_dir)
+            return _cycle()
+
+        run_daemon(args.output_dir, schedule, _daemon_cycle, logger)
+    else:
+        lock_fd = acquire_run_lock(args.output_dir)
+        if lock_fd is None:
+            logger.error("Another run is still in progress (run lock held); not starting.")
+            sys.exit(1)
+        try:
+            _cycle()
+        finally:
+            os.close(lock_fd)
+
+    if archive_queue is not None:
+        archive_queue.close()
+        outbox.close()
 
-            else:  # subset
-                chosen = [t for t in supported_tools if t in subset_tools]
-                if not chosen:
-                    logger.warning(
-                        f"No matching tools for test '{test}' with subset {sorted(subset_tools)}; skipping."
-                    )
-                    continue
-                for tool in chosen:
-                    run_pscheduler_test(
-                        test, tool, host_spec, args.output_dir, logger, archiver_clients,
-                        reverse=False, dst_override=dst, source=source
-                    )
-                    if args.reverse and test in ["throughput", "latency"] and tool not in ["halfping"]:
-                        run_pscheduler_test(
-                            test, tool, host_spec, args.output_dir, logger, archiver_clients,
-                            reverse=True, dst_override=dst, source=source
-                        )
+
+def run_once(args, jobs: List[PendingTest], logger: logging.Logger, archiver_clients: dict,
+             archive_queue: Optional[ArchivalQueue], outbox: Optional[ArchiveOutbox],
+             api_client: Optional[PSchedulerAPIClient] = None, lease_options: Optional[dict] = None,
+             budget: Optional[ThroughputBudget] = None, preflight: Optional[Preflight] = None) -> dict:
+    """
+    One complete run: replay the outbox, run every job (with retries), then wait
+    for queued archival. Returns the run statistics.
+    """
+    started = datetime.now(timezone.utc)
+    t0 = time.monotonic()
+    timer = PhaseTimer()
+
+    if outbox is not None:
+        with timer.phase("outbox"):
+            expired = outbox.expire(args.outbox_max_age_days * 86400)
+            if expired:
+                logger.warning(f"Outbox: dropped {expired} entries older than {args.outbox_max_age_days:g} days")
+            replaying = archive_queue.replay_outbox(args.outbox_batch)
+            if replaying:
+                logger.info(f"Outbox: replaying {replaying} previously failed uploads in the background")
+
+    retry_policy = RetryPolicy(attempts=args.retry_attempts, delay=args.retry_delay, jitter=args.retry_jitter)
+    outcomes = {OUTCOME_OK: 0, OUTCOME_FAILED: 0, OUTCOME_RETRY: 0, OUTCOME_SKIPPED: 0}
+    segment_store = SegmentStore(args.output_dir) if args.storage == "segments" else None
+    manifest = RunManifest(args.output_dir, started.strftime('%Y%m%d-%H%M%SZ'))
+    logger.info(f"Run manifest: {manifest.path}")
+
+    outcomes_lock = threading.Lock()
+
+    def _job_runner(client: Optional[PSchedulerAPIClient]):
+        def _run_job(job: PendingTest) -> str:
+            outcome = run_pscheduler_test(
+                job.test, job.tool, job.host_spec, args.output_dir, logger, archiver_clients,
+                reverse=job.reverse, dst_override=job.dst, source=job.source,
+                archive_queue=archive_queue, api_client=client,
+                archive_summary=args.archive_summary, segment_store=segment_store, manifest=manifest,
+                attempt=job.attempt, lease_options=lease_options, budget=budget,
+                affinity=args.throughput_affinity
+            )
+            with outcomes_lock:
+                outcomes[outcome] += 1
+            return outcome
+        return _run_job
+
+    if preflight is not None:
+        with timer.phase("preflight"):
+            jobs, pruned = preflight.run(jobs)
+        for job, reason in pruned:
+            logger.warning(f"Pre-flight: dropping {job.describe()}: {reason}")
+            outcomes[OUTCOME_SKIPPED] += 1
+            entry = _manifest_entry(job.test, job.tool, job.dst.ip, job.dst, job.source, job.reverse, job.attempt)
+            entry.update(status=OUTCOME_SKIPPED, reason=f"preflight: {reason}")
+            manifest.add(entry)
+
+    admit = None
+    deadline = _deadline_seconds(args)
+    if deadline is not None:
+        jobs = order_by_priority(jobs, args.priority)
+    groups = group_jobs(jobs, args.parallel_sources)
+    if deadline is not None:
+        estimator = DurationEstimator(args.output_dir)
+        plan = plan_run(groups, estimator, retry_policy)
+        ends = time.monotonic() + deadline
+        logger.info(
+            f"Deadline: {_fmt_duration(deadline)} for tests; plan estimates {_fmt_duration(plan['expected_s'])}"
+        )
+        if plan["expected_s"] > deadline:
+            logger.warning("Planned tests exceed the deadline; lowest-priority tests will be skipped")
+
+        def admit_within_deadline(job: PendingTest, start_at: float) -> bool:
+            seconds, _ = estimator.estimate(job)
+            if start_at + seconds <= ends:
+                return True
+            logger.warning(
+                f"Deadline: skipping {job.describe()}"
+                f"{' retry ' + str(job.attempt - 1) if job.attempt > 1 else ''}: needs ~{seconds:.0f}s, "
+                f"{max(0.0, ends - start_at):.0f}s left"
+            )
+            with outcomes_lock:
+                outcomes[OUTCOME_SKIPPED] += 1
+            entry = _manifest_entry(job.test, job.tool, job.dst.ip, job.dst, job.source, job.reverse, job.attempt)
+            entry.update(status=OUTCOME_SKIPPED, reason="deadline", estimate_s=round(seconds, 1))
+            manifest.add(entry)
+            return False
+
+        admit = admit_within_deadline
+
+    with timer.phase("tests"):
+        if len(groups) > 1:
+            # One thread per source interface; each keeps its own retry queue
+            # and pScheduler API session
+            logger.info("Running source interfaces in parallel: " + ", ".join(
+                f"{nic} ({len(group)} tests)" for nic, group in groups.items()))
+            with ThreadPoolExecutor(max_workers=len(groups), thread_name_prefix="nic") as pool:
+                futures = [
+                    pool.submit(run_test_jobs, group, _job_runner(api_client.fork() if api_client else None),
+                                retry_policy, logger, admit=admit)
+                    for group in groups.values()
+                ]
+                group_stats = [f.result() for f in futures]
+            retry_stats = {key: sum(g[key] for g in group_stats) for key in group_stats[0]}
+        else:
+            retry_stats = run_test_jobs(jobs, _job_runner(api_client), retry_policy, logger, admit=admit)
+    logger.info(
+        f"Retries: scheduled={retry_stats['scheduled']} recovered={retry_stats['recovered']} "
+        f"exhausted={retry_stats['exhausted']} time={retry_stats['retry_seconds']:.0f}s"
+    )
+    if retry_stats["skipped"]:
+        logger.warning(f"Deadline: skipped {retry_stats['skipped']} tests/retries (recorded in {manifest.path})")
+
+    archival = {}
+    if archive_queue is not None:
+        logger.info(f"Waiting up to {args.archive_drain_timeout:.0f}s for queued archival uploads...")
+        with timer.phase("archive_drain"):
+            archival = archive_queue.wait(args.archive_drain_timeout)
+        depth = outbox.depth()
+        for url, res in archival.items():
+            res["outbox"] = depth.get(url, 0)
+            logger.info(
+                f"Archival {url}: {res['status']} ok={res['ok']} replayed={res['replayed']} "
+                f"failed={res['failed']} pending={res['pending']} outbox={res['outbox']} "
+                f"upload_time={res['send_s']:.1f}s"
+            )
 
     logger.info("All tests completed.")
+    return {
+        "started": started.isoformat(),
+        "finished": datetime.now(timezone.utc).isoformat(),
+        "duration_s": round(time.monotonic() - t0, 1),
+        "jobs": len(jobs),
+        "parallel_groups": len(groups),
+        "manifest": manifest.path,
+        "outcomes": outcomes,
+        "retries": retry_stats,
+        "archival": archival,
+        "phases": timer.phases,
+        "tests": manifest.entries,
+    }
+
+
+def build_run_report(stats: dict, tests: List[dict]) -> dict:
+    """
+    The run statistics from run_once() plus per-test timing, with each test
+    phase summed over the run so the largest contributor stands out.
+    """
+    test_phases = {}
+    by_category = {}
+    pscheduler = {"schedule_delay_s": 0.0, "test_runtime_s": 0.0}
+    for t in tests:
+        for phase, seconds in (t.get("phases") or {}).items():
+            test_phases[phase] = round(test_phases.get(phase, 0.0) + seconds, 3)
+        cat = by_category.setdefault(t["category"], {"tests": 0, "duration_s": 0.0})
+        cat["tests"] += 1
+        cat["duration_s"] = round(cat["duration_s"] + t.get("duration_s", 0.0), 3)
+        for key in pscheduler:
+            pscheduler[key] = round(pscheduler[key] + t.get(key, 0.0), 3)
+    return {
+        **stats,
+        "test_phases": test_phases,
+        "by_category": by_category,
+        # Only known with --pscheduler-backend=api; the CLI reports one "pscheduler" phase
+        "pscheduler": pscheduler,
+        "tests": [{k: v for k, v in t.items() if k != "summary"} for t in tests],
+    }
+
+
+def _prom_labels(**labels) -> str:
+    def _escape(v) -> str:
+        return str(v).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+    return "{" + ",".join(f'{k}="{_escape(v)}"' for k, v in labels.items()) + "}"
+
+
+def format_prometheus_metrics(report: dict) -> str:
+    """Prometheus text exposition of a run report (all gauges, last run only)."""
+    metrics = {}
+
+    def gauge(name: str, help_text: str, value, **labels) -> None:
+        if value is None:
+            return
+        lines = metrics.setdefault(name, [f"# HELP {name} {help_text}", f"# TYPE {name} gauge"])
+        lines.append(f"{name}{_prom_labels(**labels) if labels else ''} {float(value):g}")
+
+    prefix = "perfsonar_runner"
+    finished = datetime.fromisoformat(report["finished"]).timestamp()
+    gauge(f"{prefix}_last_run_timestamp_seconds", "End of the last run (unix time).", finished)
+    gauge(f"{prefix}_run_duration_seconds", "Wall time of the last run.", report["duration_s"])
+    for phase, seconds in report["phases"].items():
+        gauge(f"{prefix}_run_phase_seconds", "Wall time per run phase.", seconds, phase=phase)
+    for phase, seconds in report["test_phases"].items():
+        gauge(f"{prefix}_test_phase_seconds", "Time per test phase, summed over the run's tests.",
+              seconds, phase=phase)
+    for outcome, count in report["outcomes"].items():
+        gauge(f"{prefix}_tests", "Test invocations by outcome.", count, outcome=outcome)
+    for category, cat in report["by_category"].items():
+        gauge(f"{prefix}_category_duration_seconds", "Test time per category.", cat["duration_s"],
+              category=category)
+    gauge(f"{prefix}_retry_seconds", "Time spent waiting for and re-running retries.",
+          report["retries"]["retry_seconds"])
+    gauge(f"{prefix}_pscheduler_schedule_delay_seconds",
+          "Task posted to run start, summed over API-run tests.", report["pscheduler"]["schedule_delay_s"])
+    gauge(f"{prefix}_pscheduler_test_runtime_seconds",
+          "Run start to end, summed over API-run tests.", report["pscheduler"]["test_runtime_s"])
+    for url, res in report["archival"].items():
+        for result in ("ok", "failed", "replayed"):
+            gauge(f"{prefix}_archive_uploads", "Archiver uploads in the last run.", res[result],
+                  endpoint=url, result=result)
+        gauge(f"{prefix}_archive_upload_seconds", "Total archiver upload time.", res["send_s"], endpoint=url)
+        gauge(f"{prefix}_archive_upload_max_seconds", "Slowest single archiver upload.", res["send_max_s"],
+              endpoint=url)
+        gauge(f"{prefix}_archive_pending", "Uploads still queued at the drain deadline.", res["pending"],
+              endpoint=url)
+        gauge(f"{prefix}_archive_outbox_depth", "Entries waiting in the archive outbox.", res.get("outbox"),
+              endpoint=url)
+    return "\n".join(line for lines in metrics.values() for line in lines) + "\n"
+
+
+def write_run_report(args, stats: dict, tests: List[dict], logger: logging.Logger) -> str:
+    """
+    Write <output-dir>/reports/run_<timestamp>.json (and the --metrics-textfile,
+    if set) for one run. Returns the report path.
+    """
+    report = build_run_report(stats, tests)
+    stamp = datetime.fromisoformat(stats["started"]).strftime('%Y%m%d-%H%M%SZ')
+    path = os.path.join(args.output_dir, "reports", f"run_{stamp}.json")
+    write_json_atomic(path, report)
+    logger.info(
+        "Run phases: " + ", ".join(f"{k}={v:.1f}s" for k, v in report["phases"].items())
+        + " | test phases: " + ", ".join(f"{k}={v:.1f}s" for k, v in report["test_phases"].items())
+    )
+    logger.info(f"Run report: {path}")
+
+    if args.metrics_textfile:
+        # Same directory + rename, so the collector never reads a partial file
+        tmp = f"{args.metrics_textfile}.tmp.{os.getpid()}"
+        try:
+            with open(tmp, "w") as f:
+                f.write(format_prometheus_metrics(report))
+            os.replace(tmp, args.metrics_textfile)
+        except OSError as e:
+            logger.error(f"Could not write metrics textfile {args.metrics_textfile}: {e}")
+    return path
 
 
 # Optional: keep speedtest helper (unchanged except no archiver flag here)
@@ -622,7 +2190,7 @@ def run_speedtest(output_dir, logger, archiver_clients: Optional[dict] = None):
 
         if archiver_clients:
             try:
-                raw = json.loads(result.stdout)
+                raw = json_loads(result.stdout)
             except Exception as e:
                 logger.error(f"Could not parse speedtest JSON: {e}")
                 return
@@ -0,0 +1,368 @@
+#!/usr/bin/env python3
+"""
+Recompute result summaries offline, without rerunning any test.
+
+Walks one or more output directories, either the pScheduler runner's
+(<category>/*.json and <category>/segments/*.ndjson.gz) or
+run_direct_tools.py's (<tool>/*.json with their *.samples.ndjson). Every
+result is re-summarized in a process pool, and the new summary is written to:
+
+  pScheduler result file    <result>.summary.json (summarize_result()), as the runner does
+  pScheduler segment        <segment>.summaries.ndjson, one line per record; the runner
+                            keeps its own segment summaries in the manifest instead, so
+                            read these with result_store.iter_segment_summaries()
+  direct-tool result        <result>.summary.json (StreamStats of the samples)
+
+Work is handed out in chunks of files (one work unit per segment). Progress
+is checkpointed to <dir>/state/reprocess_state.json as chunks complete, so
+an interrupted pass picks up where it stopped. A file is skipped when its
+size and mtime, or else its content hash, are unchanged since the last pass.
+The state also records a fingerprint of the summarizing code; when that
+code changes, every file is reprocessed.
+
+    python reprocess_results.py /data [/data_tools ...] [--workers 4] [--chunk-size 64] [--force]
+"""
+import argparse
+import hashlib
+import json
+import os
+import re
+import sys
+import time
+import zlib
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from typing import Dict, Iterator, List, Optional, Tuple
+
+import result_store
+import tool_parsers
+from result_store import json_loads, read_json_file, segment_summaries_path
+from tool_parsers import STREAM_PARSERS, Iperf3Stream, StreamStats, parse_stream
+
+try:
+    import pscheduler_test_runner as runner
+except ImportError:
+    try:
+        # Inside the testpoint image the runner is installed as periodic.py;
+        # in the tool image periodic.py is run_direct_tools.py instead
+        import periodic as runner
+    except ImportError:
+        runner = None
+    if runner is not None and not hasattr(runner, "summarize_result"):
+        runner = None  # direct-tool results only
+
+STATE_FILE = os.path.join("state", "reprocess_state.json")
+
+# Seconds between state checkpoints while a pass is running
+CHECKPOINT_INTERVAL_S = 10.0
+
+# "<name>@<dest>_<tool>_<time>_<direction>[_src-<source>].json" (pScheduler runner result files)
+PSCHEDULER_FILE = re.compile(
+    r'^(?P<name>.+)@(?P<dest>.+)_(?P<tool>[^_]+)_(?P<time>\d{8}-\d{6}Z)_(?P<direction>forward|reverse)'
+    r'(?:_src-(?P<source>.+))?\.json$'
+)
+# "<host>_<tool>_<time>.json" (run_direct_tools.py result files)
+DIRECT_FILE = re.compile(r'^(?P<host>.+)_(?P<tool>[^_]+)_(?P<time>\d{8}-\d{6}Z)\.json$')
+
+# Value summarized per direct-tool sample (see tool_parsers feed())
+DIRECT_SAMPLE_VALUES = {
+    "ping": lambda s: None if s.get("dup") else s.get("rtt_ms"),
+    "iperf3": lambda s: (s.get("sum") or {}).get("bits_per_second"),
+    "nuttcp": lambda s: s.get("rate_Mbps"),
+    "traceroute": lambda s: min(s["rtt_ms"]) if s.get("rtt_ms") else None,
+}
+
+# Sidecars written next to results; never results themselves
+SIDECAR_SUFFIXES = (".summary.json", ".meta.json", ".samples.ndjson")
+
+
+def code_fingerprint() -> str:
+    """Hash of the code that derives summaries; a change invalidates all earlier passes."""
+    h = hashlib.blake2b(digest_size=16)
+    modules = [tool_parsers, result_store, sys.modules[__name__]] + ([runner] if runner is not None else [])
+    for module in modules:
+        with open(module.__file__, "rb") as f:
+            h.update(f.read())
+    return h.hexdigest()
+
+
+def _file_hash(path: str) -> str:
+    h = hashlib.blake2b(digest_size=16)
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(1 << 20), b""):
+            h.update(block)
+    return h.hexdigest()
+
+
+def _write_atomic(path: str, data: bytes) -> None:
+    tmp = f"{path}.tmp.{os.getpid()}"
+    with open(tmp, "wb") as f:
+        f.write(data)
+    os.replace(tmp, path)
+
+
+def _summary_path(result_path: str) -> str:
+    return f"{os.path.splitext(result_path)[0]}.summary.json"
+
+
+def output_path(kind: str, path: str) -> str:
+    return segment_summaries_path(path) if kind == "segment" else _summary_path(path)
+
+
+def iter_segment_records(path: str) -> Iterator[Tuple[str, bytes]]:
+    """
+    Yield (reference, record line) for every gzip member of a result segment.
+    References match SegmentStore.append(): "<segment>#<offset>:<length>". A
+    partly written last member is ignored.
+    """
+    offset = 0
+    with open(path, "rb") as f:
+        buf = b""
+        while True:
+            d = zlib.decompressobj(wbits=31)
+            start = offset
+            out = []
+            while not d.eof:
+                if not buf:
+                    buf = f.read(1 << 16)
+                    if not buf:
+                        return
+                out.append(d.decompress(buf))
+                offset += len(buf) - len(d.unused_data)
+                buf = d.unused_data
+            yield f"{path}#{start}:{offset - start}", b"".join(out)
+
+
+def _pscheduler_meta(path: str) -> dict:
+    """Test metadata for a result file: from its previous summary, else from its name."""
+    try:
+        with open(_summary_path(path), "rb") as f:
+            previous = json.loads(f.read())
+    except (OSError, ValueError):
+        previous = None
+    if previous:
+        # The runner writes the test entry first, then "result_file", then the metrics
+        meta = {}
+        for key, value in previous.items():
+            if key == "result_file":
+                return meta
+            meta[key] = value
+    match = PSCHEDULER_FILE.match(os.path.basename(path))
+    meta = {"category": os.path.basename(os.path.dirname(path))}
+    if match:
+        meta.update(match.groupdict())
+    return meta
+
+
+def _summarize_pscheduler_file(path: str) -> Tuple[str, str]:
+    meta = _pscheduler_meta(path)
+    raw = read_json_file(path)
+    summary = runner.summarize_result(meta["category"], raw, meta.get("dest")) if isinstance(raw, dict) else None
+    if summary is None:
+        return "no-summary", "NumPy missing or not a result document"
+    summary = {**meta, "result_file": os.path.basename(path), **summary}
+    _write_atomic(_summary_path(path), json.dumps(summary).encode())
+    return "summarized", ""
+
+
+def _summarize_segment(path: str) -> Tuple[str, str]:
+    category = os.path.basename(os.path.dirname(os.path.dirname(path)))
+    lines = []
+    records = 0
+    for ref, line in iter_segment_records(path):
+        records += 1
+        record = json_loads(line)
+        meta, raw = record.get("meta") or {}, record.get("result")
+        summary = runner.summarize_result(category, raw, meta.get("dest")) if isinstance(raw, dict) else None
+        if summary is not None:
+            lines.append(json.dumps({**meta, "stored": ref, "summary": summary}))
+    if not lines:
+        return "no-summary", f"{records} records, none summarized"
+    _write_atomic(segment_summaries_path(path), ("\n".join(lines) + "\n").encode())
+    return "summarized", f"{len(lines)}/{records} records"
+
+
+def _summarize_direct_file(path: str) -> Tuple[str, str]:
+    tool = os.path.basename(os.path.dirname(path))
+    root = os.path.splitext(path)[0]
+    try:
+        with open(f"{root}.meta.json") as f:
+            meta = {k: v for k, v in json.load(f).items() if k in ("tool", "host", "time")}
+    except (OSError, ValueError):
+        match = DIRECT_FILE.match(os.path.basename(path))
+        meta = {"tool": tool, **({"host": match["host"], "time": match["time"]} if match else {})}
+
+    samples_path = f"{root}.samples.ndjson"
+    if os.path.exists(samples_path):
+        stats = StreamStats()
+        value_of = DIRECT_SAMPLE_VALUES[tool]
+        with open(samples_path) as f:
+            for line in f:
+                if line.strip():
+                    value = value_of(json.loads(line))
+                    if value is not None:
+                        stats.add(value)
+        source, samples = "samples", stats.summary(digits=0 if tool == "iperf3" else 3)
+    elif tool == "iperf3":
+        # Runs before the streaming parsers stored iperf3's own -J output
+        with open(path) as f:
+            samples = parse_stream(Iperf3Stream(), f.read())["interval_bps"]
+        source = "iperf3-json"
+    else:
+        return "no-summary", "no samples recorded"
+    summary = {**meta, "result_file": os.path.basename(path), "source": source, "samples": samples}
+    _write_atomic(_summary_path(path), json.dumps(summary).encode())
+    return "summarized", ""
+
+
+_HANDLERS = {
+    "pscheduler": _summarize_pscheduler_file,
+    "segment": _summarize_segment,
+    "direct": _summarize_direct_file,
+}
+
+
+def process_chunk(kind: str, items: List[Tuple[str, Optional[str]]]) -> List[dict]:
+    """
+    Worker: (re)summarize each (path, previous hash) in *items*, skipping
+    files whose content hash still matches. Returns one record per file.
+    """
+    done = []
+    for path, previous_hash in items:
+        record = {"path": path}
+        try:
+            st = os.stat(path)
+            record.update(size=st.st_size, mtime_ns=st.st_mtime_ns, hash=_file_hash(path))
+            if record["hash"] == previous_hash and os.path.exists(output_path(kind, path)):
+                record["status"] = "unchanged"
+            else:
+                record["status"], record["detail"] = _HANDLERS[kind](path)
+        except Exception as e:
+            record.update(status="error", detail=f"{type(e).__name__}: {e}")
+        done.append(record)
+    return done
+
+
+def discover(output_dir: str) -> Iterator[Tuple[str, str]]:
+    """Yield (kind, path) for every result under *output_dir*."""
+    pscheduler_categories = set(runner.AVAILABLE_TESTS) if runner is not None else set()
+    for entry in sorted(os.scandir(output_dir), key=lambda e: e.name):
+        if not entry.is_dir():
+            continue
+        if entry.name in pscheduler_categories:
+            kind = "pscheduler"
+        elif entry.name in STREAM_PARSERS:
+            kind = "direct"
+        else:
+            continue
+        for f in sorted(os.scandir(entry.path), key=lambda e: e.name):
+            if f.is_file() and f.name.endswith(".json") and not f.name.endswith(SIDECAR_SUFFIXES):
+                yield kind, f.path
+        segment_dir = os.path.join(entry.path, "segments")
+        if kind == "pscheduler" and os.path.isdir(segment_dir):
+            for name in sorted(os.listdir(segment_dir)):
+                if name.endswith(".ndjson.gz"):
+                    yield "segment", os.path.join(segment_dir, name)
+
+
+class ReprocessState:
+    """Per-directory record of what the last passes summarized (see module docstring)."""
+
+    def __init__(self, output_dir: str, fingerprint: str, force: bool = False):
+        self.path = os.path.join(output_dir, STATE_FILE)
+        self.output_dir = output_dir
+        self.fingerprint = fingerprint
+        self.files = {}
+        if not force:
+            try:
+                with open(self.path) as f:
+                    state = json.load(f)
+                if state.get("fingerprint") == fingerprint:
+                    self.files = state.get("files", {})
+            except (OSError, ValueError):
+                pass
+
+    def _key(self, path: str) -> str:
+        return os.path.relpath(path, self.output_dir)
+
+    def get(self, path: str) -> Optional[dict]:
+        return self.files.get(self._key(path))
+
+    def update(self, record: dict) -> None:
+        if record["status"] in ("summarized", "unchanged", "no-summary"):
+            self.files[self._key(record["path"])] = {
+                k: record[k] for k in ("size", "mtime_ns", "hash")
+            }
+
+    def save(self) -> None:
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        _write_atomic(self.path, json.dumps({"fingerprint": self.fingerprint, "files": self.files}).encode())
+
+
+def reprocess(output_dirs: List[str], workers: Optional[int], chunk_size: int, force: bool = False,
+              log=print) -> Dict[str, int]:
+    """Reprocess every directory; returns counts per status plus "skipped" (size/mtime unchanged)."""
+    fingerprint = code_fingerprint()
+    counts = {"skipped": 0}
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        for output_dir in output_dirs:
+            state = ReprocessState(output_dir, fingerprint, force)
+            pending = {}
+            for kind, path in discover(output_dir):
+                known = state.get(path)
+                st = os.stat(path)
+                if (known and known["size"] == st.st_size and known["mtime_ns"] == st.st_mtime_ns
+                        and os.path.exists(output_path(kind, path))):
+                    counts["skipped"] += 1
+                    continue
+                pending.setdefault(kind, []).append((path, known["hash"] if known else None))
+
+            futures = []
+            for kind, items in pending.items():
+                # A segment holds a whole day of results: one per work unit
+                size = 1 if kind == "segment" else chunk_size
+                for i in range(0, len(items), size):
+                    futures.append(pool.submit(process_chunk, kind, items[i:i + size]))
+            total = sum(len(items) for items in pending.values())
+            log(f"{output_dir}: {total} files to check in {len(futures)} chunks")
+
+            last_checkpoint = time.monotonic()
+            try:
+                for future in as_completed(futures):
+                    for record in future.result():
+                        counts[record["status"]] = counts.get(record["status"], 0) + 1
+                        if record["status"] == "error":
+                            log(f"  error: {record['path']}: {record['detail']}")
+                        state.update(record)
+                    if time.monotonic() - last_checkpoint >= CHECKPOINT_INTERVAL_S:
+                        state.save()
+                        last_checkpoint = time.monotonic()
+            finally:
+                state.save()
+    return counts
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Recompute result summaries from stored runner output.")
+    parser.add_argument("output_dirs", nargs="+", metavar="DIR",
+                        help="Runner output directories (pScheduler runner and/or run_direct_tools.py)")
+    parser.add_argument("--workers", type=int, default=None,
+                        help="Worker processes (default: one per CPU)")
+    parser.add_argument("--chunk-size", type=int, default=64,
+                        help="Result files per work unit (default: 64)")
+    parser.add_argument("--force", action="store_true",
+                        help="Ignore the state of earlier passes and reprocess everything")
+    args = parser.parse_args()
+
+    if runner is None:
+        print("pScheduler runner not importable; only direct-tool results are reprocessed", file=sys.stderr)
+    started = time.monotonic()
+    counts = reprocess(args.output_dirs, args.workers, max(1, args.chunk_size), args.force)
+    elapsed = time.monotonic() - started
+    handled = sum(counts.values())
+    print(f"Done in {elapsed:.1f}s ({handled / elapsed if elapsed else 0:.0f} files/s): "
+          + ", ".join(f"{n} {status}" for status, n in sorted(counts.items())))
+    sys.exit(1 if counts.get("error") else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,187 @@
+#!/usr/bin/env python3
+"""
+Stored results of the pScheduler runner.
+
+Results are written either as one JSON file per test or as records in
+append-only daily segments (SegmentStore); a stored reference is a file path
+or "<segment>#<offset>:<length>", and load_stored_result() reads either.
+Each run also appends one line per test to a manifest (RunManifest), which
+iter_manifest_entries() searches. The JSON helpers use orjson when it is
+installed; reprocess_results.py reads results through this module too.
+"""
+import fcntl
+import gzip
+import json
+import os
+import re
+import threading
+from datetime import datetime, timezone
+from typing import Optional
+
+try:
+    import orjson  # optional: faster decode/encode of large trace/throughput results
+except ImportError:
+    orjson = None
+
+
+def json_loads(data):
+    """Decode JSON text/bytes, with orjson when available."""
+    return orjson.loads(data) if orjson is not None else json.loads(data)
+
+
+def json_dumps(obj) -> bytes:
+    """Encode to compact JSON bytes, with orjson when available."""
+    return orjson.dumps(obj) if orjson is not None else json.dumps(obj).encode()
+
+
+def read_json_file(path: str):
+    with open(path, "rb") as f:
+        return json_loads(f.read())
+
+
+class SegmentStore:
+    """
+    Append-only daily result segments, an alternative to one file per test:
+
+        <output-dir>/<category>/segments/<YYYYMMDD>.ndjson.gz
+
+    Each record is one NDJSON line {"meta": {...}, "result": {...}} compressed
+    as its own gzip member. The segment as a whole still reads with zcat, and a
+    single record can be read back from its (offset, length) without
+    decompressing anything else. Appends hold an flock, so concurrent runners
+    on the same volume never interleave records.
+    """
+
+    def __init__(self, output_dir: str):
+        self.output_dir = output_dir
+
+    def segment_path(self, category: str, when: Optional[datetime] = None) -> str:
+        day = (when or datetime.now(timezone.utc)).strftime("%Y%m%d")
+        return os.path.join(self.output_dir, category, "segments", f"{day}.ndjson.gz")
+
+    def append(self, category: str, meta: dict, result_json: bytes) -> str:
+        """
+        Append one record; returns its reference "<segment>#<offset>:<length>".
+        *result_json* is embedded as-is, so the result is never re-encoded.
+        """
+        line = b'{"meta":' + json_dumps(meta) + b',"result":' + result_json + b'}\n'
+        member = gzip.compress(line, mtime=0)
+        path = self.segment_path(category)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        fd = os.open(path, os.O_WRONLY | os.O_CREAT | os.O_APPEND, 0o644)
+        try:
+            fcntl.flock(fd, fcntl.LOCK_EX)
+            offset = os.lseek(fd, 0, os.SEEK_END)
+            os.write(fd, member)
+        finally:
+            os.close(fd)  # also releases the lock
+        return f"{path}#{offset}:{len(member)}"
+
+    @staticmethod
+    def read(ref: str) -> dict:
+        """The full {"meta", "result"} record behind a reference from append()."""
+        path, span = ref.rsplit("#", 1)
+        offset, length = (int(x) for x in span.split(":"))
+        with open(path, "rb") as f:
+            f.seek(offset)
+            return json_loads(gzip.decompress(f.read(length)))
+
+
+def _is_segment_ref(ref: str) -> bool:
+    return bool(re.search(r"\.ndjson\.gz#\d+:\d+$", ref))
+
+
+def load_stored_result(ref: str):
+    """Result JSON behind a stored reference: a result file or a segment record."""
+    if _is_segment_ref(ref):
+        return SegmentStore.read(ref)["result"]
+    return read_json_file(ref)
+
+
+def segment_summaries_path(segment_path: str) -> str:
+    """<day>.summaries.ndjson next to a <day>.ndjson.gz segment (written by reprocess_results.py)."""
+    return segment_path[:-len(".ndjson.gz")] + ".summaries.ndjson"
+
+
+def iter_segment_summaries(output_dir: str, *, category: Optional[str] = None):
+    """
+    Yield the reprocessed summaries of segment records, one dict per record:
+    the record's meta plus "stored" (its reference) and "summary". The runner
+    keeps the summaries it computed at run time in the manifest lines instead.
+    """
+    for name in sorted(os.listdir(output_dir)) if os.path.isdir(output_dir) else []:
+        if category and name != category:
+            continue
+        segment_dir = os.path.join(output_dir, name, "segments")
+        if not os.path.isdir(segment_dir):
+            continue
+        for segment in sorted(os.listdir(segment_dir)):
+            if not segment.endswith(".summaries.ndjson"):
+                continue
+            with open(os.path.join(segment_dir, segment), "rb") as f:
+                for line in f:
+                    if line.strip():
+                        yield json_loads(line)
+
+
+class RunManifest:
+    """
+    Per-run index, <output-dir>/manifests/run_<timestamp>.ndjson, with one line
+    per test invocation: what ran, timing, status and where the result was
+    stored. Lines are appended as tests finish, so a crashed run still leaves
+    a usable manifest. Use iter_manifest_entries() to look results up by
+    host/test/time without walking the result directories.
+    """
+
+    def __init__(self, output_dir: str, run_timestamp: str):
+        manifest_dir = os.path.join(output_dir, "manifests")
+        os.makedirs(manifest_dir, exist_ok=True)
+        self.path = os.path.join(manifest_dir, f"run_{run_timestamp}.ndjson")
+        self.entries = []
+        self._lock = threading.Lock()
+
+    def add(self, entry: dict) -> None:
+        line = json_dumps(entry) + b"\n"
+        with self._lock, open(self.path, "ab") as f:
+            f.write(line)
+            self.entries.append(entry)
+
+
+def iter_manifest_entries(output_dir: str, *, dest: Optional[str] = None, category: Optional[str] = None,
+                          since: Optional[str] = None, until: Optional[str] = None, last: Optional[int] = None):
+    """
+    Yield manifest entries matching the filters. *since*/*until* compare
+    against the entry's "time" (UTC, '%Y%m%d-%H%M%SZ'). Whole manifests
+    outside the window are skipped by name. *last* limits the search to the
+    newest N runs.
+    """
+    manifest_dir = os.path.join(output_dir, "manifests")
+    if not os.path.isdir(manifest_dir):
+        return
+    names = sorted(n for n in os.listdir(manifest_dir) if n.startswith("run_") and n.endswith(".ndjson"))
+    if last is not None:
+        names = names[-last:] if last > 0 else []
+    for name in names:
+        if until and name[len("run_"):-len(".ndjson")] > until:
+            continue
+        with open(os.path.join(manifest_dir, name), "rb") as f:
+            for line in f:
+                entry = json_loads(line)
+                if dest and dest not in (entry.get("dest"), entry.get("name")):
+                    continue
+                if category and entry.get("category") != category:
+                    continue
+                if since and entry.get("time", "") < since:
+                    continue
+                if until and entry.get("time", "") > until:
+                    continue
+                yield entry
+
+
+def write_json_atomic(path: str, data) -> None:
+    """Write *data* as indented JSON via a temp file and rename, so readers never see a partial file."""
+    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+    tmp = f"{path}.tmp.{os.getpid()}"
+    with open(tmp, "w") as f:
+        json.dump(data, f, indent=2)
+    os.replace(tmp, path)
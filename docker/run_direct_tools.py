@@ -1,11 +1,20 @@
 import argparse
-import subprocess
+import asyncio
 import os
+from collections import deque
 from datetime import datetime, timezone
 import logging
-from typing import Any
-import re
 import json
+import re
+import signal
+import subprocess
+import time
+from contextlib import nullcontext
+from functools import lru_cache
+
+from cpu_affinity import numactl_prefix, resolve_placement, source_interface
+from throughput_lease import DEFAULT_LEASE_DIR, LeaseTimeout, ThroughputLease, interface_for, lease_keys
+from tool_parsers import STREAM_PARSERS
 
 # Define tools and base commands
 TOOLS = {
@@ -15,89 +24,15 @@ TOOLS = {
     #"traceroute": ["traceroute", "--mtu"],
 }
 
-def parse_traceroute_output(output):
-    result = []
-    lines = output.strip().splitlines()
-    for line in lines:
-        # Skip the header line
-        if line.lower().startswith("traceroute"):
-            continue
-        hop_match = re.match(r'\s*(\d+)\s+(.+)', line)
-        if hop_match:
-            hop_num = int(hop_match.group(1))
-            rest = hop_match.group(2)
-
-            # Extract IP addresses
-            ip_match = re.search(r'\(([\d\.]+)\)', rest)
-            ip_address = ip_match.group(1) if ip_match else None
-
-            # Extract RTT times
-            rtt_times = re.findall(r'(\d+\.\d+)\s+ms', rest)
-
-            result.append({
-                'hop': hop_num,
-                'ip': ip_address,
-                'rtt_ms': [float(rtt) for rtt in rtt_times] if rtt_times else []
-            })
-    return result
-
-def parse_nuttcp_output(output):
-    result_dict = {}
-    # Split on whitespace to get key=value pairs
-    for pair in output.strip().split():
-        if "=" in pair:
-            key, value = pair.split("=")
-            # Attempt to convert to float or int where possible
-            try:
-                if '.' in value:
-                    result_dict[key] = float(value)
-                else:
-                    result_dict[key] = int(value)
-            except ValueError:
-                result_dict[key] = value
-    return result_dict
-
-
-def parse_ping_output(ping_output: str) -> dict[str, dict[str, Any]]:
-    """Parses the output of a ping command to extract RTT and packet loss statistics."""
-    sections = ping_output.strip().split("PING ")
-    results: Dict[str, Dict[str, Any]] = {}
-
-    for section in sections[1:]:  # Skip first empty split
-        lines = section.split("\n")
-
-        # Extract destination IP
-        first_line: str = lines[0]
-        match = re.search(r'\((.*?)\)', first_line)
-        if not match:
-            continue
-        dest_ip: str = match.group(1)
-
-        # Extract RTT statistics
-        rtt_line: Optional[str] = next((l for l in lines if "rtt min/avg/max/mdev" in l), None)
-        if rtt_line:
-            rtt_values = re.findall(r"[0-9]+\.[0-9]+", rtt_line)
-            if len(rtt_values) == 4:
-                min_rtt, avg_rtt, max_rtt, mdev_rtt = map(float, rtt_values)
-            else:
-                continue
-        else:
-            continue
-
-        # Extract packet loss percentage
-        packet_loss_line: Optional[str] = next((l for l in lines if "packet loss" in l), None)
-        match = re.search(r'([0-9]+)% packet loss', packet_loss_line)
-        packet_loss: int = int(match.group(1)) if match else 0
+# Bandwidth-heavy tools: at most one at a time per NIC, and under a
+# cross-process lease shared with the pScheduler runner
+LEASED_TOOLS = {"iperf3", "nuttcp"}
 
-        results[dest_ip] = {
-            "min_rtt": min_rtt,
-            "avg_rtt": avg_rtt,
-            "max_rtt": max_rtt,
-            "mdev_rtt": mdev_rtt,
-            "packet_loss": packet_loss
-        }
+# Default concurrent runs per tool (0: unlimited); override with --concurrency
+TOOL_CONCURRENCY = {"ping": 0, "iperf3": 1, "nuttcp": 1, "traceroute": 4}
 
-    return results
+# Default per-command timeout in seconds; override with --timeout
+TOOL_TIMEOUTS = {"ping": 30, "iperf3": 90, "nuttcp": 60, "traceroute": 120}
 
 def setup_logger(output_dir):
     """Set up logging to file and console."""
@@ -125,13 +60,17 @@ def setup_logger(output_dir):
     logger.info(f"Logging to {log_file}")
     return logger
 
-def run_tool(tool, base_cmd, host, output_dir, logger):
-    timestamp = datetime.utcnow().strftime('%Y%m%d-%H%M%SZ')
-    category_dir = os.path.join(output_dir, tool)
-    os.makedirs(category_dir, exist_ok=True)
-
-    output_file = f"{category_dir}/{host.replace(':', '_')}_{tool}_{timestamp}.json"
+@lru_cache(maxsize=None)
+def iperf3_json_stream():
+    """Whether the installed iperf3 has --json-stream (3.17 or newer); probed once."""
+    try:
+        out = subprocess.run(["iperf3", "--version"], capture_output=True, text=True, timeout=10).stdout
+    except (OSError, subprocess.SubprocessError):
+        return False
+    match = re.search(r"iperf (\d+)\.(\d+)", out)
+    return bool(match) and (int(match.group(1)), int(match.group(2))) >= (3, 17)
 
+def build_tool_cmd(tool, base_cmd, host):
     cmd = list(base_cmd)
     # Add host where necessary
     if tool == "iperf3":
@@ -140,35 +79,214 @@ def run_tool(tool, base_cmd, host, output_dir, logger):
         cmd.insert(c_index + 1, host)
         # Add other options after
         cmd.extend(["-P", "4", "-t", "30", "-i", "10", "-O", "10", "-J"])
+        if iperf3_json_stream():
+            # One JSON event per line, so intervals are parsed as they arrive
+            cmd.append("--json-stream")
     else:
         cmd.append(host)
+    return cmd
+
+def apply_placement(tool, cmd, placement):
+    """
+    Pin *cmd* to a resolved cpu_affinity placement. iperf3 pinned to a single
+    CPU uses its own -A; anything else gets the CPU set applied to the child
+    before exec. Memory is bound to the NUMA node with numactl when both are
+    known. Returns (cmd, CPUs for run_command or None, affinity metadata).
+    """
+    affinity = {**placement, "membind": False}
+    cpus = None
+    if tool == "iperf3" and len(placement["cpus"]) == 1:
+        cmd = cmd + ["-A", str(placement["cpus"][0])]
+        affinity["method"] = "iperf3 -A"
+    else:
+        cpus = placement["cpus"]
+        affinity["method"] = "sched_setaffinity"
+    prefix = numactl_prefix(placement["numa_node"])
+    if prefix:
+        cmd = prefix + cmd
+        affinity["membind"] = True
+    return cmd, cpus, affinity
+
+async def run_command(cmd, timeout, on_line, tail_lines=20, cpus=None):
+    """
+    Run *cmd* with stderr folded into stdout, passing each output line to
+    *on_line* as it is read. Returns (returncode, last *tail_lines* lines);
+    on timeout the process group is killed and asyncio.TimeoutError is raised.
+    With *cpus* the child is restricted to those CPUs before it execs.
+    """
+    # Own process group, so a timeout also kills anything the tool forked
+    # (which would otherwise keep the output pipe open)
+    preexec = (lambda: os.sched_setaffinity(0, cpus)) if cpus else None
+    proc = await asyncio.create_subprocess_exec(*cmd, stdout=asyncio.subprocess.PIPE, stderr=asyncio.subprocess.STDOUT,
+                                                start_new_session=True, limit=1 << 20, preexec_fn=preexec)
+    tail = deque(maxlen=tail_lines)
+
+    async def _pump():
+        async for raw in proc.stdout:
+            line = raw.decode(errors="replace").rstrip("\n")
+            tail.append(line)
+            on_line(line)
+        await proc.wait()
 
-    logger.info(f"Running {tool} to {host}")
-    logger.debug(f"Command: {' '.join(cmd)}")
+    try:
+        await asyncio.wait_for(_pump(), timeout)
+    except asyncio.TimeoutError:
+        try:
+            os.killpg(proc.pid, signal.SIGKILL)
+        except ProcessLookupError:
+            pass
+        await proc.wait()
+        raise
+    return proc.returncode, "\n".join(tail)
+
+class ToolLimits:
+    """
+    Concurrency limits shared by all runs: one semaphore per tool (tools
+    without a limit run unthrottled) and one lock per NIC for LEASED_TOOLS.
+    """
+
+    def __init__(self, concurrency):
+        self._tools = {tool: asyncio.Semaphore(n) for tool, n in concurrency.items() if n > 0}
+        self._nics = {}
+
+    def tool(self, tool):
+        return self._tools.get(tool) or nullcontext()
+
+    def nic(self, tool):
+        if tool not in LEASED_TOOLS:
+            return nullcontext()
+        # Direct tools do not bind a source address, so they all share the default-route NIC
+        return self._nics.setdefault(interface_for(None), asyncio.Lock())
+
+async def run_tool(tool, base_cmd, host, output_dir, logger, limits, timeout, lease_options=None, placement=None):
+    """Run one tool against one host; returns "ok", "failed", "timeout" or "skipped"."""
+    category_dir = os.path.join(output_dir, tool)
+    os.makedirs(category_dir, exist_ok=True)
+    cmd = build_tool_cmd(tool, base_cmd, host)
+    cpus = affinity = None
+    if placement:
+        cmd, cpus, affinity = apply_placement(tool, cmd, placement)
+
+    queued = time.monotonic()
+    async with limits.tool(tool), limits.nic(tool):
+        timestamp = datetime.utcnow().strftime('%Y%m%d-%H%M%SZ')
+        output_file = f"{category_dir}/{host.replace(':', '_')}_{tool}_{timestamp}.json"
+        meta = {"tool": tool, "host": host, "time": timestamp, "timeout_s": timeout,
+                "queue_wait_s": round(time.monotonic() - queued, 3)}
+        if affinity:
+            meta["affinity"] = affinity
+        lease = None
+        if lease_options and tool in LEASED_TOOLS:
+            lease = ThroughputLease(keys=lease_keys(host), owner=f"direct {tool} {host}", logger=logger, **lease_options)
+            try:
+                # Waiting for the lease blocks; keep it off the event loop
+                await asyncio.to_thread(lease.acquire)
+            except LeaseTimeout as e:
+                logger.error(f"Skipping {tool} to {host}: {e}")
+                return "skipped"
+            meta["lease_wait_s"] = lease.wait_s
+            meta["lease_keys"] = lease.keys
+            if lease.recovered:
+                meta["lease_recovered"] = lease.recovered
+
+        logger.info(f"Running {tool} to {host}")
+        logger.debug(f"Command: {' '.join(cmd)}")
+        # Per-probe / per-interval samples are appended as they arrive, so a
+        # run cut short by its timeout still leaves what it measured
+        parser = STREAM_PARSERS[tool]()
+        samples_file = f"{os.path.splitext(output_file)[0]}.samples.ndjson"
+        meta["samples"] = 0
+
+        def _on_line(line):
+            for sample in parser.feed(line):
+                samples.write(json.dumps(sample) + "\n")
+                meta["samples"] += 1
+
+        started = time.monotonic()
+        try:
+            with open(samples_file, "w") as samples:
+                returncode, tail = await run_command(cmd, timeout, _on_line, cpus=cpus)
+        except asyncio.TimeoutError:
+            logger.error(f"Timeout running {tool} on {host} after {timeout:g}s ({meta['samples']} samples kept)")
+            return "timeout"
+        except OSError as e:
+            logger.error(f"Error running {tool} on {host}: {e}")
+            return "failed"
+        finally:
+            if lease is not None:
+                lease.release()
+        meta["duration_s"] = round(time.monotonic() - started, 3)
+
+    if returncode != 0:
+        logger.error(f"Error running {tool} on {host}: exit status {returncode}")
+        logger.debug(tail)
+        return "failed"
 
     try:
-        result = subprocess.run(cmd, stdout=subprocess.PIPE, stderr=subprocess.STDOUT, text=True, check=True)
-        output = result.stdout
-        if tool == "ping":
-            output = json.dumps(parse_ping_output(result.stdout), indent=4)
-        elif tool == "nuttcp":
-            output = json.dumps(parse_nuttcp_output(result.stdout), indent=4)
-        elif tool == "traceroute":
-            output = json.dumps(parse_traceroute_output(result.stdout), indent=4)
-
-        with open(output_file, "w") as f:
-            f.write(output)
-        logger.info(f"Completed {tool} to {host}, output saved to {output_file}")
-    except subprocess.CalledProcessError as e:
-        logger.error(f"Error running {tool} on {host}: {e}")
+        output = parser.result()
+    except ValueError as e:
+        logger.error(f"Unparsable {tool} output from {host}: {e}")
+        return "failed"
+    with open(output_file, "w") as f:
+        json.dump(output, f, indent=4)
+    # Run metadata next to the raw tool output (e.g. time spent waiting for a slot or the lease)
+    with open(f"{os.path.splitext(output_file)[0]}.meta.json", "w") as f:
+        json.dump(meta, f, indent=4)
+    logger.info(f"Completed {tool} to {host}, output saved to {output_file}")
+    return "ok"
+
+async def run_all(hosts, tools, output_dir, logger, concurrency, timeouts, lease_options=None, placements=None):
+    """Run every host x tool pair concurrently within the per-tool and per-NIC limits."""
+    limits = ToolLimits(concurrency)
+    placements = placements or {}
+    pairs = [(host, tool) for host in hosts for tool in tools]
+    outcomes = await asyncio.gather(*(
+        run_tool(tool, TOOLS[tool], host, output_dir, logger, limits, timeouts[tool], lease_options,
+                 placements.get(tool))
+        for host, tool in pairs
+    ))
+    return {outcome: outcomes.count(outcome) for outcome in sorted(set(outcomes))}
+
+def parse_tool_values(values, defaults, kind):
+    """Apply TOOL=N overrides from the command line on top of *defaults*."""
+    result = dict(defaults)
+    for item in values or []:
+        tool, sep, value = item.partition("=")
+        if not sep or tool not in TOOLS:
+            raise argparse.ArgumentTypeError(f"expected TOOL=N with TOOL one of {', '.join(TOOLS)}: {item!r}")
+        result[tool] = kind(value)
+    return result
 
 def main():
     parser = argparse.ArgumentParser(description="Run network tools directly and save output.")
     parser.add_argument("--hosts", nargs="+", required=True, help="Target hosts")
     parser.add_argument("--output-dir", default="./direct_results", help="Directory to save outputs")
     parser.add_argument("--tools", nargs="+", choices=list(TOOLS.keys()), default=list(TOOLS.keys()), help="Tools to run (default: all)")
+    parser.add_argument("--concurrency", nargs="+", metavar="TOOL=N",
+                        help="Max concurrent runs per tool, 0 for unlimited (default: "
+                             + " ".join(f"{t}={n}" for t, n in TOOL_CONCURRENCY.items() if t in TOOLS) + ")")
+    parser.add_argument("--timeout", nargs="+", metavar="TOOL=SECONDS",
+                        help="Per-command timeout per tool (default: "
+                             + " ".join(f"{t}={n}" for t, n in TOOL_TIMEOUTS.items() if t in TOOLS) + ")")
+    parser.add_argument("--affinity", nargs="+", metavar="TOOL=SPEC",
+                        help="CPU/NUMA placement per tool: a CPU list (2-3,6), node:N, or auto for the "
+                             "NIC's NUMA node (e.g. iperf3=auto nuttcp=node:1; default: unpinned)")
+    parser.add_argument("--lease-dir", default=DEFAULT_LEASE_DIR,
+                        help="Shared lease directory, same as the pScheduler runner's (default: $LEASE_DIR or /leases; '' disables)")
+    parser.add_argument("--lease-timeout", type=float, default=1800.0,
+                        help="Max seconds to wait for a busy NIC/destination lease (default: 1800)")
+    parser.add_argument("--lease-max-hold", type=float, default=900.0,
+                        help="Seconds after which a lease is considered stale (default: 900)")
 
     args = parser.parse_args()
+    try:
+        concurrency = parse_tool_values(args.concurrency, TOOL_CONCURRENCY, int)
+        timeouts = parse_tool_values(args.timeout, TOOL_TIMEOUTS, float)
+        # Direct tools leave through the default-route NIC (see ToolLimits.nic)
+        placements = {tool: resolve_placement(spec, source_interface(None))
+                      for tool, spec in parse_tool_values(args.affinity, {}, str).items()}
+    except (argparse.ArgumentTypeError, ValueError) as e:
+        parser.error(str(e))
 
     os.makedirs(args.output_dir, exist_ok=True)
     logger = setup_logger(args.output_dir)
@@ -176,11 +294,25 @@ def main():
     logger.info(f"Starting direct network tool tests for hosts: {', '.join(args.hosts)}")
     logger.info(f"Tools to run: {', '.join(args.tools)}")
 
-    for host in args.hosts:
-        for tool in args.tools:
-            run_tool(tool, TOOLS[tool], host, args.output_dir, logger)
+    lease_options = None
+    if args.lease_dir:
+        try:
+            os.makedirs(args.lease_dir, exist_ok=True)
+            lease_options = {"lease_dir": args.lease_dir, "timeout": args.lease_timeout, "max_hold": args.lease_max_hold}
+        except OSError as e:
+            logger.warning(f"Lease directory {args.lease_dir} unusable ({e}); running without leases")
+
+    for tool, placement in placements.items():
+        if placement is None:
+            logger.warning(f"NUMA node of {source_interface(None) or 'the default-route NIC'} unknown; running {tool} unpinned")
+        else:
+            logger.info(f"Pinning {tool} to CPUs {placement['cpus']}"
+                        + (f" on NUMA node {placement['numa_node']}" if placement["numa_node"] is not None else ""))
+
+    outcomes = asyncio.run(run_all(args.hosts, args.tools, args.output_dir, logger, concurrency, timeouts, lease_options,
+                                   placements))
 
-    logger.info("All direct tests completed.")
+    logger.info("All direct tests completed: " + ", ".join(f"{n} {outcome}" for outcome, n in outcomes.items()))
 
 if __name__ == "__main__":
     main()
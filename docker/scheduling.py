@@ -0,0 +1,170 @@
+#!/usr/bin/env python3
+"""
+When the pScheduler runner runs: the run lock shared by cron-launched runs
+and the daemon, cron expressions, and the resident daemon loop that calls
+one run per cron slot.
+"""
+import fcntl
+import logging
+import os
+import signal
+import threading
+from datetime import datetime, timedelta
+from typing import Optional
+
+from result_store import write_json_atomic
+
+
+def acquire_run_lock(output_dir: str) -> Optional[int]:
+    """
+    Non-blocking exclusive lock on <output-dir>/state/runner.lock, shared by
+    cron-launched runs and the daemon. Returns the fd to close on release, or
+    None if another run holds it. The kernel drops the lock if we die.
+    """
+    state_dir = os.path.join(output_dir, "state")
+    os.makedirs(state_dir, exist_ok=True)
+    fd = os.open(os.path.join(state_dir, "runner.lock"), os.O_RDWR | os.O_CREAT, 0o644)
+    try:
+        fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+    except OSError:
+        os.close(fd)
+        return None
+    os.ftruncate(fd, 0)
+    os.write(fd, f"{os.getpid()}\n".encode())
+    return fd
+
+
+class CronSchedule:
+    """
+    Standard 5-field cron expression: minute hour day-of-month month day-of-week.
+    Supports '*', lists, ranges and steps (e.g. '0 */6 * * *', '15 1-5 * * 1,3').
+    As in cron, when both day fields are restricted either may match.
+    """
+
+    _BOUNDS = [(0, 59), (0, 23), (1, 31), (1, 12), (0, 7)]
+
+    def __init__(self, expr: str):
+        fields = expr.split()
+        if len(fields) != 5:
+            raise ValueError(f"expected 5 fields, got {len(fields)} in '{expr}'")
+        self.expr = expr
+        self.minutes, self.hours, self.days, self.months, weekdays = (
+            self._parse_field(f, lo, hi) for f, (lo, hi) in zip(fields, self._BOUNDS)
+        )
+        self.weekdays = {d % 7 for d in weekdays}  # 7 is Sunday too
+        self._any_day = fields[2] == "*"
+        self._any_weekday = fields[4] == "*"
+
+    @staticmethod
+    def _parse_field(field: str, lo: int, hi: int) -> set:
+        values = set()
+        for part in field.split(","):
+            rng, _, step_s = part.partition("/")
+            step = int(step_s) if step_s else 1
+            if rng == "*":
+                start, end = lo, hi
+            elif "-" in rng:
+                a, b = rng.split("-", 1)
+                start, end = int(a), int(b)
+            else:
+                start = int(rng)
+                end = hi if step_s else start
+            if step < 1 or start < lo or end > hi or start > end:
+                raise ValueError(f"field '{field}' out of range {lo}-{hi}")
+            values.update(range(start, end + 1, step))
+        return values
+
+    def _day_matches(self, dt: datetime) -> bool:
+        dom = dt.day in self.days
+        dow = (dt.weekday() + 1) % 7 in self.weekdays  # cron: Sunday = 0
+        if self._any_day and self._any_weekday:
+            return True
+        if self._any_day:
+            return dow
+        if self._any_weekday:
+            return dom
+        return dom or dow
+
+    def next_after(self, dt: datetime) -> datetime:
+        """First matching minute strictly after *dt* (same tzinfo as *dt*)."""
+        t = dt.replace(second=0, microsecond=0) + timedelta(minutes=1)
+        limit = t + timedelta(days=366 * 5)
+        while t < limit:
+            if t.month not in self.months:
+                t = (t.replace(day=1, hour=0, minute=0) + timedelta(days=32)).replace(day=1)
+            elif not self._day_matches(t):
+                t = t.replace(hour=0, minute=0) + timedelta(days=1)
+            elif t.hour not in self.hours:
+                t = t.replace(minute=0) + timedelta(hours=1)
+            elif t.minute not in self.minutes:
+                t += timedelta(minutes=1)
+            else:
+                return t
+        raise ValueError(f"cron expression '{self.expr}' never matches")
+
+
+def run_daemon(output_dir: str, schedule: CronSchedule, run_cycle, logger: logging.Logger) -> None:
+    """
+    Stay resident and call run_cycle() on the cron schedule, with the run
+    lock held; its return value is kept as the last-run stats. Archiver
+    clients, the archival queue and resolved sources live for the whole process.
+
+    A run never starts while the previous one (or a cron-launched run holding
+    the run lock) is still going; slots that pass meanwhile are skipped and
+    counted. The next-run time and last-run stats are kept in
+    <output-dir>/state/daemon_status.json.
+    """
+    stop = threading.Event()
+
+    def _on_signal(signum, _frame):
+        logger.info(f"Received signal {signum}; daemon stopping after the current run")
+        stop.set()
+
+    signal.signal(signal.SIGTERM, _on_signal)
+    signal.signal(signal.SIGINT, _on_signal)
+
+    status_file = os.path.join(output_dir, "state", "daemon_status.json")
+    status = {
+        "pid": os.getpid(),
+        "cron": schedule.expr,
+        "started": datetime.now().astimezone().isoformat(),
+        "runs": 0,
+        "skipped_slots": 0,
+        "next_run": None,
+        "last_run": None,
+    }
+    logger.info(f"Daemon mode: schedule '{schedule.expr}' (status in {status_file})")
+
+    next_run = schedule.next_after(datetime.now().astimezone())
+    while not stop.is_set():
+        status["next_run"] = next_run.isoformat()
+        write_json_atomic(status_file, status)
+        logger.info(f"Daemon: next run at {next_run.isoformat()}")
+
+        if stop.wait(max(0.0, (next_run - datetime.now().astimezone()).total_seconds())):
+            break
+
+        lock_fd = acquire_run_lock(output_dir)
+        if lock_fd is None:
+            logger.warning("Daemon: another run is still in progress (run lock held); skipping this slot")
+            status["skipped_slots"] += 1
+        else:
+            try:
+                status["last_run"] = run_cycle()
+                status["runs"] += 1
+            except Exception as e:
+                logger.exception(f"Daemon: run failed: {e}")
+            finally:
+                os.close(lock_fd)
+
+        # Slots that came due while we were running are skipped, not queued
+        now = datetime.now().astimezone()
+        following = schedule.next_after(next_run)
+        while following <= now:
+            status["skipped_slots"] += 1
+            logger.warning(f"Daemon: skipped slot {following.isoformat()} (previous run still going)")
+            following = schedule.next_after(following)
+        next_run = following
+
+    status["next_run"] = None
+    write_json_atomic(status_file, status)
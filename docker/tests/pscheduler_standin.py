@@ -0,0 +1,125 @@
+"""
+Minimal pScheduler REST API stand-in on http.server, covering what
+PSchedulerAPIClient uses: POST /tasks, GET <task>/runs and GET <run>.
+Every task gets one run that is already finished with a canned result.
+
+Run it on its own to exercise the runner without pScheduler installed:
+
+    python tests/pscheduler_standin.py --port 8080
+    python pscheduler_test_runner.py --pscheduler-api http://127.0.0.1:8080/pscheduler ...
+"""
+import argparse
+import json
+import threading
+import time
+from datetime import datetime, timedelta, timezone
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+DEFAULT_RESULT = {
+    "schema": 1,
+    "succeeded": True,
+    "roundtrips": [{"seq": 1, "rtt": "PT0.0012S", "ttl": 61}, {"seq": 2, "rtt": "PT0.0011S", "ttl": 61}],
+}
+
+
+class _Server(ThreadingHTTPServer):
+    daemon_threads = True
+    # Don't wait for a handler stuck in post_delay when shutting down
+    block_on_close = False
+
+
+class PSchedulerStandIn:
+    """
+    Serve the stand-in API on 127.0.0.1 in a background thread:
+
+        with PSchedulerStandIn(post_delay=2.0) as api:
+            client = PSchedulerAPIClient(api.base_url, timeout=0.5)
+
+    *post_delay* holds the POST /tasks response after the task is created,
+    like an API that accepted the task but answered too late. Posted task
+    bodies are kept in *tasks*.
+    """
+
+    def __init__(self, result: dict = None, post_delay: float = 0.0, port: int = 0):
+        self.result = DEFAULT_RESULT if result is None else result
+        self.post_delay = post_delay
+        self.tasks = []
+        self._lock = threading.Lock()
+        self._server = _Server(("127.0.0.1", port), self._handler())
+        self.base_url = f"http://127.0.0.1:{self._server.server_port}/pscheduler"
+        self._thread = None
+
+    def _handler(self):
+        standin = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def log_message(self, fmt, *args):
+                pass
+
+            def _reply(self, status: int, body) -> None:
+                data = json.dumps(body).encode()
+                self.send_response(status)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(data)))
+                self.end_headers()
+                self.wfile.write(data)
+
+            def do_POST(self):
+                if self.path != "/pscheduler/tasks":
+                    return self._reply(404, "Not found")
+                task = json.loads(self.rfile.read(int(self.headers.get("Content-Length", 0))))
+                with standin._lock:
+                    standin.tasks.append(task)
+                    number = len(standin.tasks)
+                if standin.post_delay:
+                    time.sleep(standin.post_delay)
+                self._reply(200, f"{standin.base_url}/tasks/{number}")
+
+            def do_GET(self):
+                parts = self.path.split("?")[0].strip("/").split("/")
+                # pscheduler/tasks/<n>/runs[/<run>]
+                if len(parts) < 4 or parts[:2] != ["pscheduler", "tasks"] or parts[3] != "runs":
+                    return self._reply(404, "Not found")
+                task_url = f"{standin.base_url}/tasks/{parts[2]}"
+                if len(parts) == 4:
+                    return self._reply(200, [f"{task_url}/runs/1"])
+                end = datetime.now(timezone.utc)
+                self._reply(200, {
+                    "state": "finished",
+                    "start-time": (end - timedelta(seconds=10)).isoformat(),
+                    "end-time": end.isoformat(),
+                    "result-merged": standin.result,
+                })
+
+        return Handler
+
+    def start(self) -> "PSchedulerStandIn":
+        self._thread = threading.Thread(target=self._server.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self) -> None:
+        self._server.shutdown()
+        self._server.server_close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.stop()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Serve a minimal pScheduler REST API stand-in.")
+    parser.add_argument("--port", type=int, default=8080, help="Port to listen on (default: 8080)")
+    args = parser.parse_args()
+    standin = PSchedulerStandIn(port=args.port)
+    print(f"pScheduler stand-in at {standin.base_url}")
+    try:
+        standin._server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == "__main__":
+    main()
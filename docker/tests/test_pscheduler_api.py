@@ -0,0 +1,77 @@
+import json
+import logging
+import socket
+from types import SimpleNamespace
+from unittest import mock
+
+import pytest
+
+import pscheduler_test_runner as runner
+from pscheduler_standin import DEFAULT_RESULT, PSchedulerStandIn
+
+LOGGER = logging.getLogger("test_pscheduler_api")
+
+
+def _entry():
+    return {"category": "rtt", "tool": "auto", "dest": "192.0.2.10", "source": None,
+            "direction": "forward", "time": "20261019T000000Z"}
+
+
+def _run(api_client, output_dir, entry=None):
+    entry = entry or _entry()
+    outcome = runner._run_pscheduler_test(
+        entry, runner.NodeRef(ip="192.0.2.10", name="shore"), str(output_dir), LOGGER,
+        archiver_clients={}, archive_queue=None, api_client=api_client, archive_summary=False,
+        segment_store=None, timer=runner.PhaseTimer(),
+    )
+    return outcome, entry
+
+
+@pytest.fixture
+def run_checked():
+    with mock.patch.object(runner, "run_checked") as patched:
+        yield patched
+
+
+def test_api_success(tmp_path, run_checked):
+    with PSchedulerStandIn() as api:
+        client = runner.PSchedulerAPIClient(api.base_url, poll_interval=0.01)
+        outcome, entry = _run(client, tmp_path)
+
+    assert outcome == runner.OUTCOME_OK
+    assert len(api.tasks) == 1
+    assert api.tasks[0]["test"]["type"] == "rtt"
+    assert api.tasks[0]["test"]["spec"]["dest"] == "192.0.2.10"
+    with open(entry["stored"]) as f:
+        assert json.load(f) == DEFAULT_RESULT
+    assert entry["test_runtime_s"] == pytest.approx(10.0)
+    run_checked.assert_not_called()
+
+
+def test_timeout_after_post_does_not_rerun_with_cli(tmp_path, run_checked):
+    # The task was created; rerunning it with the CLI would test the path twice
+    with PSchedulerStandIn(post_delay=2.0) as api:
+        client = runner.PSchedulerAPIClient(api.base_url, timeout=0.3, poll_interval=0.01)
+        outcome, entry = _run(client, tmp_path)
+
+    assert outcome == runner.OUTCOME_FAILED
+    assert len(api.tasks) == 1
+    assert "stored" not in entry
+    run_checked.assert_not_called()
+
+
+def test_unreachable_api_falls_back_to_cli(tmp_path, run_checked):
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        port = s.getsockname()[1]
+    client = runner.PSchedulerAPIClient(f"http://127.0.0.1:{port}/pscheduler", timeout=1.0)
+    stdout = json.dumps(DEFAULT_RESULT)
+    run_checked.return_value = (True, SimpleNamespace(stdout=stdout))
+
+    outcome, entry = _run(client, tmp_path)
+
+    assert outcome == runner.OUTCOME_OK
+    run_checked.assert_called_once()
+    assert run_checked.call_args.args[0][:2] == ["pscheduler", "task"]
+    with open(entry["stored"]) as f:
+        assert f.read() == stdout
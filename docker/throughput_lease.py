@@ -0,0 +1,187 @@
+#!/usr/bin/env python3
+"""
+Cross-process leases for bandwidth-heavy tests.
+
+The pScheduler runner (testpoint container), run_direct_tools.py (tool
+container) and ad-hoc runs take a lease in the same shared directory before
+starting a throughput test, so two measurements never share a NIC or a
+destination at the same time.
+
+Each lease key is an flock on <lease-dir>/<key>.lock; the holder writes who
+it is and when its lease expires into the file. The kernel drops an flock
+when its process exits, so a crashed holder frees its leases at once. A
+holder that hangs past its expiry is stale: a waiter replaces the lock file
+(the hung process keeps its lock on the unlinked file) and proceeds.
+"""
+import fcntl
+import json
+import logging
+import os
+import re
+import socket
+import time
+from typing import List, Optional
+
+try:
+    import netifaces  # optional: map a source IP to its interface
+except ImportError:
+    netifaces = None
+
+# Shared volume mounted into both containers (see docker-compose-*.yml)
+DEFAULT_LEASE_DIR = os.environ.get("LEASE_DIR") or "/leases"
+
+
+class LeaseTimeout(Exception):
+    """A lease could not be acquired within the wait timeout."""
+
+
+def _safe_key(value: str) -> str:
+    return re.sub(r"[^A-Za-z0-9_.-]", "_", value)
+
+
+def _default_interface() -> Optional[str]:
+    try:
+        return netifaces.gateways().get("default", {}).get(netifaces.AF_INET, (None, None))[1]
+    except Exception:
+        return None
+
+
+def interface_for(source: Optional[str]) -> str:
+    """
+    NIC key for a test bound to *source* (an IP or interface name). Unbound
+    tests, and sources on the default-route interface, share "default".
+    """
+    if not source:
+        return "default"
+    if netifaces is None:
+        return source
+    default = _default_interface()
+    for ifname in netifaces.interfaces():
+        addrs = netifaces.ifaddresses(ifname)
+        ips = {a.get("addr", "").split("%")[0]
+               for fam in (netifaces.AF_INET, netifaces.AF_INET6) for a in addrs.get(fam, [])}
+        if source == ifname or source in ips:
+            return "default" if ifname == default else ifname
+    return source
+
+
+def lease_keys(dest: str, source: Optional[str] = None) -> List[str]:
+    """Lease keys covering the NIC used to reach *dest* and *dest* itself."""
+    return sorted({f"nic-{_safe_key(interface_for(source))}", f"dst-{_safe_key(dest)}"})
+
+
+class ThroughputLease:
+    """
+    Exclusive lease on one or more keys, used as a context manager:
+
+        with ThroughputLease(lease_dir, lease_keys(dest, source), owner="...") as lease:
+            ...run the test...
+        lease.wait_s  # seconds spent waiting
+
+    Keys are acquired in sorted order, so leases on overlapping key sets can
+    not deadlock. Waits up to *timeout* seconds in total (LeaseTimeout after
+    that); a lease whose holder is past *max_hold* seconds is taken over.
+    """
+
+    def __init__(self, lease_dir: str, keys: List[str], *, owner: str, timeout: float = 1800.0,
+                 max_hold: float = 900.0, poll: float = 1.0, logger: Optional[logging.Logger] = None):
+        self.lease_dir = lease_dir
+        self.keys = sorted(keys)
+        self.owner = owner
+        self.timeout = timeout
+        self.max_hold = max_hold
+        self.poll = poll
+        self.logger = logger or logging.getLogger(__name__)
+        self.wait_s = 0.0
+        self.recovered = []  # keys taken over from a stale holder
+        self._fds = []
+
+    def __enter__(self):
+        return self.acquire()
+
+    def __exit__(self, *exc):
+        self.release()
+
+    def acquire(self) -> "ThroughputLease":
+        os.makedirs(self.lease_dir, exist_ok=True)
+        started = time.monotonic()
+        deadline = started + self.timeout
+        try:
+            for key in self.keys:
+                self._fds.append(self._acquire_one(key, deadline))
+        except BaseException:
+            self.release()
+            raise
+        self.wait_s = round(time.monotonic() - started, 3)
+        return self
+
+    def release(self) -> None:
+        for fd in self._fds:
+            try:
+                os.ftruncate(fd, 0)
+            finally:
+                os.close(fd)  # releases the flock
+        self._fds = []
+
+    def _acquire_one(self, key: str, deadline: float) -> int:
+        path = os.path.join(self.lease_dir, f"{key}.lock")
+        waiting = False
+        while True:
+            fd = os.open(path, os.O_RDWR | os.O_CREAT, 0o666)
+            try:
+                fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except BlockingIOError:
+                holder, ino = self._read_holder(fd)
+                os.close(fd)
+                if holder.get("expires", float("inf")) < time.time():
+                    self.logger.warning(f"Lease {key}: holder {holder.get('owner')} is past its expiry; taking over")
+                    self._remove_stale(path, ino)
+                    self.recovered.append(key)
+                    continue
+                if time.monotonic() >= deadline:
+                    raise LeaseTimeout(f"lease {key} still held by {holder.get('owner', 'unknown')}")
+                if not waiting:
+                    self.logger.info(f"Lease {key} held by {holder.get('owner', 'unknown')}; waiting")
+                    waiting = True
+                time.sleep(min(self.poll, max(0.0, deadline - time.monotonic())))
+                continue
+
+            # Stale recovery may have replaced the file between open() and flock()
+            try:
+                current = os.stat(path).st_ino == os.fstat(fd).st_ino
+            except FileNotFoundError:
+                current = False
+            if not current:
+                os.close(fd)
+                continue
+
+            info = {
+                "owner": self.owner,
+                "host": socket.gethostname(),
+                "pid": os.getpid(),
+                "acquired": time.time(),
+                "expires": time.time() + self.max_hold,
+            }
+            os.ftruncate(fd, 0)
+            os.pwrite(fd, json.dumps(info).encode(), 0)
+            return fd
+
+    @staticmethod
+    def _read_holder(fd: int) -> tuple[dict, int]:
+        try:
+            data = os.pread(fd, 4096, 0)
+            holder = json.loads(data) if data else {}
+        except (OSError, ValueError):
+            holder = {}
+        return holder, os.fstat(fd).st_ino
+
+    def _remove_stale(self, path: str, ino: int) -> None:
+        # Serialized, and only if the file is still the stale one, so two
+        # waiters never remove each other's fresh lease
+        with open(os.path.join(self.lease_dir, ".recovery.lock"), "a") as guard:
+            fcntl.flock(guard, fcntl.LOCK_EX)
+            try:
+                if os.stat(path).st_ino == ino:
+                    os.unlink(path)
+            except FileNotFoundError:
+                pass
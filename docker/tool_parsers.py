@@ -0,0 +1,451 @@
+#!/usr/bin/env python3
+"""
+Line-streaming parsers for ping, traceroute, nuttcp and iperf3 output.
+
+Each parser is fed one line at a time, straight from the tool's pipe:
+feed(line) yields the samples found in that line (a ping reply, an
+interval, a hop) as soon as it is read, and result() returns the parsed
+document once the tool has exited. Only running statistics are kept in
+memory, so long runs never buffer their output.
+
+Used by run_direct_tools.py (tool container) and copied next to the
+pScheduler runner (testpoint container) for offline reprocessing of saved
+output. Run as a script to check the parsers against the golden corpus in
+parser_corpus/ or to benchmark them:
+
+    python tool_parsers.py --check [--update]
+    python tool_parsers.py --bench [--seconds 2]
+"""
+import argparse
+import bisect
+import json
+import os
+import re
+import sys
+import time
+from typing import Any, Dict, Iterator, List, Optional
+
+# Golden corpus: <corpus>/<tool>/<case>.txt (tool output) and <case>.json (expected result())
+DEFAULT_CORPUS_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "parser_corpus")
+
+# An IPv4 or IPv6 address (no zone index, no embedded IPv4)
+_IP = r'(?:\d{1,3}(?:\.\d{1,3}){3}|[0-9A-Fa-f]{0,4}(?::[0-9A-Fa-f]{0,4}){2,7})'
+
+
+class P2Quantile:
+    """
+    Streaming estimate of one quantile with the P-square algorithm (Jain &
+    Chlamtac, 1985): five markers, constant memory however many samples are
+    added. Exact up to five samples.
+    """
+
+    def __init__(self, p: float):
+        self.p = p
+        self._count = 0
+        self._q = []  # marker heights
+        self._n = [0, 1, 2, 3, 4]  # marker positions
+        self._want = [0, 2 * p, 4 * p, 2 + 2 * p, 4]  # desired positions
+        self._step = [0, p / 2, p, (1 + p) / 2, 1]
+
+    def add(self, x: float) -> None:
+        q, n = self._q, self._n
+        self._count += 1
+        if len(q) < 5:
+            bisect.insort(q, x)
+            return
+        if x < q[0]:
+            q[0] = x
+        elif x > q[4]:
+            q[4] = x
+        k = min(max(bisect.bisect_right(q, x) - 1, 0), 3)
+        for i in range(k + 1, 5):
+            n[i] += 1
+        for i in range(5):
+            self._want[i] += self._step[i]
+        for i in (1, 2, 3):
+            d = self._want[i] - n[i]
+            if (d >= 1 and n[i + 1] - n[i] > 1) or (d <= -1 and n[i - 1] - n[i] < -1):
+                d = 1 if d > 0 else -1
+                # Piecewise-parabolic prediction, linear if that leaves the bracket
+                h = q[i] + d / (n[i + 1] - n[i - 1]) * (
+                    (n[i] - n[i - 1] + d) * (q[i + 1] - q[i]) / (n[i + 1] - n[i])
+                    + (n[i + 1] - n[i] - d) * (q[i] - q[i - 1]) / (n[i] - n[i - 1])
+                )
+                if not q[i - 1] < h < q[i + 1]:
+                    h = q[i] + d * (q[i + d] - q[i]) / (n[i + d] - n[i])
+                q[i] = h
+                n[i] += d
+
+    def value(self) -> Optional[float]:
+        q = self._q
+        if not q:
+            return None
+        if self._count <= 5:
+            # The markers are still the sorted samples themselves
+            return q[min(len(q) - 1, int(round(self.p * (len(q) - 1))))]
+        return q[2]
+
+
+class StreamStats:
+    """Count/min/max/mean/stdev (Welford) and P-square percentiles of a sample stream."""
+
+    PERCENTILES = (50, 90, 99)
+
+    def __init__(self):
+        self.count = 0
+        self.min = None
+        self.max = None
+        self._mean = 0.0
+        self._m2 = 0.0
+        self._quantiles = {pct: P2Quantile(pct / 100) for pct in self.PERCENTILES}
+
+    def add(self, x: float) -> None:
+        self.count += 1
+        self.min = x if self.min is None else min(self.min, x)
+        self.max = x if self.max is None else max(self.max, x)
+        delta = x - self._mean
+        self._mean += delta / self.count
+        self._m2 += delta * (x - self._mean)
+        for quantile in self._quantiles.values():
+            quantile.add(x)
+
+    def summary(self, digits: int = 3) -> Dict[str, Any]:
+        if not self.count:
+            return {"count": 0}
+        result = {
+            "count": self.count,
+            "min": round(self.min, digits),
+            "max": round(self.max, digits),
+            "mean": round(self._mean, digits),
+            "stdev": round((self._m2 / (self.count - 1)) ** 0.5 if self.count > 1 else 0.0, digits),
+        }
+        for pct, quantile in self._quantiles.items():
+            result[f"p{pct}"] = round(quantile.value(), digits)
+        return result
+
+
+class PingStream:
+    """ping (iputils or BSD-style): one sample per reply, plus the statistics block at the end."""
+
+    HEADER = re.compile(r'^PING \S+ \((.*?)\)')
+    HEADER_BARE = re.compile(r'^PING (\S+?)\(')
+    REPLY = re.compile(r'icmp_seq=(\d+).*?time=([0-9.]+) ms')
+    LOSS = re.compile(r'([0-9.]+)% packet loss')
+    RTT = re.compile(r'(?:rtt|round-trip) min/avg/max(?:/mdev|/stddev)? = ([0-9.]+)/([0-9.]+)/([0-9.]+)(?:/([0-9.]+))?')
+
+    def __init__(self):
+        self._results = {}
+        self._dest = None
+        self._rtt = None
+        self._loss = 0
+
+    def feed(self, line: str) -> Iterator[dict]:
+        if line.startswith("PING "):
+            # "PING host (addr) ..." or, for a literal IPv6 address, "PING addr(addr) ..."
+            match = self.HEADER.match(line) or self.HEADER_BARE.match(line)
+            if match:
+                self._dest = match.group(1)
+                self._rtt = StreamStats()
+                self._loss = 0
+                return
+        if self._dest is None:
+            return
+        match = self.REPLY.search(line)
+        if match:
+            rtt = float(match.group(2))
+            sample = {"dest": self._dest, "seq": int(match.group(1)), "rtt_ms": rtt}
+            if "(DUP!)" in line:
+                # Duplicates are not counted as received; keep them out of the statistics
+                sample["dup"] = True
+            else:
+                self._rtt.add(rtt)
+            yield sample
+            return
+        match = self.LOSS.search(line)
+        if match:
+            loss = float(match.group(1))
+            self._loss = int(loss) if loss.is_integer() else loss
+            return
+        match = self.RTT.search(line)
+        if match:
+            min_rtt, avg_rtt, max_rtt = map(float, match.group(1, 2, 3))
+            stats = self._rtt.summary()
+            self._results[self._dest] = {
+                "min_rtt": min_rtt,
+                "avg_rtt": avg_rtt,
+                "max_rtt": max_rtt,
+                "mdev_rtt": float(match.group(4) or 0.0),
+                "packet_loss": self._loss,
+                "probes": stats["count"],
+                **{f"rtt_{pct}": stats[pct] for pct in ("p50", "p90", "p99") if pct in stats},
+            }
+
+    def result(self) -> Dict[str, Dict[str, Any]]:
+        return self._results
+
+
+class TracerouteStream:
+    """
+    traceroute (IPv4 or IPv6, with or without -n): one sample per hop. A hop
+    answered by several routers lists all of them in "ips"; "ip" is the first.
+    """
+
+    HOP = re.compile(r'\s*(\d+)\s+(.+)')
+    IP = re.compile(rf'\(({_IP})\)')
+    IP_BARE = re.compile(rf'(?<![\w:.])({_IP})(?![\w:.])')
+    RTT = re.compile(r'(\d+(?:\.\d+)?)\s+ms')
+
+    def __init__(self):
+        self._hops = []
+
+    def feed(self, line: str) -> Iterator[dict]:
+        # Skip the header line
+        if line.lower().startswith("traceroute"):
+            return
+        match = self.HOP.match(line)
+        if match:
+            rest = match.group(2)
+            # Resolved names carry the address in parentheses; with -n it stands alone
+            ips = self.IP.findall(rest) or self.IP_BARE.findall(rest)
+            ips = list(dict.fromkeys(ips))
+            hop = {
+                'hop': int(match.group(1)),
+                'ip': ips[0] if ips else None,
+                'ips': ips,
+                'rtt_ms': [float(rtt) for rtt in self.RTT.findall(rest)],
+            }
+            self._hops.append(hop)
+            yield hop
+
+    def result(self) -> List[dict]:
+        return self._hops
+
+
+_NUTTCP_FIELD = re.compile(r'(\w+)=(\S+)')
+
+
+def _parse_nuttcp_fields(line: str) -> Dict[str, Any]:
+    fields = {}
+    for key, value in _NUTTCP_FIELD.findall(line):
+        # Attempt to convert to float or int where possible
+        try:
+            fields[key] = float(value) if '.' in value else int(value)
+        except ValueError:
+            fields[key] = value
+    return fields
+
+
+class NuttcpStream:
+    """
+    nuttcp -fparse: one sample per interval line. Later values win, so the
+    result carries the final summary line plus the interval rate statistics.
+    """
+
+    def __init__(self):
+        self._fields = {}
+        self._rate = StreamStats()
+
+    def feed(self, line: str) -> Iterator[dict]:
+        fields = _parse_nuttcp_fields(line)
+        if not fields:
+            return
+        self._fields.update(fields)
+        # The closing summary line is the one with CPU usage
+        if "rate_Mbps" in fields and "tx_cpu" not in fields and "rx_cpu" not in fields:
+            self._rate.add(float(fields["rate_Mbps"]))
+            yield fields
+
+    def result(self) -> Dict[str, Any]:
+        return {**self._fields, "interval_rate_Mbps": self._rate.summary()}
+
+
+class Iperf3Stream:
+    """
+    iperf3 --json-stream: one JSON event per line; each "interval" event is a
+    sample. The result keeps the "start" and "end" sections and the interval
+    throughput statistics, not the interval list. Plain -J output (older
+    iperf3) is buffered until its closing brace and then parsed as one
+    document; its intervals become samples too, so both paths give the same
+    result shape.
+    """
+
+    def __init__(self):
+        self._doc = {}
+        self._bps = StreamStats()
+        self._legacy = []
+
+    def feed(self, line: str) -> Iterator[dict]:
+        if self._legacy or not (line.startswith("{") and line.rstrip().endswith("}")):
+            self._legacy.append(line)
+            # The -J document closes with a "}" in column 0
+            if line.rstrip() == "}":
+                yield from self._parse_legacy(strict=False)
+            return
+        try:
+            event = json.loads(line)
+        except ValueError:
+            return
+        name, data = event.get("event"), event.get("data")
+        if name == "interval":
+            yield self._interval(data)
+        elif name in ("start", "end", "error"):
+            self._doc[name] = data
+
+    def _interval(self, data: dict) -> dict:
+        bps = (data.get("sum") or {}).get("bits_per_second")
+        if bps is not None:
+            self._bps.add(bps)
+        return data
+
+    def _parse_legacy(self, strict: bool) -> Iterator[dict]:
+        try:
+            doc = json.loads("\n".join(self._legacy))
+        except ValueError:
+            if strict:
+                raise
+            return
+        self._legacy = []
+        for interval in doc.pop("intervals", []):
+            yield self._interval(interval)
+        self._doc = doc
+
+    def result(self) -> Dict[str, Any]:
+        if self._legacy:
+            for _ in self._parse_legacy(strict=True):
+                pass
+        return {**self._doc, "interval_bps": self._bps.summary(digits=0)}
+
+
+STREAM_PARSERS = {
+    "ping": PingStream,
+    "traceroute": TracerouteStream,
+    "nuttcp": NuttcpStream,
+    "iperf3": Iperf3Stream,
+}
+
+
+def parse_stream(parser, text: str):
+    """Run a whole captured output through a stream parser; returns its result()."""
+    for line in text.splitlines():
+        for _ in parser.feed(line):
+            pass
+    return parser.result()
+
+
+def parse_ping_output(ping_output: str) -> Dict[str, Dict[str, Any]]:
+    """Parses the output of a ping command to extract RTT and packet loss statistics."""
+    return parse_stream(PingStream(), ping_output)
+
+
+def parse_traceroute_output(output: str) -> List[dict]:
+    return parse_stream(TracerouteStream(), output)
+
+
+def parse_nuttcp_output(output: str) -> Dict[str, Any]:
+    return parse_stream(NuttcpStream(), output)
+
+
+def _corpus_cases(corpus_dir: str):
+    """Yield (tool, case name, output path) for every *.txt in the corpus."""
+    for tool in sorted(STREAM_PARSERS):
+        tool_dir = os.path.join(corpus_dir, tool)
+        if not os.path.isdir(tool_dir):
+            continue
+        for name in sorted(os.listdir(tool_dir)):
+            if name.endswith(".txt"):
+                yield tool, name[:-4], os.path.join(tool_dir, name)
+
+
+def check_corpus(corpus_dir: str, update: bool = False) -> int:
+    """
+    Parse every corpus output and compare with its golden <case>.json (or,
+    with *update*, rewrite the golden files). Returns the number of mismatches.
+    """
+    failures = 0
+    for tool, case, path in _corpus_cases(corpus_dir):
+        with open(path) as f:
+            got = parse_stream(STREAM_PARSERS[tool](), f.read())
+        golden = f"{os.path.splitext(path)[0]}.json"
+        if update:
+            with open(golden, "w") as f:
+                json.dump(got, f, indent=2, sort_keys=True)
+                f.write("\n")
+            print(f"updated  {tool}/{case}")
+            continue
+        try:
+            with open(golden) as f:
+                expected = json.load(f)
+        except FileNotFoundError:
+            print(f"MISSING  {tool}/{case}: no {os.path.basename(golden)} (run with --update)")
+            failures += 1
+            continue
+        # Compare through JSON so tuples/ints/floats normalise the same way
+        if json.loads(json.dumps(got)) == expected:
+            print(f"ok       {tool}/{case}")
+        else:
+            print(f"FAIL     {tool}/{case}")
+            print(f"  expected: {json.dumps(expected, sort_keys=True)}")
+            print(f"  got:      {json.dumps(got, sort_keys=True)}")
+            failures += 1
+    return failures
+
+
+def bench_corpus(corpus_dir: str, seconds: float = 2.0) -> Dict[str, dict]:
+    """
+    Feed each tool's corpus through its parser repeatedly for about *seconds*
+    and report parsed lines/s and MB/s per tool.
+    """
+    texts = {}
+    for tool, _, path in _corpus_cases(corpus_dir):
+        with open(path) as f:
+            texts.setdefault(tool, []).append(f.read())
+    results = {}
+    for tool, outputs in texts.items():
+        lines = [text.splitlines() for text in outputs]
+        n_lines = sum(len(ls) for ls in lines)
+        n_bytes = sum(len(text.encode()) for text in outputs)
+        rounds = 0
+        started = time.perf_counter()
+        deadline = started + seconds
+        while True:
+            for output in lines:
+                parser = STREAM_PARSERS[tool]()
+                for line in output:
+                    for _ in parser.feed(line):
+                        pass
+                parser.result()
+            rounds += 1
+            if time.perf_counter() >= deadline:
+                break
+        elapsed = time.perf_counter() - started
+        results[tool] = {
+            "lines": n_lines * rounds,
+            "seconds": round(elapsed, 3),
+            "lines_per_s": round(n_lines * rounds / elapsed),
+            "mb_per_s": round(n_bytes * rounds / elapsed / 1e6, 2),
+        }
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Check or benchmark the tool output parsers against a corpus.")
+    mode = parser.add_mutually_exclusive_group(required=True)
+    mode.add_argument("--check", action="store_true", help="Compare parser output with the golden files")
+    mode.add_argument("--bench", action="store_true", help="Report parser throughput in lines/s per tool")
+    parser.add_argument("--corpus", default=DEFAULT_CORPUS_DIR,
+                        help="Corpus directory with <tool>/<case>.txt and .json (default: parser_corpus/)")
+    parser.add_argument("--update", action="store_true", help="With --check, rewrite the golden files")
+    parser.add_argument("--seconds", type=float, default=2.0, help="With --bench, time per tool (default: 2)")
+    args = parser.parse_args()
+
+    if args.check:
+        failures = check_corpus(args.corpus, update=args.update)
+        sys.exit(1 if failures else 0)
+
+    for tool, stats in bench_corpus(args.corpus, args.seconds).items():
+        print(f"{tool:<11} {stats['lines_per_s']:>10,} lines/s  {stats['mb_per_s']:>7.2f} MB/s  "
+              f"({stats['lines']:,} lines in {stats['seconds']}s)")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,383 @@
+#!/usr/bin/env python3
+"""
+archive_export.py
+  Dump perfSONAR results from OpenSearch/Elasticsearch on the SHORE node,
+  in parallel and resumably (successor to archive_offload.sh).
+
+  - Opens a point-in-time (PIT) over the index and reads it with N sliced
+    searches at once, paging each slice with search_after.
+  - Streams every slice into its own gzipped NDJSON part (one gzip member
+    per page) and concatenates the parts into --outfile at the end.
+  - Checkpoints each slice after every page (search_after position, docs,
+    part size), so an interrupted export resumes where it stopped: run the
+    same command again.
+  - Reports docs/s per slice.
+  - Credentials as in archive_offload.sh: --user/--pass, or the
+    opensearch_login file (read with sudo when needed).
+
+Usage (examples):
+  # Last 10 days, 8 slices:
+  ./archive_export.py --days 10 --slices 8 --insecure --outfile cruise_10d.ndjson.gz
+
+  # Explicit window:
+  ./archive_export.py --from 2025-08-01T00:00:00Z --to 2025-09-02T23:59:59Z
+
+Requires only the Python 3 standard library.
+"""
+import argparse
+import base64
+import gzip
+import json
+import os
+import shutil
+import ssl
+import subprocess
+import sys
+import threading
+import time
+import urllib.error
+import urllib.request
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta, timezone
+
+CREDENTIALS_FILE = "/etc/perfsonar/opensearch/opensearch_login"
+DEFAULT_PARTS_DIR = "cruise_dump.parts"
+REQUEST_ATTEMPTS = 3
+
+
+def die(message):
+    print(f"ERROR: {message}", file=sys.stderr)
+    sys.exit(1)
+
+
+class SearchError(Exception):
+    def __init__(self, status, body):
+        super().__init__(f"HTTP {status}: {body[:500]}")
+        self.status = status
+
+
+class SearchClient:
+    """Minimal JSON-over-HTTP client for the OpenSearch/Elasticsearch REST API."""
+
+    def __init__(self, host, user=None, password=None, insecure=False, timeout=120.0):
+        self.host = host.rstrip("/")
+        self.timeout = timeout
+        self.headers = {"Content-Type": "application/json"}
+        if user:
+            token = base64.b64encode(f"{user}:{password or ''}".encode()).decode()
+            self.headers["Authorization"] = f"Basic {token}"
+        self.context = ssl._create_unverified_context() if insecure else None
+
+    def request(self, method, path, body=None):
+        """Send one request; retries connection errors and 5xx responses with backoff."""
+        data = json.dumps(body).encode() if body is not None else None
+        for attempt in range(1, REQUEST_ATTEMPTS + 1):
+            req = urllib.request.Request(f"{self.host}{path}", data=data, method=method, headers=self.headers)
+            try:
+                with urllib.request.urlopen(req, timeout=self.timeout, context=self.context) as resp:
+                    return json.load(resp)
+            except urllib.error.HTTPError as e:
+                error = SearchError(e.code, e.read().decode(errors="replace"))
+                if e.code < 500:
+                    raise error
+            except (urllib.error.URLError, OSError) as e:
+                error = e
+            if attempt < REQUEST_ATTEMPTS:
+                time.sleep(2 ** attempt)
+        raise error
+
+
+class PointInTime:
+    """
+    A PIT over the index, shared by all slices. Both flavours are supported:
+    OpenSearch (/_search/point_in_time) and Elasticsearch (/_pit). An expired
+    PIT is reopened once for everyone by renew().
+    """
+
+    def __init__(self, client, index, keep_alive):
+        self.client = client
+        self.index = index
+        self.keep_alive = keep_alive
+        self.flavour = None
+        self.id = None
+        self._lock = threading.Lock()
+        self._open()
+
+    def _open(self):
+        try:
+            resp = self.client.request("POST", f"/{self.index}/_search/point_in_time?keep_alive={self.keep_alive}")
+            self.flavour, self.id = "opensearch", resp["pit_id"]
+        except SearchError as e:
+            if e.status not in (400, 404, 405):
+                raise
+            resp = self.client.request("POST", f"/{self.index}/_pit?keep_alive={self.keep_alive}")
+            self.flavour, self.id = "elasticsearch", resp["id"]
+
+    def renew(self, stale_id):
+        with self._lock:
+            if self.id == stale_id:
+                self._open()
+            return self.id
+
+    def tiebreaker(self):
+        # Elasticsearch rejects sorting on _id; _shard_doc is its PIT tiebreaker,
+        # only valid within the PIT that produced it (see SliceExport)
+        return {"_shard_doc": "asc"} if self.flavour == "elasticsearch" else {"_id": "asc"}
+
+    def close(self):
+        try:
+            if self.flavour == "opensearch":
+                self.client.request("DELETE", "/_search/point_in_time", {"pit_id": [self.id]})
+            else:
+                self.client.request("DELETE", "/_pit", {"id": self.id})
+        except (SearchError, OSError):
+            pass  # best effort; it expires after keep_alive anyway
+
+
+class SliceExport:
+    """
+    One slice of the export. Pages are appended to <parts>/slice-<i>.ndjson.gz
+    as separate gzip members, and <parts>/slice-<i>.json records the
+    search_after position, the document count and the part size after
+    each page. A restarted slice truncates its part to the checkpointed
+    size and continues from there.
+
+    The checkpoint also keeps the PIT the position came from and the ids of
+    the documents written at the last timestamp. Elasticsearch's _shard_doc
+    tiebreaker means nothing in another PIT, so after a resume or renew() an
+    Elasticsearch slice restarts at that timestamp and skips those ids.
+    """
+
+    def __init__(self, slice_id, slices, parts_dir):
+        self.slice_id = slice_id
+        self.slices = slices
+        self.part_file = os.path.join(parts_dir, f"slice-{slice_id}.ndjson.gz")
+        self.state_file = os.path.join(parts_dir, f"slice-{slice_id}.json")
+        self.state = {"search_after": None, "pit_id": None, "tail": {"sort": None, "ids": []},
+                      "docs": 0, "bytes": 0, "seconds": 0.0, "done": False}
+        if os.path.exists(self.state_file):
+            with open(self.state_file) as f:
+                self.state.update(json.load(f))
+
+    def _checkpoint(self):
+        tmp = f"{self.state_file}.tmp"
+        with open(tmp, "w") as f:
+            json.dump(self.state, f)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp, self.state_file)
+
+    @staticmethod
+    def _doc_key(hit):
+        return f"{hit.get('_index')}/{hit['_id']}"
+
+    def run(self, pit, query, sort, size, slice_field, time_field, log):
+        if self.state["done"]:
+            return self.state
+        if self.state["docs"]:
+            log(f"slice {self.slice_id}: resuming after {self.state['docs']} docs")
+        started = time.monotonic() - self.state["seconds"]
+        tail_sort, tail_ids = self.state["tail"]["sort"], set(self.state["tail"]["ids"])
+        with open(self.part_file, "ab") as part:
+            # Drop anything written after the last checkpoint (e.g. a half-written member)
+            part.truncate(self.state["bytes"])
+            part.seek(self.state["bytes"])
+            while True:
+                body = {
+                    "size": size,
+                    "_source": True,
+                    "query": query,
+                    "sort": sort,
+                    "slice": {"field": slice_field, "id": self.slice_id, "max": self.slices},
+                    "pit": {"id": pit.id, "keep_alive": pit.keep_alive},
+                    "track_total_hits": False,
+                }
+                if self.slices == 1:
+                    del body["slice"]
+                pit_id = pit.id
+                if self.state["search_after"] is not None:
+                    if pit.flavour == "elasticsearch" and self.state["pit_id"] != pit_id:
+                        # Position from another PIT: start again at its timestamp
+                        body["query"] = {"bool": {"filter": [query, {"range": {time_field: {
+                            "gte": self.state["search_after"][0], "format": "epoch_millis"}}}]}}
+                    else:
+                        body["search_after"] = self.state["search_after"]
+                try:
+                    resp = pit.client.request("POST", "/_search", body)
+                except SearchError as e:
+                    if e.status != 404:
+                        raise
+                    log(f"slice {self.slice_id}: point-in-time expired, reopening")
+                    pit.renew(pit_id)
+                    continue
+                hits = resp["hits"]["hits"]
+                if not hits:
+                    break
+                # Skip documents already written at the last checkpointed timestamp
+                new = [hit for hit in hits if hit["sort"][0] != tail_sort or self._doc_key(hit) not in tail_ids]
+                if new:
+                    lines = "".join(json.dumps(hit["_source"], separators=(",", ":")) + "\n" for hit in new)
+                    part.write(gzip.compress(lines.encode(), compresslevel=6))
+                    part.flush()
+                    os.fsync(part.fileno())
+                if hits[-1]["sort"][0] != tail_sort:
+                    tail_sort, tail_ids = hits[-1]["sort"][0], set()
+                tail_ids.update(self._doc_key(hit) for hit in new if hit["sort"][0] == tail_sort)
+                self.state["search_after"] = hits[-1]["sort"]
+                self.state["pit_id"] = pit_id
+                self.state["tail"] = {"sort": tail_sort, "ids": sorted(tail_ids)}
+                self.state["docs"] += len(new)
+                self.state["bytes"] = part.tell()
+                self.state["seconds"] = time.monotonic() - started
+                self._checkpoint()
+                if len(hits) < size:
+                    break
+        self.state["seconds"] = time.monotonic() - started
+        self.state["done"] = True
+        self._checkpoint()
+        rate = self.state["docs"] / self.state["seconds"] if self.state["seconds"] else 0.0
+        log(f"slice {self.slice_id}: {self.state['docs']} docs in {self.state['seconds']:.1f}s ({rate:.0f} docs/s)")
+        return self.state
+
+
+def read_credentials(path=CREDENTIALS_FILE):
+    """(user, password) from the first line of the opensearch_login file, using sudo if it is not readable."""
+    try:
+        with open(path) as f:
+            line = f.readline()
+    except PermissionError:
+        try:
+            line = subprocess.run(["sudo", "head", "-n", "1", path], check=True, capture_output=True,
+                                  text=True).stdout
+        except (OSError, subprocess.CalledProcessError):
+            return None
+    except OSError:
+        return None
+    fields = line.split()
+    return (fields[0], fields[1]) if len(fields) >= 2 else None
+
+
+def export(client, args, log=print):
+    """Run (or resume) the export described by *args*; returns the per-slice states."""
+    query = {"range": {args.time_field: {"gte": args.time_from, "lte": args.time_to,
+                                         "format": "strict_date_optional_time"}}}
+    params = {"index": args.index, "from": args.time_from, "to": args.time_to, "time_field": args.time_field,
+              "slices": args.slices, "slice_field": args.slice_field, "size": args.size}
+    os.makedirs(args.parts_dir, exist_ok=True)
+    params_file = os.path.join(args.parts_dir, "export.json")
+    if os.path.exists(params_file):
+        with open(params_file) as f:
+            previous = json.load(f)
+        previous.pop("outfile", None)
+        if previous != params:
+            die(f"{args.parts_dir} holds an export with other parameters ({previous}); "
+                f"remove it or use --restart")
+    else:
+        with open(params_file, "w") as f:
+            json.dump({**params, "outfile": args.outfile}, f)
+
+    slices = [SliceExport(i, args.slices, args.parts_dir) for i in range(args.slices)]
+    pit = PointInTime(client, args.index, args.keep_alive)
+    sort = [{args.time_field: "asc"}, pit.tiebreaker()]
+    log(f"==> Exporting from {client.host} index '{args.index}' ({pit.flavour}), {args.slices} slices")
+    log(f"    Time range: {args.time_from}  ->  {args.time_to}  (field: {args.time_field})")
+    started = time.monotonic()
+    try:
+        with ThreadPoolExecutor(max_workers=args.slices) as pool:
+            states = list(pool.map(
+                lambda s: s.run(pit, query, sort, args.size, args.slice_field, args.time_field, log), slices))
+    finally:
+        pit.close()
+    elapsed = time.monotonic() - started
+
+    # Concatenated gzip members are one valid gzip stream
+    tmp = f"{args.outfile}.tmp"
+    with open(tmp, "wb") as out:
+        for s in slices:
+            with open(s.part_file, "rb") as part:
+                shutil.copyfileobj(part, out, 1 << 20)
+    os.replace(tmp, args.outfile)
+    total = sum(state["docs"] for state in states)
+    log(f"==> Wrote {total} documents to {args.outfile} in {elapsed:.1f}s "
+        f"({total / elapsed if elapsed else 0:.0f} docs/s this run)")
+    if not args.keep_parts:
+        shutil.rmtree(args.parts_dir)
+    return states
+
+
+def _iso(dt):
+    return dt.strftime("%Y-%m-%dT%H:%M:%SZ")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Export perfSONAR results from OpenSearch as gzipped NDJSON, "
+                                                 "with parallel point-in-time slices and resume")
+    parser.add_argument("--host", default="https://localhost:9200", help="Search endpoint (default: https://localhost:9200)")
+    parser.add_argument("--index", default="pscheduler*", help="Index or pattern (default: pscheduler*)")
+    parser.add_argument("--user", help="User (default: from the opensearch_login file)")
+    parser.add_argument("--pass", dest="password", help="Password (default: from the opensearch_login file)")
+    parser.add_argument("--from", dest="time_from", help="Start of the window, UTC ISO 8601")
+    parser.add_argument("--to", dest="time_to", help="End of the window, UTC ISO 8601")
+    parser.add_argument("--days", type=int, help="Export the last N days (instead of --from/--to)")
+    parser.add_argument("--time-field", default="@timestamp", help="Time field (default: @timestamp)")
+    parser.add_argument("--slices", type=int, default=4, help="Parallel slices (default: 4)")
+    parser.add_argument("--slice-field", help="Numeric/date field the slices are split on; a field makes slices "
+                                              "stable across PITs, so resume is exact (default: --time-field)")
+    parser.add_argument("--size", type=int, default=5000, help="Documents per page (default: 5000)")
+    parser.add_argument("--keep-alive", default="5m", help="Point-in-time keep-alive between pages (default: 5m)")
+    parser.add_argument("--outfile", help="Output file (default: cruise_dump-YYYY-MM-DD.ndjson.gz, dated when the "
+                                          "export starts; a resumed export keeps its name)")
+    parser.add_argument("--parts-dir", help="Slice parts and checkpoints (default: <outfile>.parts, or "
+                                            f"{DEFAULT_PARTS_DIR} without --outfile)")
+    parser.add_argument("--keep-parts", action="store_true", help="Keep the parts directory after a complete export")
+    parser.add_argument("--restart", action="store_true", help="Discard checkpoints and start over")
+    parser.add_argument("--insecure", action="store_true", help="Don't verify TLS certificates (self-signed)")
+    args = parser.parse_args()
+
+    # The default parts directory doesn't depend on the date, so the same
+    # command still resumes after midnight
+    args.parts_dir = args.parts_dir or (f"{args.outfile}.parts" if args.outfile else DEFAULT_PARTS_DIR)
+    args.slice_field = args.slice_field or args.time_field
+    if args.slices < 1 or args.size < 1:
+        die("--slices and --size must be positive")
+    if args.restart and os.path.isdir(args.parts_dir):
+        shutil.rmtree(args.parts_dir)
+
+    previous = None
+    params_file = os.path.join(args.parts_dir, "export.json")
+    if os.path.exists(params_file):
+        with open(params_file) as f:
+            previous = json.load(f)
+    if not args.outfile:
+        args.outfile = (previous or {}).get("outfile") or \
+            f"cruise_dump-{datetime.now().strftime('%Y-%m-%d')}.ndjson.gz"
+
+    if args.days is not None:
+        if args.time_from or args.time_to:
+            die("Use either --days N OR --from/--to, not both.")
+        if previous is not None:
+            # Resuming: keep the window the interrupted run started with
+            args.time_from, args.time_to = previous["from"], previous["to"]
+            print(f"==> Resuming export of {args.time_from} -> {args.time_to}")
+        else:
+            now = datetime.now(timezone.utc)
+            args.time_from, args.time_to = _iso(now - timedelta(days=args.days)), _iso(now)
+    if not args.time_from or not args.time_to:
+        die("You must provide a time window via --days N or --from ISO --to ISO")
+
+    if not args.user or not args.password:
+        credentials = read_credentials()
+        if credentials is None:
+            die(f"No --user/--pass provided and cannot read {CREDENTIALS_FILE} (need sudo).")
+        args.user, args.password = credentials
+        print(f"==> Using credentials from {CREDENTIALS_FILE} (user: {args.user})")
+
+    client = SearchClient(args.host, args.user, args.password, insecure=args.insecure)
+    try:
+        export(client, args)
+    except (SearchError, OSError) as e:
+        die(f"Export interrupted ({e}); run the same command again to resume")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,5 +1,238 @@
 import json
 import argparse
+import functools
+import math
+import os
+import re
+import sys
+import tempfile
+import time
+from datetime import datetime, timedelta, timezone
+from json.encoder import encode_basestring_ascii
+
+# Supported schedule intervals
+VALID_INTERVALS = {"10M": "PT10M", "2H": "PT2H", "4H": "PT4H", "6H": "PT6H"}
+INTERVAL_SECONDS = {"10M": 600, "2H": 7200, "4H": 14400, "6H": 21600}
+
+# Throughput test timing (seconds); a slot holds one run plus its setup/teardown
+THROUGHPUT_DURATION = 60
+THROUGHPUT_OMIT = 10
+DEFAULT_THROUGHPUT_SLOT = 120
+
+# Throughput slots are offsets from this fixed instant, so every host's agent
+# computes the same run times (pScheduler runs a task at start + n * repeat)
+DEFAULT_SLOT_ANCHOR = "2025-01-01T00:00:00Z"
+
+TOPOLOGIES = ("pair", "mesh", "star")
+
+# Compact output: the archives are attached once to this host entry, which
+# every address points at, instead of being listed in every task
+COMPACT_HOST = "tested_hosts"
+
+# Non-throughput tests of mesh/star: one task per test type over the topology
+# group, which yields both directions of every pair
+OTHER_TESTS = {
+    "latencybg": ("Latency Tests", {"flip": False}),
+    "trace": ("Traceroute Tests", {}),
+    "rtt": ("RTT Tests", {}),
+    "mtu": ("MTU Tests", {}),
+    "clock": ("Clock Tests", {}),
+}
+
+
+def round_robin_rounds(names: list[str]) -> list[list[tuple[str, str]]]:
+    """
+    Split every pair of *names* into rounds in which no name appears twice
+    (circle method: len(names) - 1 rounds, or len(names) for an odd count).
+    """
+    ring = list(names)
+    if len(ring) % 2:
+        ring.append(None)  # bye
+    n = len(ring)
+    rounds = []
+    for _ in range(n - 1):
+        rounds.append([(ring[i], ring[n - 1 - i]) for i in range(n // 2)
+                       if ring[i] is not None and ring[n - 1 - i] is not None])
+        # Keep the first entry fixed and rotate the rest by one
+        ring = [ring[0], ring[-1]] + ring[1:-1]
+    return rounds
+
+
+def star_rounds(hub: str, names: list[str]) -> list[list[tuple[str, str]]]:
+    """One pair per round: every pair in a star includes the hub."""
+    return [[(hub, name)] for name in names if name != hub]
+
+
+def slot_rounds(config: dict) -> dict[tuple[str, str], int]:
+    """(source, dest) -> round of every slotted throughput pair in an existing config."""
+    result = {}
+    for task in config.get("tasks", {}).values():
+        schedule = task.get("schedule", "")
+        if task.get("test") != "throughput" or not schedule.startswith("throughput_slot_"):
+            continue
+        group = config["groups"].get(task["group"], {})
+        if group.get("type") == "disjoint" and len(group["a-addresses"]) == len(group["b-addresses"]) == 1:
+            pair = (group["a-addresses"][0]["name"], group["b-addresses"][0]["name"])
+            result[pair] = int(schedule[len("throughput_slot_"):]) // 2
+    return result
+
+
+def reslot_rounds(rounds: list, previous: dict[tuple[str, str], int]) -> list[list[tuple[str, str]]]:
+    """
+    Re-arrange *rounds* so that pairs found in *previous* (see slot_rounds)
+    keep their round and direction; other pairs go into the first round in
+    which neither address is busy, or a new round. Rounds emptied by removed
+    pairs are kept, so later rounds don't move.
+    """
+    result, busy, new = [], [], []
+
+    def _place(pair, index):
+        while len(result) <= index:
+            result.append([])
+            busy.append(set())
+        result[index].append(pair)
+        busy[index].update(pair)
+
+    for a, b in (pair for pairs in rounds for pair in pairs):
+        if (a, b) in previous:
+            _place((a, b), previous[(a, b)])
+        elif (b, a) in previous:
+            _place((b, a), previous[(b, a)])
+        else:
+            new.append((a, b))
+    for a, b in new:
+        index = next((i for i, names in enumerate(busy) if a not in names and b not in names), len(result))
+        _place((a, b), index)
+    return result
+
+
+def diff_configs(current: dict, desired: dict) -> dict[str, dict[str, list[str]]]:
+    """
+    Structural diff of two psconfigs: {section: {"added", "removed",
+    "changed"}} with entry names for the named sections (addresses, tests,
+    tasks...) and top-level key names under "config" for everything else.
+    """
+    diff = {}
+    keys = list(dict.fromkeys([*current, *desired]))
+    for key in keys:
+        old, new = current.get(key), desired.get(key)
+        if isinstance(old, dict) and isinstance(new, dict) and not key.startswith("_"):
+            changes = {
+                "added": [name for name in new if name not in old],
+                "removed": [name for name in old if name not in new],
+                "changed": [name for name, value in new.items() if name in old and old[name] != value],
+            }
+        elif old == new:
+            continue
+        else:
+            changes = {"added": [key] if old is None else [], "removed": [key] if new is None else [],
+                       "changed": [key] if old is not None and new is not None else []}
+            key = "config"
+        if any(changes.values()):
+            section = diff.setdefault(key, {"added": [], "removed": [], "changed": []})
+            for kind, names in changes.items():
+                section[kind] += names
+    return diff
+
+
+def apply_diff(current: dict, desired: dict, diff: dict) -> dict:
+    """*current* with *diff* applied: unchanged entries keep their order, new ones are appended."""
+    result = dict(current)
+    for key, changes in diff.items():
+        if key == "config":
+            for name in changes["removed"]:
+                del result[name]
+            for name in changes["added"] + changes["changed"]:
+                result[name] = desired[name]
+            continue
+        section = dict(current[key])
+        for name in changes["removed"]:
+            del section[name]
+        for name in changes["added"] + changes["changed"]:
+            section[name] = desired[key][name]
+        result[key] = section
+    return result
+
+
+def format_diff(diff: dict) -> str:
+    if not diff:
+        return "No changes"
+    lines = []
+    for key, changes in diff.items():
+        counts = ", ".join(f"{len(names)} {kind}" for kind, names in changes.items() if names)
+        lines.append(f"{key}: {counts}")
+        for kind, mark in (("added", "+"), ("removed", "-"), ("changed", "~")):
+            lines += [f"  {mark} {name}" for name in changes[kind][:10]]
+            if len(changes[kind]) > 10:
+                lines.append(f"  {mark} ... {len(changes[kind]) - 10} more")
+    return "\n".join(lines)
+
+
+def throughput_cycle_seconds(rounds: int, schedule_interval: str, throughput_slot: int) -> int:
+    """Repeat of the throughput slots: whole intervals, so a mesh that fits keeps the requested interval."""
+    interval_s = INTERVAL_SECONDS[schedule_interval]
+    return interval_s * max(1, math.ceil(2 * rounds * throughput_slot / interval_s))
+
+
+def dump_config(config: dict, compact: bool = False) -> str:
+    """Serialize a psconfig: indented, or minified when *compact*."""
+    if compact:
+        return json.dumps(config, separators=(",", ":"))
+    return _dumps_indented(config)
+
+
+_encode_scalar = json.JSONEncoder().encode
+
+
+def _dumps_indented(value, indent: int = 4) -> str:
+    """
+    json.dumps(value, indent=indent), byte for byte. The stdlib C encoder
+    can't indent, and its pure-Python fallback took most of the time of
+    writing a large mesh; this one builds each container with a single join
+    and encodes a list shared between entries (archives, group addresses)
+    only once per nesting level.
+    """
+    shared = {}
+    pads = []
+
+    def _encode(v, level):
+        t = type(v)
+        if t is str:
+            return encode_basestring_ascii(v)
+        if t is dict or t is list:
+            if not v:
+                return "{}" if t is dict else "[]"
+            if t is list:
+                key = (id(v), level)
+                text = shared.get(key)
+                if text is not None:
+                    return text
+            while len(pads) < level + 2:
+                pads.append(" " * (indent * len(pads)))
+            sep = ",\n" + pads[level + 1]
+            if t is dict:
+                body = sep.join([encode_basestring_ascii(k) + ": " + (
+                    encode_basestring_ascii(x) if type(x) is str else _encode(x, level + 1)) for k, x in v.items()])
+                return "{\n" + pads[level + 1] + body + "\n" + pads[level] + "}"
+            body = sep.join([encode_basestring_ascii(x) if type(x) is str else _encode(x, level + 1) for x in v])
+            text = shared[key] = "[\n" + pads[level + 1] + body + "\n" + pads[level] + "]"
+            return text
+        if v is True:
+            return "true"
+        if v is False:
+            return "false"
+        if v is None:
+            return "null"
+        if t is int:
+            return int.__repr__(v)
+        return _encode_scalar(v)
+
+    return _encode(value, 0)
+
+
+def _iso_seconds(seconds: int) -> str:
+    return f"PT{int(seconds)}S"
+
 
 class PSConfigBuilder:
     """
@@ -8,17 +241,21 @@ class PSConfigBuilder:
     Optionally supports remote archive server configuration.
     """
 
-    def __init__(self, base_config_file: str = "./psconfig_base.json", output_file: str = "./psconfig.json"):
+    def __init__(self, base_config_file: str = "./psconfig_base.json", output_file: str = "./psconfig.json",
+                 compact: bool = False):
         """
         Initialize the PSConfigBuilder.
 
         Args:
             base_config_file (str): Path to the base psconfig file.
             output_file (str): Path to the output psconfig file.
+            compact (bool, optional): Attach archives once through a shared host entry instead of to every
+                task, leave out the display references of the per-pair throughput tasks (display tools then
+                show their task names) and write minified JSON.
         """
         self.base_config_file = base_config_file
         self.output_file = output_file
-
+        self.compact = compact
 
     def add_tests(
         self,
@@ -26,7 +263,11 @@ class PSConfigBuilder:
         parallel_streams: int = None,
         remote: str = None,
         add_tests: bool = True,
-        schedule_interval: str = "10M"
+        schedule_interval: str = "10M",
+        topology: str = "pair",
+        hub: str = None,
+        throughput_slot: int = DEFAULT_THROUGHPUT_SLOT,
+        slot_anchor: str = DEFAULT_SLOT_ANCHOR,
     ):
         """
         Add perfSONAR tests to the psconfig file for the given source and destination.
@@ -37,6 +278,95 @@ class PSConfigBuilder:
             remote (str, optional): Remote archive server URL.
             add_tests (bool, optional): Whether to add tests or just update addresses/groups.
             schedule_interval (str, optional): Schedule interval, one of "10M", "2H", "4H", "6H". Default is "10M".
+            topology (str, optional): "pair" (first two addresses, the original per-pair config), "mesh" (every pair)
+                or "star" (hub to every other address).
+            hub (str, optional): Hub address name for the star topology. Default is the first address.
+            throughput_slot (int, optional): Seconds reserved for one throughput run. Default is 120.
+            slot_anchor (str, optional): ISO 8601 UTC instant the throughput slots are offset from.
+        """
+        config = self.build_config(
+            host_list, parallel_streams=parallel_streams, remote=remote, add_tests=add_tests,
+            schedule_interval=schedule_interval, topology=topology, hub=hub,
+            throughput_slot=throughput_slot, slot_anchor=slot_anchor,
+        )
+
+        self.write_config(config)
+
+    def update_tests(self, **kwargs) -> dict:
+        """
+        Incremental add_tests() (same arguments): compare the config it would
+        write with the current output file and rewrite only what changed.
+        Throughput pairs already in the output keep their time slots. Returns
+        the diff (see diff_configs); the file is not touched when it is empty.
+        """
+        current = self.load_output()
+        return self.update_config(self.build_config(current=current, **kwargs), current)
+
+    def update_config(self, config: dict, current: dict = None) -> dict:
+        """Write the changes from *current* (the output file's config) to *config*; returns the diff."""
+        current = current or {}
+        diff = diff_configs(current, config)
+        if diff:
+            self.write_config(apply_diff(current, config, diff))
+        return diff
+
+    def load_output(self) -> dict:
+        """The current output file's config, or None if there is none yet."""
+        try:
+            with open(self.output_file, "r") as f:
+                return json.load(f)
+        except FileNotFoundError:
+            return None
+
+    def write_config(self, config: dict):
+        """
+        Write *config* to the output file atomically (temporary file in the
+        same directory, then rename), so the agent never reads a partial file.
+        """
+        directory = os.path.dirname(os.path.abspath(self.output_file))
+        fd, tmp = tempfile.mkstemp(prefix=".psconfig-", suffix=".tmp", dir=directory)
+        try:
+            with os.fdopen(fd, "w") as f:
+                f.write(dump_config(config, self.compact))
+                f.flush()
+                os.fsync(f.fileno())
+            try:
+                mode = os.stat(self.output_file).st_mode & 0o777
+            except FileNotFoundError:
+                mode = 0o644
+            os.chmod(tmp, mode)
+            os.replace(tmp, self.output_file)
+        except BaseException:
+            if os.path.exists(tmp):
+                os.unlink(tmp)
+            raise
+
+    def build_config(
+        self,
+        host_list: list[tuple[str, str]],
+        parallel_streams: int = None,
+        remote: str = None,
+        add_tests: bool = True,
+        schedule_interval: str = "10M",
+        topology: str = "pair",
+        hub: str = None,
+        throughput_slot: int = DEFAULT_THROUGHPUT_SLOT,
+        slot_anchor: str = DEFAULT_SLOT_ANCHOR,
+        current: dict = None,
+    ) -> dict:
+        """
+        Build the config written by add_tests() (same arguments) and return it.
+        Throughput pairs of a *current* config keep their slots (see update_tests).
+
+        The pair topology keeps the original layout (see _add_pair_tests). For
+        mesh and star, throughput tests are the ones that must not overlap: each pair gets its
+        own group and two tasks (forward, reverse) run from the pair's first
+        address, in fixed time slots. Pairs are split into rounds in which no
+        address appears twice, each round takes two consecutive slots, and the
+        slot schedules repeat every interval (or every whole number of
+        intervals, when the rounds don't fit in one). So no address is ever in
+        two throughput tests at once. Other tests run once per test type over
+        the topology group with the interval's sliprand schedule.
         """
         # Load the base config file
         with open(self.base_config_file, "r") as f:
@@ -61,15 +391,11 @@ class PSConfigBuilder:
                 }
             }
 
-        for (name, ip) in host_list:
+        for (name, ip) in host_list or []:
             config["addresses"][name] = {"address": ip}
 
         # Collect all address names for mesh group
         address_names = list(config["addresses"].keys())
-        # Assuming the first address is central-TOKY and the second is remote-MAX
-        # to match the user's scenario. Adjust as needed.
-        source_name = address_names[0] if len(address_names) > 0 else ""
-        dest_name = address_names[1] if len(address_names) > 1 else ""
 
         # Define mesh group for all addresses
         config["groups"].update({
@@ -79,174 +405,409 @@ class PSConfigBuilder:
             }
         })
 
-        # Supported schedule intervals
-        valid_intervals = {"10M": "PT10M", "2H": "PT2H", "4H": "PT4H", "6H": "PT6H"}
-        if schedule_interval not in valid_intervals:
-            raise ValueError(f"Invalid schedule_interval '{schedule_interval}'. Must be one of {list(valid_intervals.keys())}.")
-        interval_str = valid_intervals[schedule_interval]
+        if schedule_interval not in VALID_INTERVALS:
+            raise ValueError(f"Invalid schedule_interval '{schedule_interval}'. Must be one of {list(VALID_INTERVALS.keys())}.")
+        if topology not in TOPOLOGIES:
+            raise ValueError(f"Invalid topology '{topology}'. Must be one of {list(TOPOLOGIES)}.")
+        if throughput_slot < THROUGHPUT_DURATION + THROUGHPUT_OMIT:
+            raise ValueError(f"throughput_slot must be at least {THROUGHPUT_DURATION + THROUGHPUT_OMIT} seconds")
 
         if not add_tests:
-            # Write the updated config to the output file and return if not adding tests
-            with open(self.output_file, "w") as f:
-                json.dump(config, f, indent=4)
-            return
+            # Only addresses/groups are updated when not adding tests
+            return config
+
+        if len(address_names) < 2:
+            raise ValueError("At least two addresses are needed to add tests")
+
+        archives = ["http_archive", "remote_http_archive"] if remote else ["http_archive"]
+        if self.compact:
+            # Archived through the host of every address; tasks carry no list
+            config.setdefault("hosts", {})[COMPACT_HOST] = {"archives": archives}
+            for address in config["addresses"].values():
+                address["host"] = COMPACT_HOST
+            archives = None
+
+        # The first address is the local end (e.g. central-TOKY) to match the
+        # user's scenario; it is also the default star hub
+        if topology == "pair":
+            self._add_pair_tests(config, address_names[0], address_names[1], parallel_streams, archives,
+                                 schedule_interval)
+            return config
+        if topology == "mesh":
+            rounds = round_robin_rounds(address_names)
+            test_group = "all_mesh"
+        else:
+            hub = hub or address_names[0]
+            if hub not in config["addresses"]:
+                raise ValueError(f"Star hub '{hub}' is not an address")
+            rounds = star_rounds(hub, address_names)
+            test_group = "star_tests"
+            config["groups"][test_group] = {
+                "type": "disjoint",
+                "a-addresses": [{"name": hub}],
+                "b-addresses": [{"name": name} for name in address_names if name != hub]
+            }
 
         # Define common source/dest mapping for readability
         forward_source = "{% address[0] %}"
         forward_dest = "{% address[1] %}"
 
-        # Add schedules for the tests
-        config["schedules"].update({
-            f"{source_name}_{dest_name}_schedule_PT{schedule_interval}": {
-                "repeat": interval_str,
-                "sliprand": True,
-                "slip": interval_str
+        # Non-throughput tests share one sliprand schedule
+        other_schedule = f"schedule_{VALID_INTERVALS[schedule_interval]}"
+        config["schedules"][other_schedule] = {
+            "repeat": VALID_INTERVALS[schedule_interval],
+            "sliprand": True,
+            "slip": VALID_INTERVALS[schedule_interval]
+        }
+
+        throughput_spec = {
+            "source": forward_source,
+            "dest": forward_dest,
+            "duration": _iso_seconds(THROUGHPUT_DURATION),
+            "interval": "PT10S",
+            "omit": _iso_seconds(THROUGHPUT_OMIT),
+            **({"parallel": parallel_streams} if parallel_streams else {})
+        }
+        config["tests"]["throughput"] = {"type": "throughput", "spec": throughput_spec}
+        config["tests"]["throughput_reverse"] = {"type": "throughput", "spec": {**throughput_spec, "reverse": True}}
+
+        for test_type, (display, extra) in OTHER_TESTS.items():
+            config["tests"][test_type] = {
+                "type": test_type,
+                "spec": {"source": forward_source, "dest": forward_dest, **extra}
             }
-        })
+            task = config["tasks"][f"{test_group}_task_{test_type}"] = {
+                "group": test_group,
+                "test": test_type,
+                "schedule": other_schedule,
+                "reference": {"display-task-name": f"{display} ({topology})", "display-task-group": ["Automated Tests"]}
+            }
+            if archives:
+                task["archives"] = archives
 
-        # Add test definitions
-        config["tests"].update({
-            # Forward Throughput
-            f"{source_name}_{dest_name}_throughput": {
-                "type": "throughput",
-                "spec": {
-                    "source": forward_source,
-                    "dest": forward_dest,
-                    "duration": "PT60S",
-                    "interval": "PT10S",
-                    "omit": "PT10S",
-                    **({"parallel": parallel_streams} if parallel_streams else {})
-                }
-            },
-            # Reverse Throughput
-            f"{dest_name}_{source_name}_throughput_reverse": {
-                "type": "throughput",
-                "spec": {
-                    "source": forward_source,
-                    "dest": forward_dest,
-                    "duration": "PT60S",
-                    "interval": "PT10S",
-                    "omit": "PT10S",
-                    "reverse": True,
-                    **({"parallel": parallel_streams} if parallel_streams else {})
-                }
-            },
-            # Forward Latency
-            f"{source_name}_{dest_name}_latencybg": {
-                "type": "latencybg",
-                "spec": {
-                    "source": forward_source,
-                    "dest": forward_dest,
-                    "flip": False
-                }
-            },
-            # Reverse Latency
-            f"{dest_name}_{source_name}_latencybg_reverse": {
-                "type": "latencybg",
-                "spec": {
-                    "source": forward_source,
-                    "dest": forward_dest,
-                    "flip": True
-                }
-            },
-            # Forward Trace
-            f"{source_name}_{dest_name}_trace": {
-                "type": "trace",
-                "spec": {
-                    "source": forward_source,
-                    "dest": forward_dest
-                }
-            },
-            # Forward RTT
-            f"{source_name}_{dest_name}_rtt": {
-                "type": "rtt",
-                "spec": {
-                    "source": forward_source,
-                    "dest": forward_dest
+        if current:
+            stable = reslot_rounds(rounds, slot_rounds(current))
+            # Keeping the slots is worth it while the throughput cycle doesn't
+            # grow; otherwise (e.g. a host added to an even-sized mesh) reslot all
+            if (throughput_cycle_seconds(len(stable), schedule_interval, throughput_slot)
+                    <= throughput_cycle_seconds(len(rounds), schedule_interval, throughput_slot)):
+                rounds = stable
+
+        self._add_throughput_slots(config, rounds, archives, schedule_interval, throughput_slot, slot_anchor)
+        return config
+
+    @staticmethod
+    def _add_pair_tests(config: dict, source_name: str, dest_name: str, parallel_streams: int, archives: list,
+                        schedule_interval: str):
+        """
+        Add the tests and tasks of the pair topology, named after the two
+        addresses as before mesh/star existed, so an existing pair config is
+        rewritten unchanged: throughput and latencybg in both directions, trace,
+        RTT, MTU and clock forward only, all over all_mesh on one sliprand
+        schedule. Without *archives* (compact output) the tasks carry no
+        archives list; there are few enough to keep their display references.
+        """
+        interval = VALID_INTERVALS[schedule_interval]
+        schedule = f"{source_name}_{dest_name}_schedule_PT{schedule_interval}"
+        config["schedules"][schedule] = {"repeat": interval, "sliprand": True, "slip": interval}
+
+        endpoints = {"source": "{% address[0] %}", "dest": "{% address[1] %}"}
+        throughput = {**endpoints, "duration": _iso_seconds(THROUGHPUT_DURATION), "interval": "PT10S",
+                      "omit": _iso_seconds(THROUGHPUT_OMIT)}
+        parallel = {"parallel": parallel_streams} if parallel_streams else {}
+        forward, reverse = f"{source_name}_{dest_name}", f"{dest_name}_{source_name}"
+        # (name prefix, test type suffix, test, display name); the task is <prefix>_task_<suffix>
+        pair_tests = [
+            (forward, "throughput", {"type": "throughput", "spec": {**throughput, **parallel}},
+             f"Throughput Tests {source_name} to {dest_name}"),
+            (reverse, "throughput_reverse", {"type": "throughput", "spec": {**throughput, "reverse": True, **parallel}},
+             f"Reverse Throughput Tests {dest_name} to {source_name}"),
+            (forward, "latencybg", {"type": "latencybg", "spec": {**endpoints, "flip": False}},
+             f"Latency Tests {source_name} to {dest_name}"),
+            (reverse, "latencybg_reverse", {"type": "latencybg", "spec": {**endpoints, "flip": True}},
+             f"Reverse Latency Tests {dest_name} to {source_name}"),
+        ] + [
+            (forward, test_type, {"type": test_type, "spec": dict(endpoints)},
+             f"{OTHER_TESTS[test_type][0]} {source_name} to {dest_name}")
+            for test_type in ("trace", "rtt", "mtu", "clock")
+        ]
+
+        for prefix, suffix, test, _ in pair_tests:
+            config["tests"][f"{prefix}_{suffix}"] = test
+        for prefix, suffix, _, display in pair_tests:
+            task = config["tasks"][f"{prefix}_task_{suffix}"] = {
+                "group": "all_mesh",
+                "test": f"{prefix}_{suffix}",
+                "schedule": schedule,
+            }
+            if archives is not None:
+                task["archives"] = archives
+            task["reference"] = {"display-task-name": display, "display-task-group": ["Automated Tests"]}
+
+    @staticmethod
+    def _add_throughput_slots(config: dict, rounds: list, archives: list, schedule_interval: str,
+                              throughput_slot: int, slot_anchor: str):
+        """
+        Add the per-pair groups, slot schedules and throughput tasks for
+        *rounds*. Without *archives* (compact output) the tasks carry neither
+        archives nor display references.
+        """
+        slots = 2 * len(rounds)
+        cycle_s = throughput_cycle_seconds(len(rounds), schedule_interval, throughput_slot)
+        anchor = datetime.fromisoformat(slot_anchor.replace("Z", "+00:00")).astimezone(timezone.utc)
+        repeat = _iso_seconds(cycle_s)
+        slip = _iso_seconds(throughput_slot - THROUGHPUT_DURATION - THROUGHPUT_OMIT)
+
+        schedules, groups, tasks = config["schedules"], config["groups"], config["tasks"]
+        # Shared (never mutated) sub-objects keep a large mesh cheap to build
+        refs = {name: [{"name": name}] for pairs in rounds for pair in pairs for name in pair}
+        display_group = ["Automated Tests"]
+        for slot in range(slots):
+            start = anchor + timedelta(seconds=slot * throughput_slot)
+            schedules[f"throughput_slot_{slot}"] = {
+                "start": start.strftime("%Y-%m-%dT%H:%M:%SZ"),
+                "repeat": repeat,
+                "slip": slip
+            }
+
+        for index, pairs in enumerate(rounds):
+            forward_schedule = f"throughput_slot_{2 * index}"
+            reverse_schedule = f"throughput_slot_{2 * index + 1}"
+            for source_name, dest_name in pairs:
+                group = f"pair_{source_name}_{dest_name}"
+                groups[group] = {
+                    "type": "disjoint",
+                    "unidirectional": True,
+                    "a-addresses": refs[source_name],
+                    "b-addresses": refs[dest_name]
                 }
-            },
-            # Forward MTU
-            f"{source_name}_{dest_name}_mtu": {
-                "type": "mtu",
-                "spec": {
-                    "source": forward_source,
-                    "dest": forward_dest
+                if archives is None:
+                    tasks[f"{source_name}_{dest_name}_task_throughput"] = {
+                        "group": group, "test": "throughput", "schedule": forward_schedule
+                    }
+                    tasks[f"{dest_name}_{source_name}_task_throughput_reverse"] = {
+                        "group": group, "test": "throughput_reverse", "schedule": reverse_schedule
+                    }
+                    continue
+                tasks[f"{source_name}_{dest_name}_task_throughput"] = {
+                    "group": group,
+                    "test": "throughput",
+                    "schedule": forward_schedule,
+                    "archives": archives,
+                    "reference": {"display-task-name": f"Throughput Tests {source_name} to {dest_name}", "display-task-group": display_group}
                 }
-            },
-            # Forward Clock
-            f"{source_name}_{dest_name}_clock": {
-                "type": "clock",
-                "spec": {
-                    "source": forward_source,
-                    "dest": forward_dest
+                tasks[f"{dest_name}_{source_name}_task_throughput_reverse"] = {
+                    "group": group,
+                    "test": "throughput_reverse",
+                    "schedule": reverse_schedule,
+                    "archives": archives,
+                    "reference": {"display-task-name": f"Reverse Throughput Tests {dest_name} to {source_name}", "display-task-group": display_group}
                 }
-            }
-        })
 
-        # Full task set, including traces
-        config["tasks"].update({
-            f"{source_name}_{dest_name}_task_throughput": {
-                "group": "all_mesh",
-                "test": f"{source_name}_{dest_name}_throughput",
-                "schedule": f"{source_name}_{dest_name}_schedule_PT{schedule_interval}",
-                "archives": ["http_archive", "remote_http_archive"] if remote else ["http_archive"],
-                "reference": { "display-task-name": f"Throughput Tests {source_name} to {dest_name}", "display-task-group": ["Automated Tests"] }
-            },
-            f"{dest_name}_{source_name}_task_throughput_reverse": {
-                "group": "all_mesh",
-                "test": f"{dest_name}_{source_name}_throughput_reverse",
-                "schedule": f"{source_name}_{dest_name}_schedule_PT{schedule_interval}",
-                "archives": ["http_archive", "remote_http_archive"] if remote else ["http_archive"],
-                "reference": { "display-task-name": f"Reverse Throughput Tests {dest_name} to {source_name}", "display-task-group": ["Automated Tests"] }
-            },
-            f"{source_name}_{dest_name}_task_latencybg": {
-                "group": "all_mesh",
-                "test": f"{source_name}_{dest_name}_latencybg",
-                "schedule": f"{source_name}_{dest_name}_schedule_PT{schedule_interval}",
-                "archives": ["http_archive", "remote_http_archive"] if remote else ["http_archive"],
-                "reference": { "display-task-name": f"Latency Tests {source_name} to {dest_name}", "display-task-group": ["Automated Tests"] }
-            },
-            f"{dest_name}_{source_name}_task_latencybg_reverse": {
-                "group": "all_mesh",
-                "test": f"{dest_name}_{source_name}_latencybg_reverse",
-                "schedule": f"{source_name}_{dest_name}_schedule_PT{schedule_interval}",
-                "archives": ["http_archive", "remote_http_archive"] if remote else ["http_archive"],
-                "reference": { "display-task-name": f"Reverse Latency Tests {dest_name} to {source_name}", "display-task-group": ["Automated Tests"] }
-            },
-            f"{source_name}_{dest_name}_task_trace": {
-                "group": "all_mesh",
-                "test": f"{source_name}_{dest_name}_trace",
-                "schedule": f"{source_name}_{dest_name}_schedule_PT{schedule_interval}",
-                "archives": ["http_archive", "remote_http_archive"] if remote else ["http_archive"],
-                "reference": { "display-task-name": f"Traceroute Tests {source_name} to {dest_name}", "display-task-group": ["Automated Tests"] }
-            },
-            f"{source_name}_{dest_name}_task_rtt": {
-                "group": "all_mesh",
-                "test": f"{source_name}_{dest_name}_rtt",
-                "schedule": f"{source_name}_{dest_name}_schedule_PT{schedule_interval}",
-                "archives": ["http_archive", "remote_http_archive"] if remote else ["http_archive"],
-                "reference": { "display-task-name": f"RTT Tests {source_name} to {dest_name}", "display-task-group": ["Automated Tests"] }
-            },
-            f"{source_name}_{dest_name}_task_mtu": {
-                "group": "all_mesh",
-                "test": f"{source_name}_{dest_name}_mtu",
-                "schedule": f"{source_name}_{dest_name}_schedule_PT{schedule_interval}",
-                "archives": ["http_archive", "remote_http_archive"] if remote else ["http_archive"],
-                "reference": { "display-task-name": f"MTU Tests {source_name} to {dest_name}", "display-task-group": ["Automated Tests"] }
-            },
-            f"{source_name}_{dest_name}_task_clock": {
-                "group": "all_mesh",
-                "test": f"{source_name}_{dest_name}_clock",
-                "schedule": f"{source_name}_{dest_name}_schedule_PT{schedule_interval}",
-                "archives": ["http_archive", "remote_http_archive"] if remote else ["http_archive"],
-                "reference": { "display-task-name": f"Clock Tests {source_name} to {dest_name}", "display-task-group": ["Automated Tests"] }
-            }
-        })
+# Rough traffic of the non-throughput tests, per run (bytes; both directions)
+# or per second for the continuous latencybg stream (10 packets/s by default)
+TEST_BYTES_PER_RUN = {"rtt": 1_000, "trace": 10_000, "mtu": 50_000, "clock": 1_000}
+LATENCYBG_BYTES_PER_SECOND = 10 * 100
 
+DEFAULT_ASSUMED_RATE = "100M"
+
+_ISO_DURATION = re.compile(r'^P(?:(\d+)D)?(?:T(?:(\d+)H)?(?:(\d+)M)?(?:(\d+(?:\.\d+)?)S)?)?$')
+
+
+@functools.lru_cache(maxsize=None)
+def iso_duration_seconds(value: str) -> float:
+    """ISO 8601 duration as used in psconfig ("PT10M", "PT2H", "P1DT30S") in seconds."""
+    match = _ISO_DURATION.match(value or "")
+    if not match or value in ("P", "PT"):
+        raise ValueError(f"Unsupported ISO 8601 duration '{value}'")
+    days, hours, minutes, seconds = match.groups()
+    return int(days or 0) * 86400 + int(hours or 0) * 3600 + int(minutes or 0) * 60 + float(seconds or 0)
+
+
+def parse_size(value: str) -> float:
+    """Byte or bit-rate figure with an optional K/M/G/T suffix (powers of 1000), e.g. "100M"."""
+    units = {"K": 1e3, "M": 1e6, "G": 1e9, "T": 1e12}
+    value = value.strip().upper()
+    if value and value[-1] in units:
+        return float(value[:-1]) * units[value[-1]]
+    return float(value)
+
+
+def group_pairs(config: dict, group_name: str):
+    """Yield the ordered (address[0], address[1]) name pairs a mesh or disjoint group produces."""
+    group = config["groups"][group_name]
+    if group["type"] == "mesh":
+        names = [a["name"] for a in group["addresses"]]
+        for a in names:
+            for b in names:
+                if a != b:
+                    yield a, b
+    elif group["type"] == "disjoint":
+        a_names = [a["name"] for a in group["a-addresses"]]
+        b_names = [b["name"] for b in group["b-addresses"]]
+        for a in a_names:
+            for b in b_names:
+                yield a, b
+                if not group.get("unidirectional"):
+                    yield b, a
+
+
+def _participation(config: dict, group_name: str) -> dict:
+    """Number of the group's ordered pairs each address takes part in (without expanding a mesh)."""
+    group = config["groups"][group_name]
+    counts = {}
+    if group["type"] == "mesh":
+        names = [a["name"] for a in group["addresses"]]
+        for name in names:
+            counts[name] = counts.get(name, 0) + 2 * (len(names) - 1)
+        return counts
+    for a, b in group_pairs(config, group_name):
+        counts[a] = counts.get(a, 0) + 1
+        counts[b] = counts.get(b, 0) + 1
+    return counts
+
+
+def _peak_overlap(windows: list, always: int) -> int:
+    """Most windows open at once; *windows* are (offset, length, repeat) in seconds, *always* are open throughout."""
+    if not windows:
+        return always
+    period = 1
+    for _, _, repeat in windows:
+        period = math.lcm(period, int(repeat))
+    events = []
+    for offset, length, repeat in windows:
+        for k in range(int(period // repeat)):
+            start = (offset + k * repeat) % period
+            end = start + length
+            if end > period:  # wraps around the end of the period
+                events += [(start, 1), (period, -1), (0, 1), (end - period, -1)]
+            else:
+                events += [(start, 1), (end, -1)]
+    # Ends sort before starts at the same instant: back-to-back slots don't overlap
+    events.sort()
+    peak = current = 0
+    for _, delta in events:
+        current += delta
+        peak = max(peak, current)
+    return peak + always
+
+
+def analyze_config(config: dict, assumed_rate_bps: float = parse_size(DEFAULT_ASSUMED_RATE)) -> dict:
+    """
+    Estimate what a psconfig costs each address, from its tasks, tests and
+    schedules:
+
+      throughput_s_per_hour  seconds per hour in throughput tests (incl. omit)
+      duty_cycle             the same as a fraction of the hour
+      peak_concurrent        most throughput tests that can run at once; a
+                             run may start anywhere in its slip, and tasks
+                             without a fixed start (sliprand) may overlap any
+      bytes_per_day          estimated test traffic, throughput at
+                             *assumed_rate_bps*
+
+    Returns {"hosts": {name: {...}}, "tasks": N, "throughput_tasks": N}.
+    """
+    hosts = {name: {"throughput_s_per_hour": 0.0, "bytes_per_day": 0.0} for name in config.get("addresses", {})}
+    windows = {name: [] for name in hosts}
+    always = dict.fromkeys(hosts, 0)
+    throughput_tasks = 0
+
+    @functools.lru_cache(maxsize=None)
+    def _timing(test_name, schedule_name):
+        """(repeat, run seconds, window length, fixed offset or None) of a test on a schedule."""
+        spec = config["tests"][test_name].get("spec", {})
+        schedule = config.get("schedules", {}).get(schedule_name, {})
+        repeat = iso_duration_seconds(schedule["repeat"]) if "repeat" in schedule else None
+        run_s = iso_duration_seconds(spec.get("duration", "PT10S")) + iso_duration_seconds(spec.get("omit", "PT0S"))
+        window = iso_duration_seconds(schedule.get("slip", "PT0S")) + run_s
+        offset = None
+        if repeat and "start" in schedule and not schedule.get("sliprand") and window < repeat:
+            start = datetime.fromisoformat(schedule["start"].replace("Z", "+00:00"))
+            offset = start.timestamp() % repeat
+        return repeat, run_s, window, offset
+
+    for task in config.get("tasks", {}).values():
+        if task.get("disabled"):
+            continue
+        test_type = config["tests"][task["test"]]["type"]
+        repeat, run_s, window, offset = _timing(task["test"], task.get("schedule"))
+
+        if test_type == "latencybg":
+            for name, pairs in _participation(config, task["group"]).items():
+                hosts[name]["bytes_per_day"] += pairs * LATENCYBG_BYTES_PER_SECOND * 86400
+            continue
+        if repeat is None:
+            continue  # one-off
+        runs_per_day = 86400 / repeat
+
+        if test_type != "throughput":
+            per_run = TEST_BYTES_PER_RUN.get(test_type, 0)
+            for name, pairs in _participation(config, task["group"]).items():
+                hosts[name]["bytes_per_day"] += pairs * per_run * runs_per_day
+            continue
+
+        throughput_tasks += 1
+        busy_s_per_hour = run_s * 3600 / repeat
+        bytes_per_day = assumed_rate_bps * run_s / 8 * runs_per_day
+        for a, b in group_pairs(config, task["group"]):
+            for name in (a, b):
+                host = hosts[name]
+                host["throughput_s_per_hour"] += busy_s_per_hour
+                host["bytes_per_day"] += bytes_per_day
+                if offset is not None:
+                    windows[name].append((offset, window, repeat))
+                else:
+                    always[name] += 1
+
+    for name, host in hosts.items():
+        host["duty_cycle"] = host["throughput_s_per_hour"] / 3600
+        host["peak_concurrent"] = _peak_overlap(windows[name], always[name])
+    return {"hosts": hosts, "tasks": len(config.get("tasks", {})), "throughput_tasks": throughput_tasks}
+
+
+def check_limits(analysis: dict, max_duty_cycle: float = None, max_concurrent: int = None,
+                 max_bytes_per_day: float = None) -> list[str]:
+    """Return one message per address and limit exceeded (empty when within all limits)."""
+    problems = []
+    for name, host in analysis["hosts"].items():
+        if max_duty_cycle is not None and host["duty_cycle"] > max_duty_cycle:
+            problems.append(f"{name}: throughput duty cycle {host['duty_cycle']:.1%} exceeds {max_duty_cycle:.1%}")
+        if max_concurrent is not None and host["peak_concurrent"] > max_concurrent:
+            problems.append(f"{name}: up to {host['peak_concurrent']} concurrent throughput tests, limit {max_concurrent}")
+        if max_bytes_per_day is not None and host["bytes_per_day"] > max_bytes_per_day:
+            problems.append(f"{name}: ~{host['bytes_per_day'] / 1e9:.2f} GB/day exceeds {max_bytes_per_day / 1e9:.2f} GB/day")
+    return problems
+
+
+def format_analysis(analysis: dict) -> str:
+    lines = [f"{analysis['tasks']} tasks, {analysis['throughput_tasks']} throughput",
+             f"{'host':<24} {'thrpt s/h':>10} {'duty':>7} {'peak':>5} {'GB/day':>9}"]
+    for name, host in sorted(analysis["hosts"].items()):
+        lines.append(f"{name:<24} {host['throughput_s_per_hour']:>10.1f} {host['duty_cycle']:>7.1%} "
+                     f"{host['peak_concurrent']:>5} {host['bytes_per_day'] / 1e9:>9.3f}")
+    return "\n".join(lines)
+
+def bench_output(base_config_file: str, hosts: int = 200, topology: str = "mesh") -> list[dict]:
+    """
+    Build a synthetic *hosts*-address config in the standard and the compact
+    form; returns per form the output size and the build, serialize and
+    parse (json.loads, as the agent does) times.
+    """
+    host_list = [(f"host{i}", f"10.{i // 65536 % 256}.{i // 256 % 256}.{i % 256}") for i in range(hosts)]
+    results = []
+    for compact in (False, True):
+        builder = PSConfigBuilder(base_config_file, compact=compact)
+        started = time.perf_counter()
+        config = builder.build_config(host_list, remote="archive.example.org", topology=topology)
+        built = time.perf_counter()
+        text = dump_config(config, compact)
+        dumped = time.perf_counter()
+        json.loads(text)
+        parsed = time.perf_counter()
+        results.append({"form": "compact" if compact else "standard", "bytes": len(text.encode()),
+                        "build_s": built - started, "dump_s": dumped - built, "parse_s": parsed - dumped})
+    return results
 
-        # Write the updated config to the output file
-        with open(self.output_file, "w") as f:
-            json.dump(config, f, indent=4)
 
 if __name__ == "__main__":
     # Parse command line arguments for source/destination info and config file paths
@@ -259,10 +820,45 @@ if __name__ == "__main__":
     parser.add_argument("--parallel_streams", type=int, help="Number of parallel streams for throughput tests")
     parser.add_argument("--no_add_tests", action="store_false", dest="add_tests",
                         help="If set, only update addresses/groups without adding tests")
-    parser.add_argument("--schedule_interval", type=str, choices=["10M", "2H", "4H", "6H"], default="10M",
+    parser.add_argument("--schedule_interval", type=str, choices=list(VALID_INTERVALS), default="10M",
                         help="Schedule interval for tests (default: 10M)")
+    parser.add_argument("--topology", choices=TOPOLOGIES, default="pair",
+                        help="Pairs to test: the first two addresses, every pair (mesh) or hub to all (star) (default: pair)")
+    parser.add_argument("--hub", type=str, help="Hub address name for --topology star (default: the first address)")
+    parser.add_argument("--throughput_slot", type=int, default=DEFAULT_THROUGHPUT_SLOT,
+                        help=f"Seconds reserved per throughput run (default: {DEFAULT_THROUGHPUT_SLOT})")
+    parser.add_argument("--slot_anchor", type=str, default=DEFAULT_SLOT_ANCHOR,
+                        help=f"UTC instant throughput slots are offset from (default: {DEFAULT_SLOT_ANCHOR})")
+    parser.add_argument("--compact", action="store_true",
+                        help="Compact output for large meshes: archives attached once through a shared host entry, "
+                             "no per-pair display references, minified JSON")
+    parser.add_argument("--bench", type=int, metavar="HOSTS",
+                        help="Compare output size and build/serialize/parse time of the standard and compact forms "
+                             "for a synthetic HOSTS-address mesh (or --topology star), then exit")
+    parser.add_argument("--incremental", action="store_true",
+                        help="Update the existing output file: only changed entries are rewritten, throughput pairs "
+                             "keep their slots, and the changes are listed")
+    parser.add_argument("--analyze", nargs="?", const="", metavar="PSCONFIG",
+                        help="Report per-host throughput duty cycle, concurrent-test peak and bytes/day of the "
+                             "generated config (before writing it), or of an existing PSCONFIG file")
+    parser.add_argument("--assumed_rate", type=str, default=DEFAULT_ASSUMED_RATE,
+                        help=f"Throughput (bits/s) assumed for the bytes/day estimate, e.g. 1G (default: {DEFAULT_ASSUMED_RATE})")
+    parser.add_argument("--max_duty_cycle", type=float, help="Limit: percent of each hour a host may spend in throughput tests")
+    parser.add_argument("--max_concurrent", type=int, default=1,
+                        help="Limit: concurrent throughput tests per host (default: 1)")
+    parser.add_argument("--max_bytes_per_day", type=str, help="Limit: estimated test traffic per host per day, e.g. 5G")
+    parser.add_argument("--on_limit", choices=["reject", "warn"], default="reject",
+                        help="With --analyze, refuse to write (and exit 1) or only warn when a limit is exceeded (default: reject)")
     args = parser.parse_args()
 
+    if args.bench:
+        results = bench_output(args.base_config_file, args.bench, "star" if args.topology == "star" else "mesh")
+        for result in results:
+            print(f"{result['form']:<9} {result['bytes'] / 1e6:>9.2f} MB  build {result['build_s']:.3f}s  "
+                  f"dump {result['dump_s']:.3f}s  parse {result['parse_s']:.3f}s")
+        print(f"compact/standard size: {results[1]['bytes'] / results[0]['bytes']:.1%}")
+        sys.exit(0)
+
     # Convert flat host_list argument to list of tuples
     # Example: ["host1", "1.2.3.4", "host2", "5.6.7.8"] -> [("host1", "1.2.3.4"), ("host2", "5.6.7.8")]
     if args.host_list:
@@ -271,11 +867,47 @@ if __name__ == "__main__":
         args.host_list = [(args.host_list[i], args.host_list[i+1]) for i in range(0, len(args.host_list), 2)]
 
     # Create builder and add tests based on arguments
-    builder = PSConfigBuilder(base_config_file=args.base_config_file, output_file=args.output_file)
-    builder.add_tests(
+    builder = PSConfigBuilder(base_config_file=args.base_config_file, output_file=args.output_file, compact=args.compact)
+    build_args = dict(
         host_list=args.host_list,
         parallel_streams=args.parallel_streams,
         remote=args.remote,
         add_tests=args.add_tests,
-        schedule_interval=args.schedule_interval
-    )
\ No newline at end of file
+        schedule_interval=args.schedule_interval,
+        topology=args.topology,
+        hub=args.hub,
+        throughput_slot=args.throughput_slot,
+        slot_anchor=args.slot_anchor
+    )
+
+    if args.analyze is None:
+        if args.incremental:
+            print(format_diff(builder.update_tests(**build_args)))
+        else:
+            builder.add_tests(**build_args)
+        sys.exit(0)
+
+    # Analysis mode: an existing file, or the generated config before it is written
+    current = builder.load_output() if args.incremental else None
+    if args.analyze:
+        with open(args.analyze) as f:
+            config = json.load(f)
+    else:
+        config = builder.build_config(current=current, **build_args)
+    analysis = analyze_config(config, parse_size(args.assumed_rate))
+    print(format_analysis(analysis))
+    problems = check_limits(
+        analysis,
+        max_duty_cycle=args.max_duty_cycle / 100 if args.max_duty_cycle is not None else None,
+        max_concurrent=args.max_concurrent,
+        max_bytes_per_day=parse_size(args.max_bytes_per_day) if args.max_bytes_per_day else None,
+    )
+    for problem in problems:
+        print(f"{'ERROR' if args.on_limit == 'reject' else 'WARNING'}: {problem}", file=sys.stderr)
+    if problems and args.on_limit == "reject":
+        sys.exit(1)
+    if not args.analyze:
+        if args.incremental:
+            print(format_diff(builder.update_config(config, current)))
+        else:
+            builder.write_config(config)
@@ -0,0 +1,5 @@
+import os
+import sys
+
+# archive_export.py is a standalone script in native/, not a package
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
@@ -0,0 +1,127 @@
+"""
+Minimal OpenSearch/Elasticsearch stand-in on http.server, covering what
+archive_export.py uses: opening and closing a point-in-time (PIT) and
+sliced, search_after-paged POST /_search over an in-memory index.
+
+*flavour* picks the PIT API: "opensearch" (/_search/point_in_time, sorted
+with an _id tiebreaker) or "elasticsearch" (/_pit, _shard_doc tiebreaker;
+the OpenSearch endpoint answers 404 so the client falls back).
+"""
+import json
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+
+class _Server(ThreadingHTTPServer):
+    daemon_threads = True
+
+
+class SearchStandIn:
+    """
+    Serve *docs* (dicts with an integer *time_field*, epoch ms) on 127.0.0.1:
+
+        with SearchStandIn(docs, fail_after=2) as search:
+            client = SearchClient(search.base_url)
+
+    Documents go to slice ``doc[time_field] % max``. With *fail_after*, every
+    search after that many answers HTTP 400. *searches* keeps each search
+    body, *opened* and *closed* the PIT ids.
+    """
+
+    def __init__(self, docs, flavour="opensearch", time_field="@timestamp", fail_after=None):
+        self.flavour = flavour
+        self.time_field = time_field
+        self.fail_after = fail_after
+        self.hits = [{"_index": "pscheduler_test", "_id": f"doc-{i}", "_source": doc} for i, doc in enumerate(docs)]
+        self.searches = []
+        self.opened = []
+        self.closed = []
+        self._lock = threading.Lock()
+        self._server = _Server(("127.0.0.1", 0), self._handler())
+        self.base_url = f"http://127.0.0.1:{self._server.server_port}"
+        self._thread = None
+
+    def _sort_key(self, hit):
+        position = self.hits.index(hit) if self.flavour == "elasticsearch" else hit["_id"]
+        return [hit["_source"][self.time_field], position]
+
+    def search(self, body):
+        """The hits one POST /_search returns for *body*."""
+        with self._lock:
+            if self.fail_after is not None and len(self.searches) >= self.fail_after:
+                return 400, {"error": "search_phase_execution_exception"}
+            self.searches.append(body)
+            if body["pit"]["id"] not in self.opened or body["pit"]["id"] in self.closed:
+                return 404, {"error": "search_context_missing_exception"}
+        hits = self.hits
+        if "slice" in body:
+            field, sid, smax = body["slice"]["field"], body["slice"]["id"], body["slice"]["max"]
+            hits = [hit for hit in hits if hit["_source"][field] % smax == sid]
+        for clause in body["query"].get("bool", {}).get("filter", []):
+            bound = clause.get("range", {}).get(self.time_field, {}).get("gte")
+            if isinstance(bound, int):
+                hits = [hit for hit in hits if hit["_source"][self.time_field] >= bound]
+        hits = sorted(({**hit, "sort": self._sort_key(hit)} for hit in hits), key=lambda hit: hit["sort"])
+        if "search_after" in body:
+            hits = [hit for hit in hits if hit["sort"] > body["search_after"]]
+        return 200, {"hits": {"hits": hits[:body["size"]]}}
+
+    def _handler(self):
+        standin = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def log_message(self, fmt, *args):
+                pass
+
+            def _reply(self, status, body):
+                data = json.dumps(body).encode()
+                self.send_response(status)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(data)))
+                self.end_headers()
+                self.wfile.write(data)
+
+            def _body(self):
+                length = int(self.headers.get("Content-Length", 0))
+                return json.loads(self.rfile.read(length)) if length else None
+
+            def _open_pit(self, key):
+                with standin._lock:
+                    pit_id = f"pit-{len(standin.opened) + 1}"
+                    standin.opened.append(pit_id)
+                self._reply(200, {key: pit_id})
+
+            def do_POST(self):
+                path = self.path.split("?")[0]
+                body = self._body()
+                if path == "/_search":
+                    return self._reply(*standin.search(body))
+                if path.endswith("/_search/point_in_time") and standin.flavour == "opensearch":
+                    return self._open_pit("pit_id")
+                if path.endswith("/_pit") and standin.flavour == "elasticsearch":
+                    return self._open_pit("id")
+                self._reply(404, {"error": "no handler"})
+
+            def do_DELETE(self):
+                body = self._body() or {}
+                ids = body.get("pit_id") or [body.get("id")]
+                with standin._lock:
+                    standin.closed.extend(ids)
+                self._reply(200, {"succeeded": True})
+
+        return Handler
+
+    def start(self):
+        self._thread = threading.Thread(target=self._server.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._server.shutdown()
+        self._server.server_close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.stop()
@@ -0,0 +1,72 @@
+import gzip
+import json
+from types import SimpleNamespace
+
+import pytest
+
+import archive_export
+from search_standin import SearchStandIn
+
+T0 = 1_792_368_000_000
+
+
+def _docs(n=23):
+    # Pairs share a timestamp, so paging relies on the tiebreaker
+    return [{"@timestamp": T0 + i // 2, "n": i} for i in range(n)]
+
+
+def _args(tmp_path, slices, size):
+    return SimpleNamespace(
+        index="pscheduler*", time_from="2026-10-19T00:00:00Z", time_to="2026-10-20T00:00:00Z",
+        time_field="@timestamp", slices=slices, slice_field="@timestamp", size=size, keep_alive="1m",
+        parts_dir=str(tmp_path / "dump.parts"), outfile=str(tmp_path / "dump.ndjson.gz"), keep_parts=False,
+    )
+
+
+def _exported(path):
+    with gzip.open(path, "rt") as f:
+        return [json.loads(line) for line in f]
+
+
+@pytest.mark.parametrize("flavour", ["opensearch", "elasticsearch"])
+def test_export_pages_every_slice(tmp_path, flavour):
+    docs = _docs()
+    args = _args(tmp_path, slices=3, size=2)
+    with SearchStandIn(docs, flavour=flavour) as search:
+        states = archive_export.export(archive_export.SearchClient(search.base_url), args, log=lambda msg: None)
+
+    assert sorted(doc["n"] for doc in _exported(args.outfile)) == list(range(len(docs)))
+    assert [state["docs"] for state in states] == [
+        sum(1 for doc in docs if doc["@timestamp"] % 3 == i) for i in range(3)]
+    by_slice = {}
+    for body in search.searches:
+        by_slice.setdefault(body["slice"]["id"], []).append(body)
+    assert sorted(by_slice) == [0, 1, 2]
+    for bodies in by_slice.values():
+        # Several pages per slice, each continuing after the previous one
+        assert len(bodies) > 2
+        assert "search_after" not in bodies[0]
+        assert all("search_after" in body for body in bodies[1:])
+    assert search.closed == search.opened == ["pit-1"]
+
+
+def test_export_single_slice_has_no_slice_clause(tmp_path):
+    args = _args(tmp_path, slices=1, size=5)
+    with SearchStandIn(_docs()) as search:
+        archive_export.export(archive_export.SearchClient(search.base_url), args, log=lambda msg: None)
+
+    assert len(_exported(args.outfile)) == 23
+    assert all("slice" not in body for body in search.searches)
+    assert len(search.searches) == 5
+
+
+def test_pit_closed_when_a_search_fails(tmp_path):
+    args = _args(tmp_path, slices=2, size=2)
+    with SearchStandIn(_docs(), fail_after=3) as search:
+        with pytest.raises(archive_export.SearchError) as failed:
+            archive_export.export(archive_export.SearchClient(search.base_url), args, log=lambda msg: None)
+
+    assert failed.value.status == 400
+    assert search.closed == search.opened == ["pit-1"]
+    # The parts and checkpoints stay for a resume
+    assert (tmp_path / "dump.parts" / "export.json").exists()